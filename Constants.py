@@ -20,6 +20,8 @@ import math
 #       ~ time = params[7]
 #       ~ values = params[8]
 #       ~ desc = params[9] i.e. "StepwiseHashRate"
+# seed = params[8] (optional, after hRate in the list simulation actually takes; None = OS entropy)
+# windowOnly = params[9] (optional, keep only the difficulty window of the chain in memory)
 
 MAX_RUN_TIME = 4000000.0
 LAMBDA_TARGET = 1.0/60.0
@@ -45,10 +47,110 @@ TIME_SAMPLE_SIZE = 72
 TIME_SAMPLE_SIZE_BITCOIN = 11
 TIME_SAMPLE_SIZE_BITMONERO = 60
 
+OUTPUT_FILE_NAME = "data/output.csv"
+OUTPUT_FORMAT = "text" # "text" (tab-separated, written at the end) or "npy" (columns streamed during the run)
+OUTPUT_CHUNK_RECORDS = 65536 # Blocks per chunk written by a chainWriter
+# Online metrics of the per-block error, kept during the run (see onlineMetrics.py).
+ONLINE_METRICS = False
+METRICS_CHUNK_RECORDS = 4096 # Blocks queued before the statistics are updated
+METRICS_QUANTILES = [0.5, 0.9, 0.99]
+METRICS_QUANTILE_ACCURACY = 0.01 # Relative accuracy of the quantile sketch
+RECOVERY_TOLERANCE = 0.1 # Error at most this counts as recovered from a hash rate change...
+RECOVERY_BLOCKS = 10 # ...once this many blocks in a row are within it
+
+# Instrumentation of runs (see instrumentation.py): counters and per-phase timers, optionally
+# with cProfile and tracemalloc, summarized in outputFileName + INSTRUMENTATION_SUFFIX.
+INSTRUMENT = False
+PROFILE_RUN = False
+TRACE_MEMORY = False
+PROFILE_TOP_ENTRIES = 25 # Functions and allocation sites listed in the summary
+INSTRUMENTATION_SUFFIX = ".profile.txt"
+
+CHECKPOINT_FILE_NAME = None # e.g. "data/checkpoint.npz" to checkpoint runs periodically
+CHECKPOINT_INTERVAL = 30.0*86400.0 # Simulated seconds between checkpoints
+REPLAY_CHUNK_RECORDS = 65536 # Blocks of a replayed timestamp column handled per chunk
+SWEEP_DIRECTORY = "sweep" # Each sweep cell runs in its own subdirectory of this
+BENCHMARK_DIRECTORY = "benchmarks" # Baselines written by benchmark.py
+
+# Chain storage: blocks preallocated per blockChain, and whether to keep only the last
+# max(diffSampleSize, timeSampleSize) blocks in memory.
+CHAIN_INITIAL_CAPACITY = 4096
+CHAIN_WINDOW_ONLY = False
+
+# Random streams: None seeds from OS entropy; any int makes runs bit-exactly reproducible.
+RANDOM_SEED = None
+RANDOM_BLOCK_SIZE = 65536 # Exponentials pre-drawn per refill of a randomStream
+BATCH_RANDOM_BLOCK_SIZE = 256 # Per-replica exponentials pre-drawn by a batchRandomStream
+
+# Epoch leaps: while neither difficulty nor hash rate can change, draw all block arrivals up to
+# the next difficulty recomputation or hash changepoint at once. Runs with fewer blocks than
+# EPOCH_LEAP_MIN_BLOCKS to go take ordinary steps instead.
+EPOCH_LEAP = True
+EPOCH_LEAP_MIN_BLOCKS = 16
+
+# Integrated arrivals: draw each block's arrival time by inverting the cumulative hash count
+# instead of stopping at every hash changepoint. Same distribution, different (seeded) sample
+# paths than the default accept/reject steps; much faster for dense hash rate traces.
+INTEGRATED_ARRIVALS = False
+
+# Timestamps: the policy miners stamp blocks with (see timestampPolicies.py) and its parameters.
+# The network ignores a block stamped at or below the median of the last timeSampleSize
+# timestamps, or more than MAX_FUTURE_BLOCK_TIME seconds ahead of network time.
+TIMESTAMP_POLICY = "honest"
+TIMESTAMP_POLICY_PARAMS = []
+TIMESTAMP_SKEW = 600.0 # Default clock offset of the "skewed" policy, in seconds
+TIMESTAMP_ATTACKER_SHARE = 0.25 # Default share of blocks found by the attacker of the drift policies
+MAX_FUTURE_BLOCK_TIME = 7200
+
+# Miners: reward credited to the finder of each block when the hash rate is split between the
+# miners of a minerNetwork (see miners.py).
+MINER_BLOCK_REWARD = 1.0
+
+BATCH_REPLICAS = 1000 # Number of independent chains advanced in lockstep by batchSimulation
+
+# Algorithm comparisons (see comparison.py): replications, summary metrics compared, confidence
+# level of the intervals on their differences, and where the tables are written.
+COMPARISON_REPLICATIONS = 32
+COMPARISON_METRICS = ["rmsError", "meanError", "meanBlockTime"]
+CONFIDENCE_LEVEL = 0.95
+COMPARISON_DIRECTORY = "comparison"
+
+# Adaptive replication (see adaptiveReplication.py): a scenario is replicated until the
+# confidence interval of every target metric is at most its width (relative to the metric's mean
+# with ADAPTIVE_RELATIVE_WIDTHS), or until ADAPTIVE_MAX_REPLICATIONS replications.
+ADAPTIVE_TARGETS = {"meanError": 0.05}
+ADAPTIVE_RELATIVE_WIDTHS = True
+ADAPTIVE_MIN_REPLICATIONS = 8
+ADAPTIVE_MAX_REPLICATIONS = 256
+ADAPTIVE_DIRECTORY = "replications"
+
+# Result cache (see resultCache.py): directory of cached runs, and the size they are kept under
+# by evicting the least recently used ones.
+RESULT_CACHE_DIRECTORY = "cache"
+RESULT_CACHE_MAX_BYTES = 1 << 30
+
+# Job ledgers (see jobLedger.py): a claimed sweep cell goes back to the queue when its worker has
+# not sent a heartbeat for LEDGER_LEASE_SECONDS, and is given up on after LEDGER_MAX_ATTEMPTS.
+LEDGER_LEASE_SECONDS = 300.0
+LEDGER_HEARTBEAT_SECONDS = 30.0
+LEDGER_MAX_ATTEMPTS = 3
+
+# Lazy hash rates: segments drawn per chunk, and chunks kept in memory at once.
+HASHRATE_CHUNK_SEGMENTS = 4096
+HASHRATE_CACHED_CHUNKS = 4
+
 TIME_EXAMPLE   = [0.0,  11.0,   100.0, 250.0, 375.1, 478.0]
 VALUES_EXAMPLE = [18.7, 364.2, 841.2, 241.8, 906.8]
 DESC_EXAMPLE = "StepwiseHashrate"
 
+# Logging: level shared by every log ("TRACE" writes per-block messages), records buffered per
+# log file before writing, and whether a background thread does the writing instead.
+LOG_LEVEL = "INFO"
+LOG_DIRECTORY = "logs"
+LOG_BUFFER_RECORDS = 4096
+LOG_BACKGROUND = False
+
 HASHRATE_LOGFILE = "logs/hashRateLog.log"
 BLOCKCHAIN_LOGFILE = "logs/blockChainLog.log"
 SIMULATION_LOGFILE = "logs/simulationLog.log"
+BATCH_LOGFILE = "logs/batchSimulationLog.log"
@@ -0,0 +1,255 @@
+"""
+Adaptive replication: as many runs of each scenario as its metrics need, and no more.
+
+Rather than a fixed number of replications per scenario, replicateScenarios runs rounds of
+replications over a pool of processes and keeps the running mean and variance (Welford's
+algorithm) of the target metrics of every scenario, i.e. summary keys of simulation.getSummary
+such as meanError (the mean absolute relative error) or meanRecoveryTime (the time to recover
+after a hash rate step). A scenario stops:
+
+    ~ with "precision", once it has at least minReplications replications and the confidence
+      interval of every target metric is no wider than its target (a fraction of the metric's
+      mean with relative set, an absolute width otherwise);
+    ~ with "budget", after maxReplications replications, whatever its precision.
+
+Each round hands out batchSize replications (one per worker by default) between the scenarios
+still running, in proportion to how many more replications their widest interval is projected
+to need (the width shrinks as one over the square root of the count), with at least one each.
+Cheap, quiet scenarios stop early, and the cores go to the volatile ones.
+
+A metric still unreported after minReplications is taken not to apply to the scenario (a
+recovery time without hash rate changes, say) and does not hold it up. Replication r of a
+scenario always runs with seed [entropy of seed, r], whichever round it lands
+in, and each round is folded in replication order once it is over, so results only depend on the
+seed; a lazy hash rate without a seed of its own gets the same seed (scenario.seedScenario), so
+each replication draws its own path reproducibly. Runs that do not report a metric do not count
+towards its interval.
+
+The precision achieved by every scenario is returned and written to
+outputDirectory/precision.csv, and every replication to outputDirectory/replications.csv.
+
+From the shell:
+
+    python adaptiveReplication.py steady.toml step.json --target meanError=0.02 meanRecoveryTime=0.1 -p 8
+"""
+from scenario import *
+from sweep import *
+from comparison import *
+from simLog import *
+from Constants import *
+
+import argparse
+import errno
+import math
+import multiprocessing
+import os
+import time
+
+
+class runningMoments:
+    """ Count, mean and variance of a stream of observations (Welford's algorithm). """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.squares = 0.0 # Sum of squared deviations from the mean
+
+    def add(self, x):
+        self.count = self.count + 1
+        delta = x - self.mean
+        self.mean = self.mean + delta/self.count
+        self.squares = self.squares + delta*(x - self.mean)
+
+    def variance(self):
+        """ Sample variance, or None below two observations. """
+        return self.squares/(self.count - 1) if self.count > 1 else None
+
+    def halfWidth(self, confidence=CONFIDENCE_LEVEL):
+        """ Half width of the confidence interval on the mean, or None below two observations. """
+        variance = self.variance()
+        if(variance == None):
+            return None
+        return confidenceHalfWidth(math.sqrt(variance/self.count), confidence)
+
+###########################################################
+
+def runReplication(job):
+    """ Run replication r of a scenario and return its row of metrics. Runs in a worker process. """
+    index, replication, scenario, metrics, outputDirectory = job
+    logDirectory = os.path.join(outputDirectory, "logs", "scenario" + str(index).zfill(3) + "rep" + str(replication).zfill(5))
+    start = time.time()
+    s = makeSimulation(dict(scenario, collectMetrics=True, verbose=False, outputFileName=None, checkpointFileName=None, windowOnly=True, logDirectory=logDirectory))
+    s.runSim()
+    summary = s.getSummary()
+    closeAllLogs()
+    row = {"scenario": index, "replication": replication}
+    row.update((metric, summary[metric]) for metric in metrics if metric in summary)
+    row["wallTime"] = time.time() - start
+    return row
+
+###########################################################
+
+class scenarioTracker:
+    """ Running moments of the target metrics of one scenario, and when to stop it. """
+
+    def __init__(self, index, scenario, seed, targets, relative, confidence, minReplications, maxReplications):
+        self.index = index
+        self.scenario = scenario
+        self.name = scenario.get("name", "scenario" + str(index))
+        self.seeds = replicationSeeds(seed, maxReplications)
+        self.targets = targets
+        self.relative = relative
+        self.confidence = confidence
+        self.minReplications = minReplications
+        self.maxReplications = maxReplications
+        self.moments = dict((metric, runningMoments()) for metric in targets)
+        self.launched = 0
+        self.completed = 0
+        self.wallTime = 0.0
+        self.stopped = None # "precision" or "budget" once done
+
+    def jobs(self, n, outputDirectory):
+        """ The next n replications of this scenario as runReplication jobs. """
+        replications = range(self.launched, self.launched + n)
+        self.launched = self.launched + n
+        return [(self.index, r, seedScenario(self.scenario, self.seeds[r]), list(self.targets), outputDirectory) for r in replications]
+
+    def add(self, row):
+        self.completed = self.completed + 1
+        self.wallTime = self.wallTime + row["wallTime"]
+        for metric, moments in self.moments.items():
+            if(metric in row and row[metric] == row[metric]): # Skip NaN
+                moments.add(row[metric])
+
+    def targetHalfWidth(self, metric):
+        target = 0.5*self.targets[metric]
+        return target*abs(self.moments[metric].mean) if self.relative else target
+
+    def needed(self):
+        """ Further replications projected to bring every interval down to its target. """
+        if(self.completed < self.minReplications):
+            return self.minReplications - self.completed
+        needed = 0
+        for metric, moments in self.moments.items():
+            if(moments.count == 0):
+                continue # A metric this scenario never reports, like recoveries without changepoints
+            halfWidth = moments.halfWidth(self.confidence)
+            target = self.targetHalfWidth(metric)
+            if(halfWidth == None or target <= 0.0):
+                needed = max(needed, self.minReplications) # Nothing to project from yet
+            elif(halfWidth > target):
+                needed = max(needed, int(math.ceil(moments.count*(halfWidth/target)**2)) - moments.count, 1)
+        return needed
+
+    def update(self):
+        """ Decide whether to stop after the replications completed so far. """
+        if(self.completed >= self.minReplications and self.needed() == 0):
+            self.stopped = "precision"
+        elif(self.completed >= self.maxReplications):
+            self.stopped = "budget"
+
+    def getPrecision(self):
+        """ One row per target metric: estimate, interval, target and whether it was met. """
+        rows = []
+        for metric, moments in self.moments.items():
+            row = {"scenario": self.name, "metric": metric, "replications": self.completed, "observations": moments.count, "stopped": self.stopped, "wallTime": self.wallTime}
+            halfWidth = moments.halfWidth(self.confidence)
+            if(moments.count > 0):
+                row["mean"] = moments.mean
+            if(halfWidth != None):
+                row.update({"lower": moments.mean - halfWidth, "upper": moments.mean + halfWidth, "width": 2.0*halfWidth})
+                row["relativeWidth"] = 2.0*halfWidth/abs(moments.mean) if moments.mean != 0.0 else float("inf")
+            row["targetWidth"] = 2.0*self.targetHalfWidth(metric)
+            row["met"] = halfWidth != None and halfWidth <= self.targetHalfWidth(metric)
+            rows.append(row)
+        return rows
+
+###########################################################
+
+def allocate(trackers, batchSize):
+    """ Split batchSize replications between the running trackers in proportion to what they
+    need, at least one each, without going over anyone's budget. """
+    needs = [(tracker, min(tracker.needed(), tracker.maxReplications - tracker.launched)) for tracker in trackers]
+    needs = [(tracker, need) for tracker, need in needs if need > 0]
+    total = sum(need for tracker, need in needs)
+    if(total <= batchSize):
+        return needs
+    return [(tracker, max(1, (batchSize*need)//total)) for tracker, need in needs]
+
+def replicateScenarios(scenarios, targets=None, relative=ADAPTIVE_RELATIVE_WIDTHS, seed=None, minReplications=ADAPTIVE_MIN_REPLICATIONS, maxReplications=ADAPTIVE_MAX_REPLICATIONS, confidence=CONFIDENCE_LEVEL, outputDirectory=ADAPTIVE_DIRECTORY, processes=None, batchSize=None):
+    """ Replicate every scenario of the list until its target metrics are precise enough or its
+    budget is spent, over a pool of processes (processes=1 runs them in this process), and
+    return the precision table as a list of dictionaries. """
+    if(targets == None):
+        targets = ADAPTIVE_TARGETS
+    if(minReplications < 2):
+        raise ValueError("At least two replications are needed for an interval, got minReplications=" + str(minReplications))
+    for scenario in scenarios:
+        checkScenario(scenario)
+    try:
+        os.makedirs(outputDirectory)
+    except OSError as exception:
+        if exception.errno != errno.EEXIST:
+            raise
+    if(batchSize == None):
+        batchSize = processes if processes != None else multiprocessing.cpu_count()
+
+    trackers = [scenarioTracker(index, scenario, seed, targets, relative, confidence, minReplications, max(minReplications, maxReplications)) for index, scenario in enumerate(scenarios)]
+    rows = []
+    pool = poolContext().Pool(processes) if processes != 1 else None
+    try:
+        running = trackers
+        while(running):
+            jobs = []
+            for tracker, n in allocate(running, batchSize):
+                jobs.extend(tracker.jobs(n, outputDirectory))
+            if(pool == None):
+                results = [runReplication(job) for job in jobs]
+            else:
+                results = pool.map(runReplication, jobs)
+            for row in results:
+                trackers[row["scenario"]].add(row)
+            rows.extend(results)
+            for tracker in running:
+                tracker.update()
+            running = [tracker for tracker in running if tracker.stopped == None]
+    finally:
+        if(pool != None):
+            pool.close()
+            pool.join()
+
+    writeSummary(rows, os.path.join(outputDirectory, "replications.csv"))
+    precision = []
+    for tracker in trackers:
+        precision.extend(tracker.getPrecision())
+    writeSummary(precision, os.path.join(outputDirectory, "precision.csv"))
+    return precision
+
+###########################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replicate scenarios until their metrics reach a target precision.")
+    parser.add_argument("scenarios", nargs="+", help="JSON or TOML scenario files, see scenario.py")
+    parser.add_argument("--target", nargs="+", default=None, metavar="METRIC=WIDTH", help="confidence interval widths to reach (default: " + str(ADAPTIVE_TARGETS) + ")")
+    parser.add_argument("--absolute", action="store_true", help="widths are absolute rather than relative to the means")
+    parser.add_argument("--min", type=int, default=ADAPTIVE_MIN_REPLICATIONS, help="replications before any scenario may stop")
+    parser.add_argument("--max", type=int, default=ADAPTIVE_MAX_REPLICATIONS, help="replication budget of every scenario")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE_LEVEL)
+    parser.add_argument("-o", "--output", default=ADAPTIVE_DIRECTORY, help="directory for the tables and logs")
+    parser.add_argument("-p", "--processes", type=int, default=None, help="worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    targets = None
+    if(args.target != None):
+        targets = dict((item.split("=")[0], float(item.split("=")[1])) for item in args.target)
+    scenarios = []
+    for fileName in args.scenarios:
+        scenario = loadScenario(fileName)
+        scenario.setdefault("name", fileName)
+        scenarios.append(scenario)
+    for row in replicateScenarios(scenarios, targets, not args.absolute, args.seed, args.min, args.max, args.confidence, args.output, args.processes):
+        width = "{:.4g}".format(row["width"]) if "width" in row else "n/a"
+        print(row["scenario"] + " " + row["metric"] + ": " + "{:.6g}".format(row.get("mean", float("nan"))) + ", interval width " + width + " (target " + "{:.4g}".format(row["targetWidth"]) + ") after " + str(row["replications"]) + " replications, stopped on " + str(row["stopped"]))
+
+#####################EOF###################################
@@ -0,0 +1,215 @@
+"""
+Batched Monte Carlo version of the simulation object.
+
+A simulation object advances exactly one blockChain through takeNextStep(). To get a
+distribution of difficulty error for one parameter set we would need thousands of separate
+runs, so a batchSimulation instead advances numReplicas independent chains in lockstep.
+
+The clocks, arrival rates, next difficulties and difficulty windows of every replica are held
+in NumPy arrays. Each step draws exponential inter-arrival times for every live replica at
+once, and the batched kernel of the chain's difficulty algorithm (see difficultyAlgorithms.py)
+is applied to every replica that found a block in that step.
+
+Every replica has its own child random stream, so replica i of batchSimulation(params, n, seed)
+sees the same draws as a simulation whose rng is randomStream(seed).spawn(n)[i], and ends up with
+the same chain bit for bit, for every formula (consistency.checkBatchReplicas checks this).
+
+Each replica follows exactly the same rules as simulation.takeNextStep():
+    ~ the block arrival rate is hashRate(clock)/nextDifficulty,
+    ~ if the candidate arrival comes after the next hash changepoint, roll the clock forward to
+      the changepoint and try again,
+    ~ otherwise roll the clock forward to the arrival and append a block with timestamp
+      ceil(clock), recomputing difficulty with the same difficulty algorithm,
+    ~ stop once the clock reaches maxTime.
+
+The difficulty windows are ring buffers of the algorithm's windowSize blocks, stored as
+(windowSize, numReplicas) arrays, so the window of each replica is a column. Whole chains are only kept if
+retainChains is set, in which case getBlockChain(i) returns an ordinary blockChain object for
+replica i and writeDataToFile(fileName, i) writes it out exactly as the scalar path would.
+"""
+from hashRate import *
+from blockChain import *
+from randomStream import *
+from simLog import *
+from Constants import *
+
+import math
+import numpy
+import os
+import errno
+
+
+class batchSimulation:
+    """ Lockstep simulation of many independent blockchains driven by the same hashRate. """
+
+    ## Class attributes ##
+    ## These cause the default values of specific instances of this class.
+
+    logFileName = BATCH_LOGFILE
+    maxTime = MAX_RUN_TIME
+    lambdaTarget = LAMBDA_TARGET
+    diffForm = DIFFICULTY_FORMULA
+    nextDifficulty = STARTING_DIFFICULTY
+    difficultyAdjustmentPeriod = DIFF_ADJ_PERIOD
+    diffSampleSize = DIFF_SAMPLE_SIZE
+    timeSampleSize = TIME_SAMPLE_SIZE
+    numReplicas = BATCH_REPLICAS
+    retainChains = False
+
+    ###########################################################
+
+    def __init__(self, params=None, numReplicas=None, seed=None, retainChains=None):
+        """ params has the same layout as for the simulation object. """
+        if(params==None or not params):
+            self.hRate = hashRate()
+        else:
+            self.maxTime = params[0]
+            self.lambdaTarget = params[1]
+            self.diffForm = params[2]
+            self.nextDifficulty = params[3]
+            self.difficultyAdjustmentPeriod = params[4]
+            self.diffSampleSize = params[5]
+            self.timeSampleSize = params[6]
+            self.hRate = params[7]
+        if(numReplicas != None):
+            self.numReplicas = numReplicas
+        if(retainChains != None):
+            self.retainChains = retainChains
+
+        # Let an (empty) blockChain resolve the formula specific sample sizes, so that the
+        # replicas use precisely the same windows as the scalar path.
+        self.template = blockChain([[],[],self.lambdaTarget, self.diffForm, self.nextDifficulty, self.diffSampleSize, self.timeSampleSize, self.difficultyAdjustmentPeriod])
+        self.diffSampleSize = self.template.diffSampleSize
+        self.timeSampleSize = self.template.timeSampleSize
+        self.difficultyAdjustmentPeriod = self.template.difficultyAdjustmentPeriod
+        self.algorithm = self.template.algorithm
+
+        self.logFileName = logPath("batchSimulation" + self.diffForm + str(self.maxTime) + "Log.log")
+        self.log = openLog(self.logFileName) # Clear the log file and buffer writes to it
+
+        self.streams = batchRandomStream(seed, self.numReplicas)
+
+        n = self.numReplicas
+        w = self.algorithm.windowSize
+        self.clock = numpy.zeros(n)
+        self.difficulty = numpy.full(n, float(self.nextDifficulty))
+        self.arrivalRate = numpy.ones(n)
+        self.heights = numpy.zeros(n, dtype=numpy.int64)
+        self.windowTimes = numpy.zeros((w, n), dtype=numpy.int64)
+        self.windowDifficulties = numpy.zeros((w, n))
+        self.chainTimes = numpy.zeros((0, n), dtype=numpy.int64)
+        self.chainDifficulties = numpy.zeros((0, n))
+
+    ###########################################################
+
+    def printToLog(self, text, level=INFO):
+        self.log.log(level, text)
+
+    def make_sure_path_exists(self, path):
+        try:
+            os.makedirs(path)
+        except OSError as exception:
+            if exception.errno != errno.EEXIST:
+                raise
+
+    ###########################################################
+
+    def getWindows(self, replicas):
+        """ Return the last windowSize timestamps and difficulties of each replica in
+        chronological order, as (windowSize, len(replicas)) arrays. """
+        w = self.algorithm.windowSize
+        rows = (self.heights[replicas][numpy.newaxis,:] - w + numpy.arange(w)[:,numpy.newaxis]) % w
+        cols = numpy.broadcast_to(replicas, rows.shape)
+        return self.windowTimes[rows, cols], self.windowDifficulties[rows, cols]
+
+    def setNextDifficulty(self, replicas):
+        """ Vectorized blockChain.setNextDifficulty for the replicas that just found a block. """
+        replicas = replicas[self.algorithm.isDue(self.heights[replicas])]
+        if(replicas.size == 0):
+            return
+
+        sampleTimes, sampleDifficulties = self.getWindows(replicas)
+        result = self.algorithm.nextDifficulties(sampleTimes, sampleDifficulties, self.difficulty[replicas])
+        good = ~numpy.isnan(result)
+        self.difficulty[replicas[good]] = result[good]
+        if(not good.all()):
+            self.printToLog("Error in (batchSimulation setNextDifficulty): deltaT computed to be zero or negative for " + str(int((~good).sum())) + " replicas.", ERROR)
+
+    ###########################################################
+
+    def addBlocks(self, replicas, timestamps):
+        """ Append one block to each of the given replicas, then recompute their difficulty. """
+        heights = self.heights[replicas]
+        slots = heights % self.algorithm.windowSize
+        self.windowTimes[slots, replicas] = timestamps
+        self.windowDifficulties[slots, replicas] = self.difficulty[replicas]
+
+        if(self.retainChains):
+            top = int(heights.max())
+            if(top >= len(self.chainTimes)):
+                # Grow the retained chains geometrically so appends are amortized O(1).
+                capacity = max(2*len(self.chainTimes), top + 1, self.algorithm.windowSize)
+                grownTimes = numpy.zeros((capacity, self.numReplicas), dtype=numpy.int64)
+                grownDifficulties = numpy.zeros((capacity, self.numReplicas))
+                grownTimes[:len(self.chainTimes)] = self.chainTimes
+                grownDifficulties[:len(self.chainDifficulties)] = self.chainDifficulties
+                self.chainTimes = grownTimes
+                self.chainDifficulties = grownDifficulties
+            self.chainTimes[heights, replicas] = timestamps
+            self.chainDifficulties[heights, replicas] = self.difficulty[replicas]
+
+        self.heights[replicas] = heights + 1
+        self.setNextDifficulty(replicas)
+
+    ###########################################################
+
+    def takeNextStep(self):
+        """ Advance every live replica by one event (block arrival, hash change or end of
+        simulation). Returns the number of replicas that were still live. """
+        live = numpy.flatnonzero((self.clock >= 0.0) & (self.clock < self.maxTime))
+        if(live.size == 0):
+            return 0
+
+        clock = self.clock[live]
+        self.arrivalRate[live] = self.hRate.getFunctionValues(clock)/self.difficulty[live]
+        tempClock = clock + self.streams.exponentials(live)/self.arrivalRate[live]
+        nextHashTime = self.hRate.getNextChangePoints(clock)
+        nextEventTime = numpy.minimum(numpy.minimum(tempClock, self.maxTime), nextHashTime)
+
+        # Same priority as the scalar path: hash event, then block arrival, then the end.
+        hashWins = (nextEventTime == nextHashTime)
+        blockWins = ~hashWins & (nextEventTime == tempClock)
+        self.clock[live] = numpy.where(hashWins, nextHashTime, numpy.where(blockWins, tempClock, self.maxTime))
+
+        finders = live[blockWins]
+        if(finders.size > 0):
+            self.addBlocks(finders, numpy.ceil(tempClock[blockWins]).astype(numpy.int64))
+        return live.size
+
+    ###########################################################
+
+    def runSim(self):
+        """ Run every replica up to maxTime. """
+        steps = 0
+        while(self.takeNextStep() > 0):
+            steps = steps + 1
+        self.printToLog("MaxTime obtained by all " + str(self.numReplicas) + " replicas after " + str(steps) + " lockstep iterations and " + str(int(self.heights.sum())) + " blocks.")
+
+    ###########################################################
+
+    def getBlockChain(self, replica):
+        """ Return replica's chain as a blockChain object. Requires retainChains. """
+        if(not self.retainChains):
+            self.printToLog("Error in (batchSimulation getBlockChain): chains are not retained, set retainChains to keep them.", ERROR)
+            return False
+        height = int(self.heights[replica])
+        timeChain = [int(x) for x in self.chainTimes[:height, replica]]
+        difficultyChain = [float(x) for x in self.chainDifficulties[:height, replica]]
+        return blockChain([timeChain, difficultyChain, self.lambdaTarget, self.diffForm, float(self.difficulty[replica]), self.diffSampleSize, self.timeSampleSize, self.difficultyAdjustmentPeriod])
+
+    def writeDataToFile(self, fileName, replica):
+        bc = self.getBlockChain(replica)
+        if(bc):
+            return bc.writeDataToFile(fileName, self.hRate)
+
+#####################EOF###################################
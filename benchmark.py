@@ -0,0 +1,252 @@
+"""
+Benchmark suite for simulation throughput, per-block cost and memory.
+
+Every benchmark case is one simulation scenario: a difficulty formula, a window size
+(diffSampleSize), a number of hash rate changepoints and a run length. For each case we report
+
+    ~ blocksPerSecond, simulated blocks per second of simulation.runSim(),
+    ~ setNextDifficultySeconds, mean time of one blockChain.setNextDifficulty() call on a chain
+      at a height where the formula is due,
+    ~ hashRateLookupSeconds and hashRateRandomLookupSeconds, mean time of one
+      hashRate.getFunctionValue() call for forward-moving times (the simulation's access pattern)
+      and for times in random order,
+    ~ peakRSSBytes, the peak resident set size of the process that ran the case,
+    ~ textBlocksPerSecond and npyBlocksPerSecond, output throughput of writeDataToFile and of a
+      chainWriter over the simulated chain.
+
+Each case runs in a fresh worker process, one at a time, so peak RSS belongs to that case alone
+and cases do not compete for cores. Runs are seeded, so every run of a case simulates the same
+blocks and throughputs are comparable from one baseline to the next.
+
+The "quick" suite runs every formula at every window size and every changepoint count for one
+simulated week. The "full" suite adds two-year runs. Formulas with reference sample sizes
+("bitcoin", "bitmonero") ignore the window size, so they are run once per changepoint count.
+
+Results are written as JSON baselines to BENCHMARK_DIRECTORY/<name>.json, and compareBaselines
+lists the metrics that got worse than some tolerance. From the shell:
+
+    python benchmark.py [--suite quick|full] [--name baseline] [--compare benchmarks/old.json]
+"""
+from hashRate import *
+from blockChain import *
+from simulation import *
+from chainWriter import *
+from difficultyAlgorithms import *
+from simLog import *
+from Constants import *
+
+import argparse
+import errno
+import json
+import multiprocessing
+import numpy
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import timeit
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+WINDOW_SIZES = [11, 72, 720, 2016]
+CHANGEPOINT_COUNTS = [1, 16, 1024]
+RUN_TIMES = {"short": 7.0*86400.0, "long": 2.0*365.0*86400.0}
+SUITES = {"quick": ["short"], "full": ["short", "long"]}
+BENCHMARK_SEED = 1
+LOOKUP_CALLS = 100000
+DIFFICULTY_CALLS = 200
+
+# Larger is better for these metrics, smaller is better for every other one.
+THROUGHPUT_METRICS = ["blocksPerSecond", "textBlocksPerSecond", "npyBlocksPerSecond"]
+TIMING_METRICS = ["setNextDifficultySeconds", "hashRateLookupSeconds", "hashRateRandomLookupSeconds", "peakRSSBytes"]
+
+###########################################################
+
+def makeCases(suite="quick"):
+    """ Return the list of benchmark cases of a suite. """
+    cases = []
+    for runTime in SUITES[suite]:
+        for diffForm in sorted(ALGORITHMS):
+            windows = WINDOW_SIZES
+            if(ALGORITHMS[diffForm].fixedSampleSizes != None):
+                windows = [ALGORITHMS[diffForm].fixedSampleSizes[0]]
+            for windowSize in windows:
+                for changepoints in CHANGEPOINT_COUNTS:
+                    cases.append({"diffForm": diffForm, "windowSize": windowSize, "changepoints": changepoints, "runTime": runTime, "maxTime": RUN_TIMES[runTime]})
+    return cases
+
+def describeCase(case):
+    return case["diffForm"] + "-w" + str(case["windowSize"]) + "-c" + str(case["changepoints"]) + "-" + case["runTime"]
+
+def makeHashRate(changepoints, maxTime):
+    """ Hash rate with the given number of changepoints inside (0, maxTime), alternating between
+    1.0 and 2.0 so that difficulty keeps having something to track. """
+    times = [maxTime*float(i)/float(changepoints + 1) for i in range(changepoints + 2)]
+    values = [1.0 + float(i % 2) for i in range(changepoints + 1)]
+    return hashRate([times, values, "Benchmark" + str(changepoints), maxTime])
+
+def makeParams(case, hr):
+    return [case["maxTime"], LAMBDA_TARGET, case["diffForm"], STARTING_DIFFICULTY, DIFF_ADJ_PERIOD, case["windowSize"], TIME_SAMPLE_SIZE, hr, BENCHMARK_SEED]
+
+def peakRSS():
+    """ Peak resident set size of this process in bytes, or None where it cannot be measured. """
+    if(resource == None):
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if(sys.platform == "darwin"):
+        return peak
+    return peak*1024
+
+###########################################################
+
+def timeSetNextDifficulty(case):
+    """ Mean time of one setNextDifficulty call on a chain at the first height where it is due. """
+    bc = blockChain([[],[],LAMBDA_TARGET, case["diffForm"], STARTING_DIFFICULTY, case["windowSize"], TIME_SAMPLE_SIZE, DIFF_ADJ_PERIOD])
+    height = bc.algorithm.windowSize + 1
+    while(not bc.algorithm.isDue(height) and height <= bc.algorithm.windowSize + (bc.difficultyAdjustmentPeriod or 1)):
+        height = height + 1
+    for h in range(height):
+        bc.addBlock(int(h/LAMBDA_TARGET) + 1)
+    return timeit.timeit(bc.setNextDifficulty, number=DIFFICULTY_CALLS)/float(DIFFICULTY_CALLS)
+
+def timeHashRateLookups(hr):
+    """ Mean time of one getFunctionValue call, for forward-moving and for shuffled times. """
+    times = [hr.maxTime*float(i)/float(LOOKUP_CALLS) for i in range(LOOKUP_CALLS)]
+    shuffled = list(times)
+    random.Random(BENCHMARK_SEED).shuffle(shuffled)
+    results = []
+    for sample in [times, shuffled]:
+        hr.cursor = 0
+        lookup = hr.getFunctionValue
+        start = time.perf_counter()
+        for t in sample:
+            lookup(t)
+        results.append((time.perf_counter() - start)/float(LOOKUP_CALLS))
+    return results
+
+def timeOutput(s, directory):
+    """ Blocks per second written by writeDataToFile and by a chainWriter. """
+    start = time.perf_counter()
+    s.writeDataToFile(os.path.join(directory, "output.csv"))
+    textSeconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    writer = chainWriter(os.path.join(directory, "output"), s.hRate, s.lambdaTarget, s.diffForm)
+    timestamps, difficulties = s.bChain.chain.asArrays()
+    for height, (timeStamp, difficulty) in enumerate(zip(timestamps.tolist(), difficulties.tolist())):
+        writer.addBlock(height, timeStamp, difficulty)
+    writer.close()
+    npySeconds = time.perf_counter() - start
+
+    blocks = float(len(timestamps))
+    return blocks/max(textSeconds, 1e-9), blocks/max(npySeconds, 1e-9)
+
+def runCase(case):
+    """ Run one benchmark case and return its row of results. Runs in a fresh worker process. """
+    with tempfile.TemporaryDirectory() as directory:
+        setLogDirectory(os.path.join(directory, "logs"))
+        hr = makeHashRate(case["changepoints"], case["maxTime"])
+        s = simulation(makeParams(case, hr))
+        s.verbose = False
+        s.outputFileName = None
+
+        start = time.perf_counter()
+        s.runSim()
+        wallTime = time.perf_counter() - start
+
+        row = dict(case)
+        row["name"] = describeCase(case)
+        row["blocks"] = len(s.bChain.timeChain)
+        row["wallTime"] = wallTime
+        row["blocksPerSecond"] = row["blocks"]/max(wallTime, 1e-9)
+        row["setNextDifficultySeconds"] = timeSetNextDifficulty(case)
+        row["hashRateLookupSeconds"], row["hashRateRandomLookupSeconds"] = timeHashRateLookups(hr)
+        row["textBlocksPerSecond"], row["npyBlocksPerSecond"] = timeOutput(s, directory)
+        row["peakRSSBytes"] = peakRSS()
+        closeAllLogs()
+    return row
+
+###########################################################
+
+def runBenchmarks(suite="quick", cases=None, verbose=True):
+    """ Run every case of a suite (or the given cases), each in a fresh process, and return the
+    baseline: a dictionary describing the machine together with one row of results per case. """
+    if(cases == None):
+        cases = makeCases(suite)
+    rows = []
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for row in pool.imap(runCase, cases):
+            if(verbose):
+                print(row["name"] + ": " + str(int(row["blocksPerSecond"])) + " blocks/s")
+            rows.append(row)
+    return {"suite": suite,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "results": rows}
+
+def writeBaseline(baseline, name, directory=BENCHMARK_DIRECTORY):
+    """ Write a baseline to directory/name.json and return the file name. """
+    try:
+        os.makedirs(directory)
+    except OSError as exception:
+        if exception.errno != errno.EEXIST:
+            raise
+    fileName = os.path.join(directory, name + ".json")
+    with open(fileName, "w") as w:
+        json.dump(baseline, w, indent=1, sort_keys=True)
+    return fileName
+
+def loadBaseline(fileName):
+    with open(fileName) as f:
+        return json.load(f)
+
+def compareBaselines(old, new, tolerance=0.1):
+    """ Return (case name, metric, old value, new value) for every metric of every case present
+    in both baselines that got worse by more than the fractional tolerance. """
+    oldRows = dict((row["name"], row) for row in old["results"])
+    regressions = []
+    for row in new["results"]:
+        if(row["name"] not in oldRows):
+            continue
+        oldRow = oldRows[row["name"]]
+        for metric in THROUGHPUT_METRICS + TIMING_METRICS:
+            before, after = oldRow.get(metric), row.get(metric)
+            if(before == None or after == None or before <= 0):
+                continue
+            if(metric in THROUGHPUT_METRICS):
+                worse = after < before*(1.0 - tolerance)
+            else:
+                worse = after > before*(1.0 + tolerance)
+            if(worse):
+                regressions.append((row["name"], metric, before, after))
+    return regressions
+
+###########################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark simulation throughput, per-block cost and memory.")
+    parser.add_argument("--suite", choices=sorted(SUITES), default="quick", help="quick (one simulated week) or full (also two years)")
+    parser.add_argument("--name", default=None, help="baseline name (default: the suite and the date)")
+    parser.add_argument("--compare", default=None, help="baseline JSON file to compare the results against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="fractional slowdown reported as a regression")
+    args = parser.parse_args()
+
+    baseline = runBenchmarks(args.suite)
+    name = args.name or args.suite + "-" + time.strftime("%Y%m%d-%H%M%S")
+    print("Baseline written to " + writeBaseline(baseline, name))
+    if(args.compare != None):
+        regressions = compareBaselines(loadBaseline(args.compare), baseline, args.tolerance)
+        for caseName, metric, before, after in regressions:
+            print("Regression in " + caseName + ": " + metric + " went from " + str(before) + " to " + str(after))
+        if(regressions):
+            sys.exit(1)
+
+#####################EOF###################################
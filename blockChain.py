@@ -1,15 +1,18 @@
 """ Represents the main chain of a blockchain.
 
 ### Class Attributes ###
-chain = []
+chain = chainStorage()
 lambdaTarget = 1.0/60.0
 d_Next = 1
 diffForm = "bitmonero"
 
-The list, chain = [[t[0], d[0]], [t[1], d[1]], ... [t[n-1],d[n-1]], consists of a sequence of
-ordered pairs. The i^th pair represents the data associated with the i^th block of the
-blockchain.  The first coordinate of any pair is a timestamp and the second coordinate is a
-difficulty score. 
+The chainStorage, chain, holds the sequence of ordered pairs [t[0], d[0]], [t[1], d[1]], ...,
+[t[n-1],d[n-1]] as two typed-array columns, chain.timeChain and chain.difficultyChain, which are
+also available as self.timeChain and self.difficultyChain. The i^th pair represents the data
+associated with the i^th block of the blockchain.  The first coordinate of any pair is a
+timestamp and the second coordinate is a difficulty score. Every instance gets its own chain.
+If windowOnly is set, only the last max(diffSampleSize, timeSampleSize) blocks are kept in
+memory. A sink passed in upon initialization (see chainWriter) sees every block as it is added.
 
 The int, d_Next, represents current difficulty of the blockchain, which is also the difficulty 
 of the (n+1)^th block, d[n].  The difficulty, d_Next, is computed directly from array of ordered
@@ -17,10 +20,13 @@ pairs. The formula used to compute d_Next depends on a parameter provided by the
 
 The float, lambdaTarget, represents target block arrival time (arrivals per second).
 
-The string, diffForm, tells us which formula to use to compute difficulty.
+The string, diffForm, tells us which formula to use to compute difficulty, by name in the
+registry of difficultyAlgorithms.py.
     ~ if diffForm == "bitmonero" then use the CryptoNote reference code difficulty formula.
     ~ if diffForm == "bitcoin" then use the bitcoin reference code difficulty formula.
-    ~ otherwise, specialize a difficulty formuala by hand.
+    ~ if diffForm == "other" then use the bitcoin formula with our own sample sizes.
+    ~ "lwma", "ema" and "constant" are also available, and any other formula can be
+      specialized by hand by registering a new difficultyAlgorithm.
 
 ### Methods ###
 addBlock ~ Not to be confused with adblock. Takes an integer timestamp as input, and inserts
@@ -31,6 +37,11 @@ addBlock ~ Not to be confused with adblock. Takes an integer timestamp as input,
             the blockchain.
 
 """
+from difficultyAlgorithms import *
+from windowEstimator import *
+from chainStorage import *
+from chainWriter import *
+from simLog import *
 from Constants import *
 
 import math
@@ -44,8 +55,7 @@ class blockChain:
     ## The class itself will return these values if called, i.e. blockChain.chain returns [] etc.
     ## These also cause the default values of specific instances of this class.
 
-    timeChain = []
-    difficultyChain = []
+    windowOnly = CHAIN_WINDOW_ONLY
     lambdaTarget = LAMBDA_TARGET
     diffForm = DIFFICULTY_FORMULA
     nextDifficulty = STARTING_DIFFICULTY
@@ -66,48 +76,72 @@ class blockChain:
 
     ###########################################################
 
-    def __init__(self, params=None):
+    def __init__(self, params=None, windowOnly=None, sink=None):
         paramsAreEmptyObject = not params # True if params is empty
         paramsAreNone = (params==None)    # True if params==None, when params ahven't been passed in at all.
         paramsPassedIn = not(paramsAreEmptyObject or paramsAreNone) # True if something nonempty was passed
 
+        initialTimes = []
+        initialDifficulties = []
+        if(windowOnly != None):
+            self.windowOnly = windowOnly
+
         if(paramsPassedIn):
             ## User-defined instance attributes ##
             # bc = blockChain([],[],1.0/60.0,"bitmonero",1)
-            self.timeChain = params[0]
-            self.difficultyChain = params[1]
+            initialTimes = params[0]
+            initialDifficulties = params[1]
             self.lambdaTarget = params[2]
             self.diffForm = params[3]
             self.nextDifficulty = params[4] 
 
             # self.nextDifficulty = int(math.ceil(self.d_Next)) # It is good form dynamically to use this
 
-            if(self.diffForm == "bitmonero"):
-                self.diffSampleSize = DIFF_SAMPLE_SIZE
-                self.timeSampleSize = TIME_SAMPLE_SIZE
-            elif(self.diffForm == "bitcoin"):
-                self.diffSampleSize = DIFF_SAMPLE_SIZE_BITCOIN
-                self.timeSampleSize = TIME_SAMPLE_SIZE_BITCOIN
-                self.difficultyAdjustmentPeriod = DIFF_ADJ_PERIOD_BITCOIN
-            else:
+            if(len(params) > 7):
                 self.diffSampleSize = params[5]
                 self.timeSampleSize = params[6]
                 self.difficultyAdjustmentPeriod = params[7]
 
-        self.make_sure_path_exists("logs")
-        self.logFileName = "logs/blockChain" + self.diffForm + ".log"
-        temp = open(self.logFileName,"w") # Clear the log file 
-        temp.close() # Clear the log file
+        self.logFileName = logPath("blockChain" + self.diffForm + ".log")
+        self.log = openLog(self.logFileName) # Clear the log file and buffer writes to it
+
+        # The algorithm decides the sample sizes it really uses, e.g. bitcoin and bitmonero
+        # always use their reference values.
+        self.algorithm = makeAlgorithm(self.diffForm, self.lambdaTarget, self.diffSampleSize, self.timeSampleSize, self.difficultyAdjustmentPeriod)
+        if(self.algorithm == None):
+            self.printToLog("Error in (blockChain __init__): No difficulty algorithm registered as " + str(self.diffForm) + ", difficulty will stay constant.", ERROR)
+            self.algorithm = makeAlgorithm("constant", self.lambdaTarget, self.diffSampleSize, self.timeSampleSize, self.difficultyAdjustmentPeriod)
+        self.diffSampleSize = self.algorithm.diffSampleSize
+        self.timeSampleSize = self.algorithm.timeSampleSize
+        self.difficultyAdjustmentPeriod = self.algorithm.difficultyAdjustmentPeriod
+
+        windowSize = 0
+        if(self.windowOnly):
+            windowSize = max(self.algorithm.windowSize, self.timeSampleSize)
+        self.chain = chainStorage(windowSize, sink=sink)
+        for timeStamp, difficulty in zip(initialTimes, initialDifficulties):
+            self.chain.append(timeStamp, difficulty)
+        self.timeChain = self.chain.timeChain
+        self.difficultyChain = self.chain.difficultyChain
+
+        self.rejectedBlocks = 0 # Blocks ignored by submitBlock for their timestamps
+        self.rebuildWindows()
+
+    def rebuildWindows(self):
+        """ Rebuild the incremental windows from the retained chain. Some formulas (bitmonero)
+        are kept up to date incrementally rather than recomputed per block, and the median
+        timestamp that new blocks have to beat always is. """
+        self.window = self.algorithm.makeWindow()
+        if(self.window != None):
+            for timeStamp, difficulty in zip(self.timeChain[-self.algorithm.windowSize:], self.difficultyChain[-self.algorithm.windowSize:]):
+                self.window.push(timeStamp, difficulty)
+        self.timestampWindow = slidingMedian(self.timeSampleSize)
+        self.timestampWindow.extend(list(self.timeChain[-self.timeSampleSize:]))
 
     ###########################################################
 
-    def printToLog(self, text):
-        self.logFile = open(self.logFileName, "a")
-        if(not self.logFile):
-            print("Error in (blockChain __printToLog__): Log file is an empty object!")
-        else:
-            self.logFile.write(text + "\n")
-        self.logFile.close()
+    def printToLog(self, text, level=INFO):
+        self.log.log(level, text)
 
     def make_sure_path_exists(self, path):
         try:
@@ -122,54 +156,24 @@ class blockChain:
         """ Compute difficulty of next block """
         blockHeight = len(self.timeChain)
 
-        if(blockHeight > self.diffSampleSize):
-            # We only bother computing difficulty if we have at least sampleSize blocks in our blockchain. And we only consider the top sampleSize blocks.
-            sampleTimeChain = self.timeChain[-self.diffSampleSize:]
-            sampleDifficultyChain = self.difficultyChain[-self.diffSampleSize:]
-            cumDiff = 0
-            deltaT = 0
-            DAPeriod = self.difficultyAdjustmentPeriod
-
-            if(self.diffForm == "bitmonero"):
-                # First order the timestamps, but not difficulty
-                # Then slice out the outlying 1/12 blocks from the top and bottom, leaving 5/6
-                # Then compute sample rate as usual from this particularly sampled data.
-                toSlice = int(math.floor(1.0/12.0*float(self.diffSampleSize)))
-
-                sampleTimeChain = sorted(sampleTimeChain)
-                sampleTimeChain = sampleTimeChain[toSlice:-toSlice]
-                deltaT = sampleTimeChain[-1] - sampleTimeChain[0]
-
-                if(deltaT > 0):
-                    # Since block height is greater than sampleSize,
-                    # and since block times must be at least one second
-                    # apart, we have at least deltaT > sampleSize - 1,
-                    # So we should never fail this test.
-                    sampleDifficultyChain = sampleDifficultyChain[toSlice:-toSlice]
-                    cumDiff = sum(sampleDifficultyChain)
-                    self.nextDifficulty = float(cumDiff)/(self.lambdaTarget*float(deltaT))
-
-                else:
-                    self.printToLog("Error in (blockChain setNextDifficulty): deltaT computed to be zero or negative.")
-                    
-                
-            elif(self.diffForm == "bitcoin"):
-                # Simply compute the sample rate from the top sampleSize blocks.
-                if(blockHeight % DAPeriod == 0):
-
-                    cumDiff = sum(sampleDifficultyChain)
-                    deltaT = max(sampleTimeChain) - min(sampleTimeChain)
-              
-                    if(deltaT > 0):
-                        # Since block height is greater than sampleSize,
-                        # and since block times must be at least one second
-                        # apart, we have at least deltaT > sampleSize - 1,
-                        # So we should never fail this test.
-                        self.nextDifficulty = float(cumDiff)/(self.lambdaTarget*float(deltaT))
-
-                    else:
-                        self.printToLog("Error in (blockChain setNextDifficulty): deltaT computed to be zero or negative.")
+        if(self.algorithm.isDue(blockHeight)):
+            # We only bother computing difficulty if we have at least sampleSize blocks in our
+            # blockchain, and only when the formula says so. And we only consider the top
+            # sampleSize blocks.
+            if(self.window != None):
+                result = self.algorithm.nextDifficultyFromWindow(self.window)
+            else:
+                w = self.algorithm.windowSize
+                result = self.algorithm.nextDifficulty(self.timeChain[-w:], self.difficultyChain[-w:], self.nextDifficulty)
 
+            if(result != None):
+                self.nextDifficulty = result
+            else:
+                # Since block height is greater than sampleSize,
+                # and since block times must be at least one second
+                # apart, we have at least deltaT > sampleSize - 1,
+                # So we should never fail this test.
+                self.printToLog("Error in (blockChain setNextDifficulty): deltaT computed to be zero or negative.", ERROR)
 
     ###########################################################
 
@@ -187,59 +191,124 @@ class blockChain:
         paramsPassedIn = not(paramsAreEmptyObject or paramsAreNone) # True if something was passed
 
         if(not paramsPassedIn or paramsAreNone):
-            self.printToLog("Error in (blockChain addBlock): Did not pass in time to add to blockchain!")
+            self.printToLog("Error in (blockChain addBlock): Did not pass in time to add to blockchain!", ERROR)
         else:
             timeToAdd = params
             timeIsInt = isinstance(timeToAdd, int)
             timeIsFloat = isinstance(timeToAdd,float)
 
-            if(not timeIsInt or not timeIsFloat):
-                self.printToLog("Error in (blockChain addBlock): Timestamp of new block not a number.")
+            if(not timeIsInt and not timeIsFloat):
+                self.printToLog("Error in (blockChain addBlock): Timestamp of new block not a number.", ERROR)
             elif(not timeIsInt and timeIsFloat):
-                self.printToLog("Error in (blockChain addBlock): Timestamp of new block not an integer, rounding up.")
+                self.printToLog("Error in (blockChain addBlock): Timestamp of new block not an integer, rounding up.", ERROR)
                 timeToAdd = int(math.ceil(timeToAdd))
 
             if(isinstance(timeToAdd,int)):
-                self.timeChain.append(timeToAdd)
-                self.difficultyChain.append(self.nextDifficulty)
+                self.chain.append(timeToAdd, self.nextDifficulty)
+                if(self.window != None):
+                    self.window.push(timeToAdd, self.nextDifficulty)
+                self.timestampWindow.push(timeToAdd)
                 # Recompute difficulty now that we have new blocks
                 self.setNextDifficulty()
 
+    def addBlocks(self, timeStamps):
+        """ Append a list of integer timestamps as blocks that all take the current difficulty,
+        then recompute difficulty once. Only valid if none of the new heights but the last is
+        one where difficulty is due (see difficultyAlgorithm.nextDueHeight), so the result is the
+        same as calling addBlock for each timestamp. """
+        self.chain.extend(timeStamps, self.nextDifficulty)
+        if(self.window != None):
+            for timeStamp in timeStamps:
+                self.window.push(timeStamp, self.nextDifficulty)
+        self.timestampWindow.extend(timeStamps)
+        self.setNextDifficulty()
+
+    ###########################################################
+
+    def medianTimestamp(self):
+        """ Median of the last timeSampleSize timestamps, which a new block's timestamp must
+        exceed, or None for an empty chain. """
+        return self.timestampWindow.median()
+
+    def isValidTimestamp(self, timeStamp, networkTime):
+        """ The network's rule: above the median timestamp, and at most MAX_FUTURE_BLOCK_TIME
+        ahead of networkTime, the true time the block is received at. """
+        median = self.timestampWindow.median()
+        return (median == None or timeStamp > median) and timeStamp <= networkTime + MAX_FUTURE_BLOCK_TIME
+
+    def validTimestampCount(self, timeStamps, networkTimes):
+        """ How many of the NumPy array timeStamps, received at networkTimes, submitBlock would
+        accept one after the other before ignoring one. Timestamps rising strictly above every
+        one in the median window are valid at once; otherwise the median before each of them
+        is taken from a sorted sliding view of the chain's last timestamps followed by them.
+        Chains shorter than timeSampleSize are not looked into and count 0. """
+        n = len(timeStamps)
+        if(n == 0):
+            return 0
+        late = timeStamps > networkTimes + MAX_FUTURE_BLOCK_TIME
+        w = self.timeSampleSize
+        tail = numpy.array(self.timeChain[-w:], dtype=numpy.int64)
+        if((len(tail) == 0 or int(timeStamps[0]) > int(tail.max())) and not (numpy.diff(timeStamps) <= 0).any()):
+            valid = ~late
+        elif(len(tail) < w):
+            return 0
+        else:
+            windows = numpy.sort(numpy.lib.stride_tricks.sliding_window_view(numpy.concatenate((tail, timeStamps[:-1])), w), axis=1)
+            if(w % 2 == 1):
+                medians = windows[:,w//2]
+            else:
+                medians = (windows[:,w//2-1] + windows[:,w//2])//2
+            valid = (timeStamps > medians) & ~late
+        if(valid.all()):
+            return n
+        return int(numpy.argmin(valid))
+
+    def submitBlock(self, timeStamp, networkTime):
+        """ addBlock, if the timestamp is valid at networkTime. Otherwise the network ignores the
+        block: nothing changes but the count of rejectedBlocks. Returns whether it was added. """
+        if(not self.isValidTimestamp(timeStamp, networkTime)):
+            self.rejectedBlocks = self.rejectedBlocks + 1
+            if(traceEnabled()):
+                self.printToLog("Block with timestamp " + str(timeStamp) + " ignored at time " + str(networkTime) + ", median timestamp is " + str(self.timestampWindow.median()) + ".", TRACE)
+            return False
+        self.addBlock(timeStamp)
+        return True
+
     ###########################################################
 
     def writeDataToFile(self, fileName, hr):
         """ Again, simple: write the entire blockchain and user-provided hash rate 
-        to a tab-separated file. """
+        to a tab-separated file. In windowOnly mode only the retained blocks are written.
+        For long runs, prefer streaming the chain to a chainWriter while it is built. """
 
-        self.make_sure_path_exists("data")
-        w = open(fileName, "w")
-        w.write("Timestamp \t True Hash Rate \t Difficulty \t (LambdaTarg - LambdaHat)/LambdaTarg \t OldDiff \t (LambdaTarg - LambdaHatOld)/LambdaTarg \n");
-
-        index = 0
-        while(index < len(self.timeChain)):
-            timeStamp = float(self.timeChain[index])
-            #print("Floated timestamp = " + str(timeStamp))
-            diffish = float(self.difficultyChain[index])
-            horseradish = float(hr.getFunctionValue(timeStamp))
-            isHorseRadishBool = isinstance(horseradish,bool)
-            #print("horseradish = " + str(horseradish))
-
-            """ Error catch: we shouldn't have any zero difficulty values (daikon) or boolean
-            hashrates (horseradish). If we have any such values, we have made an error 
-            somewhere else. """
-            if(diffish == 0.0 or isHorseRadishBool):
-                if(diffish == 0.0):
-                    self.printToLog("Critical error in (blockChain writeDataToFile): A zero (new) difficulty snuck into the final result somehow, despite all our failsafes.")
-                if(isHorseRadishBool):
-                    self.printToLog("Critical error in (blockChain writeDataToFile): Tried to compute hash rate at time t = " + str(timeStamp) + " and got " + str(horseradish))
-                #print("Critical error! A zero (new) difficulty snuck into the final result somehow, despite all our failsafes.\n")
-                error = -1.0
-            else: 
-                error = abs(self.lambdaTarget - horseradish/diffish)/self.lambdaTarget
-            
-            # Print this block to file.
-            sentence = str(timeStamp) + " \t " + str(horseradish) + " \t " + str(diffish) + " \t " + str(error) + "\n"
-            w.write(sentence)
-            index = index + 1
+        self.make_sure_path_exists(os.path.dirname(fileName) or ".")
+        timestamps, difficulties = self.chain.asArrays()
+        hashes = hr.getFunctionValues(timestamps.astype(numpy.float64))
+
+        """ Error catch: we shouldn't have any zero difficulty values (daikon). If we have any
+        such values, we have made an error somewhere else; relativeErrors flags them with -1. """
+        if((difficulties == 0.0).any()):
+            self.printToLog("Critical error in (blockChain writeDataToFile): A zero (new) difficulty snuck into the final result somehow, despite all our failsafes.", CRITICAL)
+        errors = relativeErrors(self.lambdaTarget, hashes, difficulties)
 
+        w = open(fileName, "w")
+        w.write(TEXT_HEADER)
+        writeTextRows(w, timestamps, hashes, difficulties, errors)
         return w.close()
+
+    ###########################################################
+
+    def getSummary(self, hr):
+        """ Summary of the per-block relative error |LambdaTarg - LambdaHat|/LambdaTarg that
+        writeDataToFile reports, over the retained blocks, as a dictionary. """
+        times, difficulties = self.chain.asArrays()
+        result = {"blocks": len(self.timeChain), "retainedBlocks": len(times), "rejectedBlocks": self.rejectedBlocks, "finalDifficulty": float(self.nextDifficulty)}
+        if(len(times) > 0):
+            hashes = hr.getFunctionValues(times.astype(numpy.float64))
+            errors = relativeErrors(self.lambdaTarget, hashes, difficulties)
+            result["meanError"] = float(errors.mean())
+            result["rmsError"] = float(numpy.sqrt((errors*errors).mean()))
+            result["maxError"] = float(errors.max())
+        if(len(times) > 1):
+            result["meanBlockTime"] = float(times[-1] - times[0])/float(len(times) - 1)
+        return result
@@ -0,0 +1,197 @@
+"""
+Compact, array-backed storage for the timestamps and difficulties of a blockChain.
+
+A chainStorage keeps the two columns of a chain in typed arrays rather than lists of boxed
+Python ints and floats: timestamps in an array('q') and difficulties in an array('d'), 16 bytes
+per block in all. It runs in one of two modes.
+
+    ~ windowSize == 0 keeps every block. The columns are preallocated to some capacity and
+      grow geometrically, so appends are amortized O(1).
+    ~ windowSize > 0 is "window-only" mode: the columns are a ring buffer holding only the
+      last windowSize blocks, and older blocks are dropped.
+
+If there is a sink (see setSink), every block is also handed to it as it is appended, as
+sink(height, timestamp, difficulty), so blocks can be streamed out during the run in either mode.
+combineSinks feeds several sinks, e.g. a chainWriter and an onlineMetrics, at once.
+
+Either way block height keeps counting every block ever appended. The timeChain and
+difficultyChain attributes are read-only chainColumn views that index by block height (with
+negative indices counting back from the top, as for a list), so code written against the old
+list attributes keeps working as long as it only looks at retained blocks.
+"""
+from Constants import *
+
+import array
+import numpy
+
+
+def combineSinks(sinks):
+    """ One sink handing every block to each of a list of sinks, in order. """
+    if(len(sinks) == 1):
+        return sinks[0]
+    def sink(height, timeStamp, difficulty):
+        for eachSink in sinks:
+            eachSink(height, timeStamp, difficulty)
+    return sink
+
+###########################################################
+
+class chainColumn:
+    """ Read-only, list-like view of one column of a chainStorage. """
+
+    __slots__ = ("storage", "columnName")
+
+    def __init__(self, storage, columnName):
+        self.storage = storage
+        self.columnName = columnName
+
+    def __len__(self):
+        return self.storage.length
+
+    def __getitem__(self, index):
+        data = getattr(self.storage, self.columnName)
+        if(isinstance(index, slice)):
+            return [data[self.storage.getSlot(i)] for i in range(*index.indices(self.storage.length))]
+        if(index < 0):
+            index = index + self.storage.length
+        return data[self.storage.getSlot(index)]
+
+    def __iter__(self):
+        data = getattr(self.storage, self.columnName)
+        for i in range(self.storage.firstHeight(), self.storage.length):
+            yield data[self.storage.getSlot(i)]
+
+###########################################################
+
+class chainStorage:
+    """ Typed-array columns of timestamps and difficulties, unbounded or as a ring buffer. """
+
+    __slots__ = ("times", "difficulties", "length", "windowSize", "sink", "streamed", "timeChain", "difficultyChain")
+
+    ###########################################################
+
+    def __init__(self, windowSize=0, capacity=CHAIN_INITIAL_CAPACITY, sink=None):
+        self.windowSize = windowSize
+        if(windowSize > 0):
+            capacity = windowSize
+        self.times = array.array('q', bytes(8*capacity))
+        self.difficulties = array.array('d', bytes(8*capacity))
+        self.length = 0
+        self.sink = sink
+        self.streamed = 0 # Blocks below this height have already been handed to the sink.
+        self.timeChain = chainColumn(self, "times")
+        self.difficultyChain = chainColumn(self, "difficulties")
+
+    ###########################################################
+
+    def firstHeight(self):
+        """ Height of the oldest block still held in memory. """
+        if(self.windowSize > 0):
+            return max(0, self.length - self.windowSize)
+        return 0
+
+    def getSlot(self, height):
+        """ Position in the underlying arrays of the block at the given height. """
+        if(height < self.firstHeight() or height >= self.length):
+            raise IndexError("Block height " + str(height) + " is not held by this chainStorage.")
+        if(self.windowSize > 0):
+            return height % self.windowSize
+        return height
+
+    def grow(self):
+        """ Double the capacity of an unbounded chainStorage. """
+        extra = max(len(self.times), 1)
+        self.times.frombytes(bytes(8*extra))
+        self.difficulties.frombytes(bytes(8*extra))
+
+    ###########################################################
+
+    def append(self, timeStamp, difficulty):
+        if(self.windowSize > 0):
+            slot = self.length % self.windowSize
+        else:
+            slot = self.length
+            if(slot == len(self.times)):
+                self.grow()
+        self.times[slot] = timeStamp
+        self.difficulties[slot] = difficulty
+        self.length = self.length + 1
+        if(self.sink != None):
+            self.sink(self.length - 1, timeStamp, difficulty)
+            self.streamed = self.length
+
+    def extend(self, timeStamps, difficulty):
+        """ Append a list of blocks that all have the same difficulty, copying whole runs of
+        slots at once rather than one block at a time. """
+        n = len(timeStamps)
+        start = self.length
+        if(self.windowSize > 0):
+            # Only the last windowSize blocks survive, so only those are copied in.
+            skipped = max(0, n - self.windowSize)
+            height = start + skipped
+            rest = timeStamps[skipped:]
+            while(rest):
+                slot = height % self.windowSize
+                take = min(len(rest), self.windowSize - slot)
+                self.times[slot:slot+take] = array.array('q', rest[:take])
+                self.difficulties[slot:slot+take] = array.array('d', [difficulty])*take
+                rest = rest[take:]
+                height = height + take
+        else:
+            while(start + n > len(self.times)):
+                self.grow()
+            self.times[start:start+n] = array.array('q', timeStamps)
+            self.difficulties[start:start+n] = array.array('d', [difficulty])*n
+        self.length = start + n
+        if(self.sink != None):
+            for i in range(n):
+                self.sink(start + i, timeStamps[i], difficulty)
+            self.streamed = self.length
+
+    def load(self, length, times, difficulties):
+        """ Replace the contents with the last len(times) blocks of a chain of length blocks, as
+        saved from a chainStorage of the same kind. Only a window-only chainStorage may hold
+        fewer blocks than its length. """
+        n = len(times)
+        expected = length if self.windowSize == 0 else min(length, self.windowSize)
+        if(n != expected or len(difficulties) != n):
+            raise ValueError("Expected " + str(expected) + " retained blocks for a chain of length " + str(length) + ", got " + str(n) + ".")
+        if(self.windowSize == 0):
+            while(n > len(self.times)):
+                self.grow()
+        self.length = length
+        for height, timeStamp, difficulty in zip(range(length - n, length), times, difficulties):
+            slot = self.getSlot(height)
+            self.times[slot] = timeStamp
+            self.difficulties[slot] = difficulty
+        self.streamed = length
+
+    def setSink(self, sink):
+        """ Stream blocks to sink from now on, starting with the retained blocks it has not seen. """
+        self.sink = sink
+        self.flush()
+
+    def flush(self):
+        """ Hand every retained block that has not been streamed yet to the sink. """
+        if(self.sink != None):
+            for height in range(max(self.streamed, self.firstHeight()), self.length):
+                slot = self.getSlot(height)
+                self.sink(height, self.times[slot], self.difficulties[slot])
+            self.streamed = self.length
+
+    ###########################################################
+
+    def asArrays(self):
+        """ Return copies of the retained timestamps and difficulties as NumPy arrays in height
+        order. (Views would pin the arrays, and an array exporting its buffer cannot grow.) """
+        times = numpy.frombuffer(self.times, dtype=numpy.int64)
+        difficulties = numpy.frombuffer(self.difficulties)
+        if(self.windowSize > 0):
+            slots = numpy.arange(self.firstHeight(), self.length) % self.windowSize
+            return times[slots], difficulties[slots]
+        return times[:self.length].copy(), difficulties[:self.length].copy()
+
+    def nbytes(self):
+        return self.times.itemsize*len(self.times) + self.difficulties.itemsize*len(self.difficulties)
+
+#####################EOF###################################
@@ -0,0 +1,167 @@
+"""
+Streaming, columnar binary output of a blockChain.
+
+Writing the chain as text meant building one string per block, querying the hash rate once per
+block, and doing all of it only after the whole run had finished in memory. A chainWriter
+instead takes blocks as they are produced (it is meant to be the sink of a chainStorage) and
+writes them out in chunks of OUTPUT_CHUNK_RECORDS blocks, as one .npy file per column inside an
+output directory:
+
+    timestamp.npy   int64    block timestamps
+    hashRate.npy    float64  true hash rate at each timestamp
+    difficulty.npy  float64  difficulty of each block
+    error.npy       float64  |LambdaTarg - LambdaHat|/LambdaTarg, as in writeDataToFile
+    meta.json                lambdaTarget, diffForm, hash rate description and block count
+
+The hash rate and the error are computed once per chunk with vectorized NumPy operations. Each
+.npy file is written with a fixed-size header that is rewritten with the final length when the
+writer is closed, so the files are valid .npy files that loadChain (or numpy.load with
+mmap_mode="r") can memory-map without parsing anything.
+
+The tab-separated text format of blockChain.writeDataToFile is still available: writeTextRows
+writes it for arrays of columns and exportText converts an output directory into it.
+"""
+from Constants import *
+
+import array
+import errno
+import json
+import numpy
+import os
+
+NPY_HEADER_SIZE = 128 # Magic string, version, header length and padded header dictionary.
+CHAIN_COLUMNS = [("timestamp", "<i8"), ("hashRate", "<f8"), ("difficulty", "<f8"), ("error", "<f8")]
+TEXT_HEADER = "Timestamp \t True Hash Rate \t Difficulty \t (LambdaTarg - LambdaHat)/LambdaTarg \t OldDiff \t (LambdaTarg - LambdaHatOld)/LambdaTarg \n"
+
+###########################################################
+
+def relativeErrors(lambdaTarget, hashes, difficulties):
+    """ Per-block |LambdaTarg - hashRate/difficulty|/LambdaTarg, with -1.0 flagging a zero
+    difficulty exactly as writeDataToFile does. """
+    errors = numpy.full(len(difficulties), -1.0)
+    good = difficulties != 0.0
+    errors[good] = numpy.abs(lambdaTarget - hashes[good]/difficulties[good])/lambdaTarget
+    return errors
+
+def writeTextRows(w, timestamps, hashes, difficulties, errors):
+    """ Append rows in the tab-separated format of writeDataToFile to the open file w. """
+    for row in zip(timestamps.astype(numpy.float64).tolist(), hashes.tolist(), difficulties.tolist(), errors.tolist()):
+        w.write(str(row[0]) + " \t " + str(row[1]) + " \t " + str(row[2]) + " \t " + str(row[3]) + "\n")
+
+###########################################################
+
+class npyColumnWriter:
+    """ Appends to a one-dimensional .npy file whose length is only known when it is closed. """
+
+    def __init__(self, fileName, descr, length=0):
+        """ With length > 0, reopen a file already holding at least length values and carry on
+        after the first length of them, dropping any others. """
+        self.fileName = fileName
+        self.descr = descr
+        self.length = length
+        if(length > 0):
+            self.file = open(fileName, "r+b")
+            self.file.truncate(NPY_HEADER_SIZE + length*numpy.dtype(descr).itemsize)
+        else:
+            self.file = open(fileName, "wb")
+        self.writeHeader()
+
+    def writeHeader(self):
+        header = "{'descr': '" + self.descr + "', 'fortran_order': False, 'shape': (" + str(self.length) + ",), }"
+        header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+        self.file.seek(0)
+        self.file.write(b"\x93NUMPY\x01\x00" + numpy.uint16(len(header)).tobytes() + header.encode("latin1"))
+        self.file.seek(0, os.SEEK_END)
+
+    def write(self, values):
+        self.file.write(numpy.ascontiguousarray(values, dtype=self.descr).tobytes())
+        self.length = self.length + len(values)
+
+    def sync(self):
+        """ Make the file on disk a valid .npy file of everything written so far. """
+        self.writeHeader()
+        self.file.flush()
+
+    def close(self):
+        self.writeHeader()
+        self.file.close()
+
+###########################################################
+
+class chainWriter:
+    """ Sink for a chainStorage that streams blocks into a directory of .npy columns. """
+
+    chunkSize = OUTPUT_CHUNK_RECORDS
+
+    def __init__(self, directory, hr, lambdaTarget, diffForm="", chunkSize=None, resumeBlocks=0):
+        """ resumeBlocks > 0 continues an output directory that already holds that many blocks
+        (see sync), as a run resumed from a checkpoint does. """
+        if(chunkSize != None):
+            self.chunkSize = chunkSize
+        self.directory = directory
+        self.hr = hr
+        self.lambdaTarget = lambdaTarget
+        self.diffForm = diffForm
+        try:
+            os.makedirs(directory)
+        except OSError as exception:
+            if exception.errno != errno.EEXIST:
+                raise
+        self.columns = dict((name, npyColumnWriter(os.path.join(directory, name + ".npy"), descr, resumeBlocks)) for name, descr in CHAIN_COLUMNS)
+        self.timestamps = array.array('q')
+        self.difficulties = array.array('d')
+        self.blocks = resumeBlocks
+
+    ###########################################################
+
+    def addBlock(self, height, timeStamp, difficulty):
+        """ chainStorage sink: queue one block, writing a chunk out once enough are queued. """
+        self.timestamps.append(timeStamp)
+        self.difficulties.append(difficulty)
+        if(len(self.timestamps) >= self.chunkSize):
+            self.flush()
+
+    def flush(self):
+        """ Write every queued block to the column files. """
+        if(len(self.timestamps) == 0):
+            return
+        timestamps = numpy.frombuffer(self.timestamps, dtype=numpy.int64)
+        difficulties = numpy.frombuffer(self.difficulties)
+        hashes = self.hr.getFunctionValues(timestamps.astype(numpy.float64))
+        self.columns["timestamp"].write(timestamps)
+        self.columns["hashRate"].write(hashes)
+        self.columns["difficulty"].write(difficulties)
+        self.columns["error"].write(relativeErrors(self.lambdaTarget, hashes, difficulties))
+        self.blocks = self.blocks + len(timestamps)
+        self.timestamps = array.array('q')
+        self.difficulties = array.array('d')
+
+    def sync(self):
+        """ Write out every queued block and leave valid column files on disk, e.g. for a checkpoint. """
+        self.flush()
+        for column in self.columns.values():
+            column.sync()
+
+    def close(self):
+        self.flush()
+        for column in self.columns.values():
+            column.close()
+        with open(os.path.join(self.directory, "meta.json"), "w") as w:
+            json.dump({"lambdaTarget": self.lambdaTarget, "diffForm": self.diffForm, "hashRate": str(self.hr.description), "blocks": self.blocks}, w)
+
+###########################################################
+
+def loadChain(directory, mmapMode="r"):
+    """ Return the columns of an output directory as a dictionary of (memory-mapped) arrays. """
+    return dict((name, numpy.load(os.path.join(directory, name + ".npy"), mmap_mode=mmapMode)) for name, descr in CHAIN_COLUMNS)
+
+def exportText(directory, fileName, chunkSize=OUTPUT_CHUNK_RECORDS):
+    """ Convert an output directory to the tab-separated text format of writeDataToFile. """
+    columns = loadChain(directory)
+    with open(fileName, "w") as w:
+        w.write(TEXT_HEADER)
+        for start in range(0, len(columns["timestamp"]), chunkSize):
+            stop = start + chunkSize
+            writeTextRows(w, columns["timestamp"][start:stop], columns["hashRate"][start:stop], columns["difficulty"][start:stop], columns["error"][start:stop])
+
+#####################EOF###################################
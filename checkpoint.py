@@ -0,0 +1,55 @@
+"""
+Compact binary checkpoint files.
+
+A checkpoint is a single uncompressed NumPy .npz archive: the bulky state (timestamps and
+difficulties of the retained chain, the hash rate partition) is stored as typed arrays, and
+everything else as a small JSON document in the "state" member. Python floats survive the trip through JSON exactly, as do the 128-bit integers of the random
+generator state, so a run resumed from a checkpoint continues bit for bit.
+
+Files are written to a temporary name and then renamed over the old checkpoint, so a crash or
+preemption while writing never leaves a truncated checkpoint behind.
+
+This module only reads and writes the files; simulation.saveCheckpoint decides what goes into
+them, and resumeSimulation and forkSimulations in simulation.py build runs from them.
+"""
+from Constants import *
+
+import errno
+import json
+import numpy
+import os
+
+CHECKPOINT_VERSION = 1
+
+###########################################################
+
+def writeCheckpoint(fileName, state, arrays):
+    """ Atomically write the JSON-friendly dictionary state and the dictionary of arrays to fileName. """
+    directory = os.path.dirname(fileName)
+    if(directory):
+        try:
+            os.makedirs(directory)
+        except OSError as exception:
+            if exception.errno != errno.EEXIST:
+                raise
+    state = dict(state)
+    state["version"] = CHECKPOINT_VERSION
+    members = dict(arrays)
+    members["state"] = numpy.frombuffer(json.dumps(state).encode("utf-8"), dtype=numpy.uint8)
+    temporary = fileName + ".tmp"
+    with open(temporary, "wb") as w:
+        numpy.savez(w, **members)
+        w.flush()
+        os.fsync(w.fileno())
+    os.replace(temporary, fileName)
+
+def readCheckpoint(fileName):
+    """ Return the (state, arrays) pair stored by writeCheckpoint. """
+    with numpy.load(fileName, allow_pickle=False) as archive:
+        arrays = dict((name, archive[name]) for name in archive.files)
+    state = json.loads(arrays.pop("state").tobytes().decode("utf-8"))
+    if(state.get("version") != CHECKPOINT_VERSION):
+        raise ValueError("Checkpoint " + str(fileName) + " has version " + str(state.get("version")) + ", expected " + str(CHECKPOINT_VERSION) + ".")
+    return state, arrays
+
+#####################EOF###################################
@@ -0,0 +1,178 @@
+"""
+Side by side comparisons of difficulty algorithms with common random numbers.
+
+Comparing two formulas through independent runs pays for the noise of both runs in every
+difference. compareAlgorithms instead runs every formula of a replication on the same scenario
+and the same Exp(1) stream, so that the differences between their summary metrics are down to
+the formulas rather than to luck:
+
+    ~ every run draws from randomStream(seed of the replication), and draws with
+      integratedArrivals, so block k of every formula takes the k-th draw times its
+      difficulty in hashes, whatever the formula did to the blocks before it. A lazy hash
+      rate without a seed of its own gets the seed of the replication too, so the formulas of
+      a replication also share its path;
+    ~ with antithetic set, every replication is a pair of runs per formula, one of them from
+      the antitheticStream of the same seed, and the pair's mean is the observation;
+    ~ replications themselves are independent, and run over a pool of processes as in
+      sweep.py.
+
+The first formula is the baseline. For every other formula and every metric (summary keys of
+simulation.getSummary, COMPARISON_METRICS by default), pairedDifferences gives the mean paired
+difference, its standard error and confidence interval (normal approximation), the standard
+error the same number of independent runs would have had, and the variance reduction: how many
+times as many independent runs would be needed for the same interval.
+
+From the shell:
+
+    python comparison.py scenario.toml --forms bitcoin lwma ema -n 64 --antithetic -p 8
+"""
+from scenario import *
+from sweep import *
+from randomStream import *
+from simLog import *
+from Constants import *
+
+import argparse
+import errno
+import math
+import numpy
+import os
+import statistics
+
+###########################################################
+
+def replicationSeeds(seed, replications):
+    """ One seed per replication, all derived from seed (OS entropy if it is None). """
+    entropy = numpy.random.SeedSequence(seed).entropy
+    return [[entropy, replication] for replication in range(replications)]
+
+def commonScenario(scenario, seed):
+    """ The scenario every formula of a replication runs: seed, integrated arrivals, online
+    metrics and no output or chain beyond the difficulty window. """
+    return dict(seedScenario(scenario, seed), integratedArrivals=True, collectMetrics=True, verbose=False, outputFileName=None, checkpointFileName=None, windowOnly=True)
+
+def runReplica(job):
+    """ Run one formula of one replication (or of its antithetic replica) and return its row of
+    metrics. Runs in a worker process. """
+    replication, antithetic, diffForm, scenario, metrics, outputDirectory = job
+    logDirectory = os.path.join(outputDirectory, "logs", "rep" + str(replication).zfill(5) + ("a" if antithetic else ""))
+    s = makeSimulation(dict(scenario, diffForm=diffForm, logDirectory=logDirectory))
+    if(antithetic):
+        s.rng = antitheticStream(s.seed)
+        s.setTimestampPolicy()
+    s.runSim()
+    summary = s.getSummary()
+    closeAllLogs()
+    row = {"replication": replication, "antithetic": antithetic, "diffForm": diffForm}
+    row.update((metric, summary[metric]) for metric in metrics if metric in summary)
+    return row
+
+###########################################################
+
+def confidenceHalfWidth(standardError, confidence=CONFIDENCE_LEVEL):
+    """ Half width of the two-sided normal confidence interval at the given level. """
+    return statistics.NormalDist().inv_cdf(0.5 + 0.5*confidence)*standardError
+
+def pairedDifferences(rows, diffForms, metrics=None, confidence=CONFIDENCE_LEVEL):
+    """ Paired difference estimates of every formula of diffForms against the first, from the
+    rows of runReplica. Returns one row per formula and metric. """
+    if(metrics == None):
+        metrics = COMPARISON_METRICS
+    observations = {} # (replication, diffForm) -> metric -> values of the run and its antithetic replica
+    single = {} # (diffForm, metric) -> values of the plain runs alone
+    antithetic = False
+    for row in rows:
+        antithetic = antithetic or row["antithetic"]
+        values = observations.setdefault((row["replication"], row["diffForm"]), {})
+        for metric in metrics:
+            if(metric in row):
+                values.setdefault(metric, []).append(row[metric])
+                if(not row["antithetic"]):
+                    single.setdefault((row["diffForm"], metric), []).append(row[metric])
+    runsPerObservation = 2 if antithetic else 1
+    replications = sorted(set(replication for replication, diffForm in observations))
+    baseline = diffForms[0]
+
+    result = []
+    for diffForm in diffForms[1:]:
+        for metric in metrics:
+            differences = []
+            for replication in replications:
+                base = observations.get((replication, baseline), {}).get(metric, [])
+                other = observations.get((replication, diffForm), {}).get(metric, [])
+                if(len(base) == runsPerObservation and len(other) == runsPerObservation):
+                    differences.append(sum(other)/runsPerObservation - sum(base)/runsPerObservation)
+            row = {"diffForm": diffForm, "baseline": baseline, "metric": metric, "replications": len(differences)}
+            if(len(differences) > 1):
+                mean = sum(differences)/len(differences)
+                variance = statistics.variance(differences)
+                standardError = math.sqrt(variance/len(differences))
+                halfWidth = confidenceHalfWidth(standardError, confidence)
+                row.update({"difference": mean, "standardError": standardError, "lower": mean - halfWidth, "upper": mean + halfWidth})
+                # Independent runs of both formulas, as many as the comparison made of each.
+                baseRuns = single.get((baseline, metric), [])
+                otherRuns = single.get((diffForm, metric), [])
+                if(len(baseRuns) > 1 and len(otherRuns) > 1):
+                    independentVariance = statistics.variance(baseRuns) + statistics.variance(otherRuns)
+                    row["independentStandardError"] = math.sqrt(independentVariance/(runsPerObservation*len(differences)))
+                    if(variance > 0.0):
+                        row["varianceReduction"] = independentVariance/(runsPerObservation*variance)
+            result.append(row)
+    return result
+
+###########################################################
+
+def compareAlgorithms(scenario, diffForms, replications=COMPARISON_REPLICATIONS, seed=None, antithetic=False, metrics=None, outputDirectory=COMPARISON_DIRECTORY, processes=None, confidence=CONFIDENCE_LEVEL):
+    """ Run every formula of diffForms on replications common random number replications of
+    scenario (with antithetic replicas if antithetic is set), write the runs to
+    outputDirectory/replications.csv and the paired differences against diffForms[0] to
+    outputDirectory/differences.csv, and return the latter as a list of dictionaries. """
+    checkScenario(scenario)
+    if(len(diffForms) < 2):
+        raise ValueError("A comparison needs at least two difficulty formulas, got " + str(diffForms))
+    if(metrics == None):
+        metrics = COMPARISON_METRICS
+    try:
+        os.makedirs(outputDirectory)
+    except OSError as exception:
+        if exception.errno != errno.EEXIST:
+            raise
+
+    jobs = []
+    for replication, replicationSeed in enumerate(replicationSeeds(seed, replications)):
+        common = commonScenario(scenario, replicationSeed)
+        for mirrored in ([False, True] if antithetic else [False]):
+            jobs.extend((replication, mirrored, diffForm, common, metrics, outputDirectory) for diffForm in diffForms)
+    if(processes == 1):
+        rows = [runReplica(job) for job in jobs]
+    else:
+        with poolContext().Pool(processes) as pool:
+            rows = list(pool.imap(runReplica, jobs))
+    writeSummary(rows, os.path.join(outputDirectory, "replications.csv"))
+    differences = pairedDifferences(rows, diffForms, metrics, confidence)
+    writeSummary(differences, os.path.join(outputDirectory, "differences.csv"))
+    return differences
+
+###########################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare difficulty formulas on common random numbers.")
+    parser.add_argument("scenario", nargs="?", default=None, help="JSON or TOML scenario file, see scenario.py (default: Constants.py)")
+    parser.add_argument("--forms", nargs="+", default=["bitcoin", "bitmonero"], choices=sorted(ALGORITHMS), help="formulas to compare, the first one being the baseline")
+    parser.add_argument("-n", "--replications", type=int, default=COMPARISON_REPLICATIONS)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--antithetic", action="store_true", help="add an antithetic replica to every replication")
+    parser.add_argument("--metrics", nargs="+", default=COMPARISON_METRICS, help="summary metrics to compare")
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE_LEVEL)
+    parser.add_argument("-o", "--output", default=COMPARISON_DIRECTORY, help="directory for the tables and logs")
+    parser.add_argument("-p", "--processes", type=int, default=None, help="worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    scenario = loadScenario(args.scenario) if args.scenario != None else {}
+    for row in compareAlgorithms(scenario, args.forms, args.replications, args.seed, args.antithetic, args.metrics, args.output, args.processes, args.confidence):
+        if("difference" in row):
+            print(row["diffForm"] + " - " + row["baseline"] + " " + row["metric"] + ": " + "{:.6g}".format(row["difference"]) + " [" + "{:.6g}".format(row["lower"]) + ", " + "{:.6g}".format(row["upper"]) + "], variance reduction " + "{:.3g}".format(row.get("varianceReduction", float("nan"))))
+        else:
+            print(row["diffForm"] + " - " + row["baseline"] + " " + row["metric"] + ": too few replications")
+
+#####################EOF###################################
@@ -0,0 +1,240 @@
+"""
+Consistency checks: the fast paths against the slow ones they stand in for.
+
+Several parts of the simulator compute the same thing twice, once directly and once faster,
+and promise that the two agree bit for bit. Every check here runs both on seeded input and
+returns a list of the disagreements it found, empty if there are none:
+
+    ~ checkTrimmedWindow: the trimmedWindow of the bitmonero formula against the direct formula,
+      at every block of a long window;
+    ~ checkBatchReplicas: every replica of a batchSimulation against a scalar simulation drawing
+      from the same child stream, for every difficulty formula;
+    ~ checkReplay: replayDifficulties, replaying every formula in one pass over a timestamp
+      column, against a blockChain the same blocks are added to one by one;
+    ~ checkResume: a run resumed from its last checkpoint against the run that wrote it, and
+      against the same run without checkpoints, with and without integratedArrivals;
+    ~ checkForks: forkSimulations from a checkpoint, with and without integratedArrivals and a
+      new hash rate: every fork starts without a pending block and, with integrated arrivals,
+      with the hashes computed up to its clock, forks differ from each other, and forking
+      again with the same seed repeats them;
+    ~ checkSteadyMiners: a network of steady miners against the equivalent plain hashRate, whose
+      runs must have the same summary, online metrics included.
+
+From the shell, running every check (or the named ones) and exiting with status 1 on any
+disagreement:
+
+    python consistency.py [checkTrimmedWindow ...]
+"""
+from hashRate import *
+from simulation import *
+from batchSimulation import *
+from blockChain import *
+from replay import *
+from scenario import *
+from randomStream import *
+from difficultyAlgorithms import *
+from windowEstimator import *
+from Constants import *
+
+import argparse
+import numpy
+import os
+import shutil
+import sys
+import tempfile
+
+###########################################################
+
+def checkTrimmedWindow(steps=20000, seed=1):
+    """ Push steps random blocks, with difficulties spread over many orders of magnitude, into a
+    trimmedWindow and compare its trimmed sum and next difficulty with the direct formula after
+    every block. """
+    generator = numpy.random.default_rng(seed)
+    times = numpy.cumsum(generator.integers(-60, 600, steps)).tolist()
+    difficulties = generator.lognormal(20.0, 3.0, steps).tolist()
+    algorithm = makeAlgorithm("bitmonero", LAMBDA_TARGET, DIFF_SAMPLE_SIZE, TIME_SAMPLE_SIZE, DIFF_ADJ_PERIOD)
+    window = algorithm.makeWindow()
+    windowSize = algorithm.windowSize
+    s = window.toSlice
+    failures = []
+    for i in range(steps):
+        window.push(times[i], difficulties[i])
+        if(not window.isFull()):
+            continue
+        recentTimes = times[i+1-windowSize:i+1]
+        recentDifficulties = difficulties[i+1-windowSize:i+1]
+        direct = sum(recentDifficulties[s:windowSize-s])
+        if(window.trimmedCumulativeDifficulty() != direct):
+            failures.append("trimmedWindow: middle sum " + repr(window.trimmedCumulativeDifficulty()) + " != " + repr(direct) + " at block " + str(i))
+        elif(algorithm.nextDifficultyFromWindow(window) != algorithm.nextDifficulty(recentTimes, recentDifficulties, None)):
+            failures.append("trimmedWindow: next difficulty differs from the direct formula at block " + str(i))
+        if(len(failures) >= 10):
+            break
+    return failures
+
+def checkBatchReplicas(replicas=2, maxTime=1000000.0, seed=1, diffForms=None):
+    """ Run every formula (all registered ones by default) as a batchSimulation with retained
+    chains, and replica i of it again as a scalar simulation whose rng is
+    randomStream(seed).spawn(replicas)[i]; the chains and next difficulties must be equal. """
+    failures = []
+    for diffForm in (diffForms or sorted(ALGORITHMS)):
+        hr = hashRate([[0.0, maxTime/3.0, maxTime], [1.0, 4.0], "Step", maxTime])
+        params = [maxTime, LAMBDA_TARGET, diffForm, STARTING_DIFFICULTY, DIFF_ADJ_PERIOD, DIFF_SAMPLE_SIZE, TIME_SAMPLE_SIZE, hr]
+        batch = batchSimulation(params, replicas, seed, retainChains=True)
+        batch.runSim()
+        streams = randomStream(seed).spawn(replicas)
+        for i in range(replicas):
+            s = simulation(params)
+            s.verbose = False
+            s.outputFileName = None
+            s.rng = streams[i]
+            s.setTimestampPolicy()
+            s.runSim()
+            bc = batch.getBlockChain(i)
+            if(list(s.bChain.timeChain) != list(bc.timeChain)):
+                failures.append("batchSimulation: timestamps of " + diffForm + " replica " + str(i) + " differ from the scalar run")
+            elif(list(s.bChain.difficultyChain) != list(bc.difficultyChain) or s.bChain.nextDifficulty != bc.nextDifficulty):
+                failures.append("batchSimulation: difficulties of " + diffForm + " replica " + str(i) + " differ from the scalar run")
+    return failures
+
+def checkReplay(blocks=12000, chunkSize=997, seed=1, diffForms=None):
+    """ Replay every formula (all registered ones by default) over random increasing timestamps,
+    in chunks that do not line up with any window, and compare with the difficulties a
+    blockChain assigns to the same blocks. """
+    generator = numpy.random.default_rng(seed)
+    gaps = numpy.concatenate((generator.integers(1, 240, blocks//2), generator.integers(1, 60, blocks - blocks//2)))
+    times = numpy.cumsum(gaps)
+    forms = diffForms or sorted(ALGORITHMS)
+    replayed = replayDifficulties(times, forms, chunkSize=chunkSize)
+    failures = []
+    for diffForm in forms:
+        bc = blockChain([[], [], LAMBDA_TARGET, diffForm, STARTING_DIFFICULTY, DIFF_SAMPLE_SIZE, TIME_SAMPLE_SIZE, DIFF_ADJ_PERIOD])
+        for timeStamp in times.tolist():
+            bc.addBlock(timeStamp)
+        expected = list(bc.difficultyChain) + [bc.nextDifficulty]
+        if(replayed[diffForm].tolist() != expected):
+            failures.append("replay: " + diffForm + " differs from blockChain from height " + str(next(i for i, (a, b) in enumerate(zip(replayed[diffForm].tolist(), expected)) if a != b)))
+    return failures
+
+def checkpointScenario(integratedArrivals, checkpointFileName=None, maxTime=400000.0):
+    """ A short seeded bitmonero run over a stepped hash rate, checkpointing at 30%, 60% and 90%
+    of it to checkpointFileName if given. """
+    return {"diffForm": "bitmonero", "seed": 7, "maxTime": maxTime,
+            "hashRate": [[0.0, 0.3*maxTime, 0.7*maxTime, maxTime], [1.0, 3.0, 0.5], "Steps"],
+            "integratedArrivals": integratedArrivals, "verbose": False, "outputFileName": None,
+            "checkpointFileName": checkpointFileName, "checkpointInterval": 0.3*maxTime}
+
+def chainOf(s):
+    return list(s.bChain.timeChain), list(s.bChain.difficultyChain), s.bChain.nextDifficulty
+
+def checkResume():
+    """ Run with checkpoints, resume from the last one and finish; the chain, clock and work must
+    be those of the run that wrote it, and of the same run without checkpoints. """
+    failures = []
+    directory = tempfile.mkdtemp()
+    try:
+        for integratedArrivals in [False, True]:
+            label = "resume" + (" with integrated arrivals" if integratedArrivals else "")
+            fileName = os.path.join(directory, "resume" + str(integratedArrivals) + ".npz")
+            plain = runScenario(checkpointScenario(integratedArrivals))
+            original = runScenario(checkpointScenario(integratedArrivals, fileName))
+            resumed = resumeSimulation(fileName)
+            if(resumed.clock >= resumed.maxTime or len(resumed.bChain.timeChain) >= len(original.bChain.timeChain)):
+                failures.append(label + ": the checkpoint was not taken part way through the run")
+                continue
+            resumed.runSim()
+            if(chainOf(original) != chainOf(plain)):
+                failures.append(label + ": checkpointing changed the run")
+            if(chainOf(resumed) != chainOf(original)):
+                failures.append(label + ": the resumed chain differs from the original")
+            if((resumed.clock, resumed.work) != (original.clock, original.work)):
+                failures.append(label + ": resumed clock or work " + repr((resumed.clock, resumed.work)) + " != " + repr((original.clock, original.work)))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return failures
+
+def checkForks(n=3, seed=11):
+    """ Fork n runs from a checkpoint taken part way through a run, with the saved hash rate and
+    with a new one, and check their starting state, their independence and their seeding. """
+    failures = []
+    directory = tempfile.mkdtemp()
+    try:
+        for integratedArrivals in [False, True]:
+            fileName = os.path.join(directory, "fork" + str(integratedArrivals) + ".npz")
+            runScenario(checkpointScenario(integratedArrivals, fileName))
+            saved = resumeSimulation(fileName)
+            for newRate in [False, True]:
+                label = "forks" + (" with integrated arrivals" if integratedArrivals else "") + (" and a new hash rate" if newRate else "")
+                maxTime = 2.0*saved.maxTime
+                def fork():
+                    hr = hashRate([[0.0, saved.clock + 1000.0, maxTime], [2.0, 5.0], "Jump", maxTime]) if newRate else None
+                    return forkSimulations(fileName, n, seed, hr, maxTime)
+                forks = fork()
+                for i, s in enumerate(forks):
+                    if(s.pendingBlock != None):
+                        failures.append(label + ": fork " + str(i) + " kept the saved pending block")
+                    if(integratedArrivals and s.work != s.hRate.getCumulativeHashes(s.clock)):
+                        failures.append(label + ": fork " + str(i) + " starts with work " + repr(s.work) + " rather than H(clock) = " + repr(s.hRate.getCumulativeHashes(s.clock)))
+                    s.verbose = False
+                    s.runSim()
+                    if(integratedArrivals and s.work != s.hRate.getCumulativeHashes(s.clock)):
+                        failures.append(label + ": fork " + str(i) + " ends with work " + repr(s.work) + " rather than H(clock)")
+                if(len(set(tuple(s.bChain.timeChain[len(saved.bChain.timeChain):]) for s in forks)) != n):
+                    failures.append(label + ": forks are not independent")
+                again = fork()
+                for s in again:
+                    s.verbose = False
+                    s.runSim()
+                if([chainOf(s) for s in again] != [chainOf(s) for s in forks]):
+                    failures.append(label + ": forking again with the same seed gave other chains")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return failures
+
+def checkSteadyMiners(maxTime=400000.0, seed=3):
+    """ Run lwma with two steady miners, one of them stepping its rate, and with the hash rate
+    that is their sum; getSummary() must be the same. """
+    base = {"diffForm": "lwma", "seed": seed, "maxTime": maxTime, "verbose": False, "outputFileName": None, "collectMetrics": True}
+    times = [0.0, 0.25*maxTime, 0.5*maxTime, 0.75*maxTime, maxTime]
+    minerRun = runScenario(dict(base, miners=[{"schedule": 1.0}, {"schedule": {"time": times, "values": [1.0, 3.0, 1.0, 2.0], "description": "Steps"}}]))
+    plainRun = runScenario(dict(base, hashRate={"time": times, "values": [2.0, 4.0, 2.0, 3.0], "description": "Steps"}))
+    minerSummary = minerRun.getSummary()
+    plainSummary = plainRun.getSummary()
+    return ["steady miners: " + name + " is " + repr(minerSummary.get(name)) + " rather than " + repr(plainSummary.get(name)) for name in sorted(set(minerSummary) | set(plainSummary)) if minerSummary.get(name) != plainSummary.get(name)]
+
+###########################################################
+
+CHECKS = {"checkTrimmedWindow": checkTrimmedWindow,
+          "checkBatchReplicas": checkBatchReplicas,
+          "checkReplay": checkReplay,
+          "checkResume": checkResume,
+          "checkForks": checkForks,
+          "checkSteadyMiners": checkSteadyMiners}
+
+def runChecks(names=None, verbose=True):
+    """ Run the named checks (all of them by default) and return every failure. """
+    failures = []
+    for name in (names or sorted(CHECKS)):
+        found = CHECKS[name]()
+        if(verbose):
+            print(name + ": " + ("ok" if not found else str(len(found)) + " failures"))
+        failures.extend(found)
+    return failures
+
+###########################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the fast paths of the simulator against the direct ones.")
+    parser.add_argument("checks", nargs="*", help="checks to run, of " + str(sorted(CHECKS)) + " (default: all)")
+    args = parser.parse_args()
+    for name in args.checks:
+        if(name not in CHECKS):
+            parser.error("unknown check " + name)
+
+    failures = runChecks(args.checks)
+    for failure in failures:
+        print(failure)
+    if(failures):
+        sys.exit(1)
+
+#####################EOF###################################
@@ -0,0 +1,349 @@
+"""
+Registry of difficulty algorithms.
+
+Every difficulty formula is an algorithm object with one interface, so blockChain, batchSimulation
+and anything else that needs a next difficulty never branch on diffForm themselves:
+
+    ~ windowSize is the number of most recent blocks the formula looks at;
+    ~ isDue(blockHeight) says whether difficulty is recomputed once the chain has blockHeight
+      blocks. It only uses comparisons and arithmetic, so blockHeight may also be a NumPy
+      array of heights, one per replica;
+    ~ nextDifficulties(times, difficulties, current) is the batched kernel: times and
+      difficulties are (windowSize, k) arrays holding the windows of k chains in chronological
+      order, current holds their current difficulties, and the result holds their next
+      difficulties, with NaN wherever the formula is undefined (a non-positive time span);
+    ~ nextDueHeight(blockHeight) is the smallest height above blockHeight at which isDue holds,
+      or None if difficulty never changes again, so an engine knows how many blocks in a row
+      share the current difficulty;
+    ~ nextDifficulty(times, difficulties, current) is the scalar entry point for one window.
+      By default it runs the batched kernel on a single column, so a new formula only needs
+      nextDifficulties to run in both the single-chain and the batched paths. It returns None
+      where the formula is undefined;
+    ~ replay(times, current) runs the formula over a whole given array of timestamps, as if
+      they were added to a blockChain one by one, and returns the n + 1 difficulties it would
+      have had after 0, 1, ..., n blocks: entry i is the difficulty of block i, and the last
+      entry the next difficulty. It reads times a chunk at a time: startReplay(n, current)
+      returns a replayState, and replayChunk(state, chunk) carries it over the next chunk of
+      timestamps, so one pass over a file can feed several formulas at once. By default
+      nextDifficulty (or the incremental window) is only called at heights where the formula
+      is due, and every other height is filled in bulk; formulas due at every block override
+      replayChunk with a vectorized recurrence.
+
+An algorithm may also offer makeWindow(), returning an incremental window structure that the
+scalar path keeps up to date block by block, and nextDifficultyFromWindow(window).
+
+Algorithms register themselves by name with registerAlgorithm, and makeAlgorithm builds one for
+a diffForm. Shipped algorithms:
+    ~ "bitcoin": the bitcoin reference formula, retargeting every DIFF_ADJ_PERIOD_BITCOIN blocks;
+    ~ "bitmonero": the CryptoNote reference formula with 1/12 of the timestamps trimmed from
+      either end, every block, kept up to date incrementally by a trimmedWindow;
+    ~ "other": the same sample-rate formula as bitcoin, but with the user's own
+      diffSampleSize and difficultyAdjustmentPeriod;
+    ~ "lwma": zawy12's linearly weighted moving average of solve times, every block;
+    ~ "ema": an exponential moving average, updating from the last solve time every block with
+      smoothing constant diffSampleSize;
+    ~ "constant": difficulty never changes.
+"""
+from windowEstimator import *
+from Constants import *
+
+import collections
+import math
+import numpy
+
+ALGORITHMS = {}
+
+def registerAlgorithm(algorithmClass):
+    """ Class decorator adding an algorithm to the registry under its name. """
+    ALGORITHMS[algorithmClass.name] = algorithmClass
+    return algorithmClass
+
+def makeAlgorithm(diffForm, lambdaTarget, diffSampleSize, timeSampleSize, difficultyAdjustmentPeriod):
+    """ Return the algorithm registered as diffForm, or None if there is no such algorithm. """
+    if(diffForm not in ALGORITHMS):
+        return None
+    return ALGORITHMS[diffForm](lambdaTarget, diffSampleSize, timeSampleSize, difficultyAdjustmentPeriod)
+
+def sampleRateDifficulty(cumDiff, deltaT, lambdaTarget):
+    """ cumDiff/(lambdaTarget*deltaT) for arrays, NaN where deltaT is not positive. """
+    result = numpy.full(numpy.shape(deltaT), numpy.nan)
+    good = deltaT > 0
+    result[good] = cumDiff[good]/(lambdaTarget*deltaT[good].astype(numpy.float64))
+    return result
+
+###########################################################
+
+class difficultyAlgorithm:
+    """ Base class of all difficulty algorithms. """
+
+    name = None
+    # Algorithms with reference parameters pin (diffSampleSize, timeSampleSize,
+    # difficultyAdjustmentPeriod) here; None entries keep what the user asked for.
+    fixedSampleSizes = None
+
+    def __init__(self, lambdaTarget, diffSampleSize, timeSampleSize, difficultyAdjustmentPeriod):
+        sizes = [diffSampleSize, timeSampleSize, difficultyAdjustmentPeriod]
+        if(self.fixedSampleSizes != None):
+            sizes = [fixed if fixed != None else given for fixed, given in zip(self.fixedSampleSizes, sizes)]
+        self.lambdaTarget = lambdaTarget
+        self.diffSampleSize, self.timeSampleSize, self.difficultyAdjustmentPeriod = sizes
+        self.windowSize = self.diffSampleSize
+
+    def isDue(self, blockHeight):
+        return blockHeight > self.windowSize
+
+    def nextDueHeight(self, blockHeight):
+        return max(blockHeight, self.windowSize) + 1
+
+    def makeWindow(self):
+        return None
+
+    def nextDifficulty(self, times, difficulties, current):
+        result = self.nextDifficulties(numpy.asarray(times, dtype=numpy.int64)[:,numpy.newaxis], numpy.asarray(difficulties, dtype=numpy.float64)[:,numpy.newaxis], numpy.array([float(current)]))[0]
+        if(math.isnan(result)):
+            return None
+        return float(result)
+
+    def nextDifficulties(self, times, difficulties, current):
+        raise NotImplementedError("Difficulty algorithm " + str(self.name) + " has no batched kernel.")
+
+    def replay(self, times, current, chunkSize=REPLAY_CHUNK_RECORDS):
+        """ Difficulties after 0, 1, ..., n blocks of times, reading it a chunk at a time. """
+        state = self.startReplay(len(times), current)
+        for start in range(0, len(times), chunkSize):
+            self.replayChunk(state, numpy.asarray(times[start:start+chunkSize], dtype=numpy.int64))
+        return state.result
+
+    def startReplay(self, n, current):
+        return replayState(n, current, self.makeWindow())
+
+    def replayChunk(self, state, chunk):
+        """ Replay the next blocks, whose timestamps are chunk: by default through the incremental
+        window if there is one, else calling nextDifficulty at the heights where it is due. """
+        result = state.result
+        start = state.height
+        stop = start + len(chunk)
+        due = self.isDue(numpy.arange(start + 1, stop + 1))
+        if(state.window != None):
+            window = state.window
+            current = float(result[start])
+            height = start
+            for timeStamp, isDue in zip(chunk.tolist(), due.tolist()):
+                window.push(timeStamp, current)
+                height = height + 1
+                if(isDue):
+                    difficulty = self.nextDifficultyFromWindow(window)
+                    if(difficulty != None):
+                        current = difficulty
+                result[height] = current
+            state.height = stop
+            return
+        w = self.windowSize
+        times = numpy.concatenate((state.tail, chunk))
+        offset = start - len(state.tail) # Height of times[0]
+        last = start # Heights up to last are filled in
+        for height in (numpy.flatnonzero(due) + start + 1).tolist():
+            result[last+1:height] = result[last]
+            # Lists, like the chain columns blockChain passes in, so sums add in the same order.
+            difficulty = self.nextDifficulty(times[height-w-offset:height-offset].tolist(), result[height-w:height].tolist(), result[height-1])
+            result[height] = result[height-1] if difficulty == None else difficulty
+            last = height
+        result[last+1:stop+1] = result[last]
+        state.tail = times[max(0, len(times)-w):]
+        state.height = stop
+
+###########################################################
+
+class replayState:
+    """ Where a replay stands between chunks: the n + 1 difficulties, filled in up to height,
+    the last timestamps before the next chunk and the algorithm's incremental window, if any. """
+
+    def __init__(self, n, current, window=None):
+        self.result = numpy.full(n + 1, float(current))
+        self.height = 0 # Blocks replayed so far
+        self.tail = numpy.zeros(0, dtype=numpy.int64)
+        self.window = window
+
+###########################################################
+
+@registerAlgorithm
+class bitcoinAlgorithm(difficultyAlgorithm):
+    """ Sample rate over the whole window, recomputed every difficultyAdjustmentPeriod blocks. """
+
+    name = "bitcoin"
+    fixedSampleSizes = (DIFF_SAMPLE_SIZE_BITCOIN, TIME_SAMPLE_SIZE_BITCOIN, DIFF_ADJ_PERIOD_BITCOIN)
+
+    def isDue(self, blockHeight):
+        return (blockHeight > self.windowSize) & (blockHeight % self.difficultyAdjustmentPeriod == 0)
+
+    def nextDueHeight(self, blockHeight):
+        period = self.difficultyAdjustmentPeriod
+        return (max(blockHeight, self.windowSize)//period + 1)*period
+
+    def nextDifficulty(self, times, difficulties, current):
+        # Plain Python, so the scalar path keeps the exact left-to-right sum it always had.
+        cumDiff = sum(difficulties)
+        deltaT = max(times) - min(times)
+        if(deltaT > 0):
+            return float(cumDiff)/(self.lambdaTarget*float(deltaT))
+        return None
+
+    def nextDifficulties(self, times, difficulties, current):
+        deltaT = times.max(axis=0) - times.min(axis=0)
+        # cumsum adds strictly left to right, like sum() over a list does, whereas a plain
+        # numpy sum is pairwise and would disagree with the scalar path in the last bits.
+        cumDiff = numpy.cumsum(difficulties, axis=0)[-1]
+        return sampleRateDifficulty(cumDiff, deltaT, self.lambdaTarget)
+
+@registerAlgorithm
+class otherAlgorithm(bitcoinAlgorithm):
+    """ The bitcoin formula with the user's own window and adjustment period. """
+
+    name = "other"
+    fixedSampleSizes = None
+
+###########################################################
+
+@registerAlgorithm
+class bitmoneroAlgorithm(difficultyAlgorithm):
+    """ Trimmed sample rate over the window, recomputed every block. """
+
+    name = "bitmonero"
+    fixedSampleSizes = (DIFF_SAMPLE_SIZE, TIME_SAMPLE_SIZE, None)
+
+    def __init__(self, lambdaTarget, diffSampleSize, timeSampleSize, difficultyAdjustmentPeriod):
+        difficultyAlgorithm.__init__(self, lambdaTarget, diffSampleSize, timeSampleSize, difficultyAdjustmentPeriod)
+        # Slice out the outlying 1/12 blocks from the top and bottom, leaving 5/6.
+        self.toSlice = int(math.floor(1.0/12.0*float(self.windowSize)))
+
+    def makeWindow(self):
+        return trimmedWindow(self.windowSize, self.toSlice)
+
+    def nextDifficultyFromWindow(self, window):
+        deltaT = window.trimmedSpan()
+        if(deltaT > 0):
+            return float(window.trimmedCumulativeDifficulty())/(self.lambdaTarget*float(deltaT))
+        return None
+
+    def nextDifficulty(self, times, difficulties, current):
+        w = self.windowSize
+        sampleTimes = sorted(times)[self.toSlice:w-self.toSlice]
+        deltaT = sampleTimes[-1] - sampleTimes[0]
+        if(deltaT > 0):
+            return float(sum(list(difficulties)[self.toSlice:w-self.toSlice]))/(self.lambdaTarget*float(deltaT))
+        return None
+
+    def nextDifficulties(self, times, difficulties, current):
+        # Order the timestamps (but not difficulty), trim both, then compute the sample rate.
+        w = self.windowSize
+        sampleTimes = numpy.sort(times, axis=0)[self.toSlice:w-self.toSlice]
+        deltaT = sampleTimes[-1] - sampleTimes[0]
+        cumDiff = numpy.cumsum(difficulties[self.toSlice:w-self.toSlice], axis=0)[-1]
+        return sampleRateDifficulty(cumDiff, deltaT, self.lambdaTarget)
+
+###########################################################
+
+@registerAlgorithm
+class lwmaAlgorithm(difficultyAlgorithm):
+    """ zawy12's LWMA: the N = windowSize - 1 most recent solve times, clamped to [-6T, 6T],
+    weighted 1, ..., N from oldest to newest, give next = sum(D)*T*(N+1)/(2*L), where
+    L = sum(i*solvetime_i) is bounded below by N*N*T/20 and T = 1/lambdaTarget. """
+
+    name = "lwma"
+
+    def nextDifficulties(self, times, difficulties, current):
+        T = 1.0/self.lambdaTarget
+        N = self.windowSize - 1
+        solveTimes = numpy.clip(numpy.diff(times, axis=0).astype(numpy.float64), -6.0*T, 6.0*T)
+        weights = numpy.arange(1, N + 1, dtype=numpy.float64)[:,numpy.newaxis]
+        # cumsum adds strictly left to right whatever the number of columns, where sum would add a
+        # single column pairwise, so the scalar, batched and replayed paths round alike.
+        L = numpy.maximum(numpy.cumsum(weights*solveTimes, axis=0)[-1], float(N*N)*T/20.0)
+        return numpy.cumsum(difficulties[1:], axis=0)[-1]*T*float(N + 1)/(2.0*L)
+
+    def startReplay(self, n, current):
+        state = replayState(n, current)
+        state.recent = collections.deque([float(current)]*(self.windowSize - 1)) # The last N difficulties
+        return state
+
+    def replayChunk(self, state, chunk):
+        # L only depends on timestamps, so it is computed for the whole chunk at once; the sum of
+        # the last N difficulties is taken afresh at every height, left to right like the kernel.
+        T = 1.0/self.lambdaTarget
+        N = self.windowSize - 1
+        start = state.height
+        stop = start + len(chunk)
+        times = numpy.concatenate((state.tail, chunk))
+        state.tail = times[max(0, len(times)-N-1):]
+        state.height = stop
+        first = max(self.windowSize + 1, start + 1)
+        if(first > stop):
+            return
+        offset = start - (len(times) - len(chunk)) # Height of times[0]
+        weights = numpy.arange(1, N + 1, dtype=numpy.float64)
+        floor = float(N*N)*T/20.0
+        # Height h uses the N solve times between blocks h - N - 1, ..., h - 1.
+        solveTimes = numpy.clip(numpy.diff(times[first-N-1-offset:stop-offset]).astype(numpy.float64), -6.0*T, 6.0*T)
+        L = numpy.maximum(numpy.cumsum(numpy.lib.stride_tricks.sliding_window_view(solveTimes, N)*weights, axis=1)[:,-1], floor).tolist()
+        recent = state.recent
+        values = []
+        for l in L:
+            value = sum(recent)*T*float(N + 1)/(2.0*l)
+            recent.popleft()
+            recent.append(value)
+            values.append(value)
+        state.result[first:stop+1] = values
+
+@registerAlgorithm
+class emaAlgorithm(difficultyAlgorithm):
+    """ Exponential moving average: next = D*exp((1 - solvetime/T)/N), with the last solve time
+    clamped to [-6T, 6T], T = 1/lambdaTarget and smoothing constant N = diffSampleSize. """
+
+    name = "ema"
+
+    def __init__(self, lambdaTarget, diffSampleSize, timeSampleSize, difficultyAdjustmentPeriod):
+        difficultyAlgorithm.__init__(self, lambdaTarget, diffSampleSize, timeSampleSize, difficultyAdjustmentPeriod)
+        self.windowSize = 2
+
+    def nextDifficulties(self, times, difficulties, current):
+        T = 1.0/self.lambdaTarget
+        solveTime = numpy.clip((times[-1] - times[-2]).astype(numpy.float64), -6.0*T, 6.0*T)
+        return difficulties[-1]*numpy.exp((1.0 - solveTime/T)/float(self.diffSampleSize))
+
+    def replayChunk(self, state, chunk):
+        # Every step multiplies by a factor of the last solve time alone, so the series is a
+        # cumulative product; multiply.accumulate multiplies in order, step by step.
+        T = 1.0/self.lambdaTarget
+        start = state.height
+        stop = start + len(chunk)
+        times = numpy.concatenate((state.tail, chunk))
+        state.tail = times[-1:]
+        state.height = stop
+        first = max(3, start + 1)
+        if(first > stop):
+            return
+        offset = start - (len(times) - len(chunk)) # Height of times[0]
+        # Height h (from 3 on) uses the solve time between blocks h - 2 and h - 1.
+        solveTimes = numpy.clip(numpy.diff(times[first-2-offset:stop-offset]).astype(numpy.float64), -6.0*T, 6.0*T)
+        factors = numpy.exp((1.0 - solveTimes/T)/float(self.diffSampleSize))
+        state.result[first:stop+1] = numpy.multiply.accumulate(numpy.concatenate(([state.result[first-1]], factors)))[1:]
+
+@registerAlgorithm
+class constantAlgorithm(difficultyAlgorithm):
+    """ Difficulty stays wherever it started. """
+
+    name = "constant"
+
+    def isDue(self, blockHeight):
+        return blockHeight < 0
+
+    def nextDueHeight(self, blockHeight):
+        return None
+
+    def nextDifficulties(self, times, difficulties, current):
+        return numpy.array(current, dtype=numpy.float64)
+
+    def replayChunk(self, state, chunk):
+        state.height = state.height + len(chunk)
+
+#####################EOF###################################
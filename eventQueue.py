@@ -0,0 +1,73 @@
+"""
+Priority queue of typed simulation events.
+
+A simulation advances from one event to the next in time order. Every source of events puts its
+next event on the queue only when its own state changes, and takes it back off when it becomes
+stale, instead of every source being asked for its next time on every step:
+
+    ~ BLOCK_FOUND: the pending candidate block, drawn from the arrival rate in force when it
+      was drawn; redrawn (memorylessly) when that rate changes;
+    ~ HASH_RATE_CHANGE: the next changepoint of the hash rate, scheduled when the previous
+      one is reached;
+    ~ DIFFICULTY_RETARGET: a new difficulty came into force with the block just added, so
+      the arrival rate is recomputed and the next block redrawn;
+    ~ CHECKPOINT: the next periodic checkpoint;
+    ~ END_OF_RUN: maxTime.
+
+Events at the same time are taken in the order of their type above, and in the order they were
+pushed within a type, so a changepoint always wins a tie with a block, a block wins a tie with
+a checkpoint, and a block at exactly maxTime is still added. Times are compared, never tested
+for equality.
+
+Cancelled events stay in the heap, marked dead, and are dropped when they come up.
+"""
+import heapq
+
+HASH_RATE_CHANGE = 0
+DIFFICULTY_RETARGET = 1
+BLOCK_FOUND = 2
+CHECKPOINT = 3
+END_OF_RUN = 4
+
+EVENT_NAMES = {HASH_RATE_CHANGE: "hashRateChange", DIFFICULTY_RETARGET: "difficultyRetarget", BLOCK_FOUND: "blockFound", CHECKPOINT: "checkpoint", END_OF_RUN: "endOfRun"}
+
+
+class eventQueue:
+    """ Heap of [time, kind, sequence number, payload, live] entries. """
+
+    def __init__(self):
+        self.heap = []
+        self.pushed = 0
+
+    ###########################################################
+
+    def push(self, time, kind, payload=None):
+        """ Schedule an event of type kind at time; returns its entry, to cancel it by. """
+        entry = [time, kind, self.pushed, payload, True]
+        self.pushed = self.pushed + 1
+        heapq.heappush(self.heap, entry)
+        return entry
+
+    def cancel(self, entry):
+        entry[4] = False
+
+    def pop(self):
+        """ Remove and return the next live entry, or None if there is none. """
+        heap = self.heap
+        while(heap):
+            entry = heapq.heappop(heap)
+            if(entry[4]):
+                return entry
+        return None
+
+    def peek(self):
+        """ The next live entry, left on the queue, or None if there is none. """
+        heap = self.heap
+        while(heap and not heap[0][4]):
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def __len__(self):
+        return sum(1 for entry in self.heap if entry[4])
+
+#####################EOF###################################
@@ -1,7 +1,10 @@
+from simLog import *
 from Constants import *
 import os
 import math
 import errno
+import bisect
+import numpy
 
 """ 
 Continuous-time function, piecewise constant on some partition of an interval of the form [a,b).
@@ -19,6 +22,17 @@ When time[n] <= t, function value will be ONE.
 This class will return the index of the interval t lies within.
 It will also either endpoint of the interval it lies within.
 It will also return the function value of the interval it lies within.
+
+Since time is sorted, every lookup is a bisection, O(log n). On top of that the hashRate keeps
+a cursor at the interval of the last lookup: the simulation clock only ever moves forward, so
+almost every query lands in the same interval as the last one or in the next, and is answered
+in O(1) without bisecting at all. getFunctionValues and getNextChangePoints are vectorized
+versions taking a NumPy array of times.
+
+The hashRate also precomputes the cumulative number of hashes H(t), the integral of the hash
+rate from 0 to t, at every changepoint. H is piecewise linear and increasing, so getArrivalTime
+inverts it with one bisection: a block needing Exp(1)*difficulty hashes after time t arrives at
+getArrivalTime(H(t) + Exp(1)*difficulty), however many changepoints lie in between.
 """
 
 class hashRate:
@@ -49,26 +63,24 @@ class hashRate:
             self.maxTime = params[3]
 
         isDescStr = isinstance(self.description,str)
-        self.make_sure_path_exists("logs")
         if(isDescStr):
-            self.logFileName = "logs/hashRate" + self.description + str(self.maxTime) + "Log.log"
+            self.logFileName = logPath("hashRate" + self.description + str(self.maxTime) + "Log.log")
         else:
-            self.logFileName = "logs/hashRate" + str(self.description) + str(self.maxTime) + "Log.log"
-        self.logFile = open(self.logFileName,"w") # Clear the log file 
-        self.logFile.close() # Clear the log file
+            self.logFileName = logPath("hashRate" + str(self.description) + str(self.maxTime) + "Log.log")
+        self.log = openLog(self.logFileName) # Clear the log file and buffer writes to it
 
         if(not isDescStr):
-            self.printToLog("Error in (blockChain __init__): Description of hash rate function not string.")
+            self.printToLog("Error in (blockChain __init__): Description of hash rate function not string.", ERROR)
+
+        self.cursor = 0 # bisect_right(self.time, t) for the last time t looked up
+        self.timeArray = numpy.asarray(self.time, dtype=numpy.float64)
+        self.valueArray = numpy.asarray(self.values, dtype=numpy.float64)
+        self.setCumulativeHashes()
 
     ###########################################################
 
-    def printToLog(self, text):
-        self.logFile = open(self.logFileName, "a")
-        if(not self.logFile):
-            print("Error in (blockChain __printToLog__): Log file is an empty object!")
-        else:
-            self.logFile.write(text + "\n")
-        self.logFile.close()
+    def printToLog(self, text, level=INFO):
+        self.log.log(level, text)
 
     def make_sure_path_exists(self, path):
         try:
@@ -79,17 +91,60 @@ class hashRate:
     
     ###########################################################
 
+    def bisectRight(self, t):
+        """ Return the number of entries in self.time that are less than or equal to t, that is
+        bisect.bisect_right(self.time, t), checking the cursor and the interval after it first. """
+        time = self.time
+        n = len(time)
+        j = self.cursor
+        if((j == 0 or time[j-1] <= t) and (j == n or t < time[j])):
+            return j
+        if(j < n and time[j] <= t and (j+1 == n or t < time[j+1])):
+            self.cursor = j + 1
+            return j + 1
+        self.cursor = bisect.bisect_right(time, t)
+        return self.cursor
+
+    ###########################################################
+
+    def setCumulativeHashes(self):
+        """ Tabulate H(t) at every knot: 0.0, each changepoint in [0, maxTime], and maxTime.
+        The hash rate is workRates[k] between workKnots[k] and workKnots[k+1], and 1.0 beyond
+        the last knot, as getFunctionValue has it. """
+        knots = numpy.unique(numpy.clip(numpy.concatenate(([0.0], self.timeArray, [float(self.maxTime)])), 0.0, float(self.maxTime)))
+        rates = self.getFunctionValues(knots)
+        hashes = numpy.concatenate(([0.0], numpy.cumsum(rates[:-1]*numpy.diff(knots))))
+        # Lists for the per-block scalar lookups, arrays for the vectorized ones.
+        self.workKnots, self.workRates, self.cumulativeHashes = knots.tolist(), rates.tolist(), hashes.tolist()
+        self.workKnotArray, self.workRateArray, self.cumulativeHashArray = knots, rates, hashes
+
+    def getCumulativeHashes(self, t):
+        """ H(t), the number of hashes computed between time 0 and time t >= 0. """
+        k = bisect.bisect_right(self.workKnots, t) - 1
+        return self.cumulativeHashes[k] + self.workRates[k]*(t - self.workKnots[k])
+
+    def getArrivalTime(self, work):
+        """ Inverse of getCumulativeHashes: the time at which work hashes have been computed. An
+        interval of zero hash rate is never chosen, since H does not grow across it. """
+        k = bisect.bisect_right(self.cumulativeHashes, work) - 1
+        return self.workKnots[k] + (work - self.cumulativeHashes[k])/self.workRates[k]
+
+    def getArrivalTimes(self, work):
+        """ Vectorized getArrivalTime, agreeing with it bit for bit. """
+        k = numpy.searchsorted(self.cumulativeHashArray, work, side="right") - 1
+        return self.workKnotArray[k] + (work - self.cumulativeHashArray[k])/self.workRateArray[k]
+
+    ###########################################################
+
     def getIndexRightEndpoint(self, t=None):
         """ Return index of first entry in self.time that is greater than t or False if none exist. """ 
         resultIndex = False
         if(t==None):
-            self.printToLog("Error in (hashRate getIndexRightEndpoint): Can't find right endpoint for time t=None. Silly.")
+            self.printToLog("Error in (hashRate getIndexRightEndpoint): Can't find right endpoint for time t=None. Silly.", ERROR)
         elif(t < self.time[-1]):
             # Note that if t >= self.time[-1], there is no righthand endpoint, so we return false.
             # Inside this case, we are guaranteed a righthand endpoint.
-            resultIndex = 0
-            while(self.time[resultIndex] <= t):
-                 resultIndex = resultIndex + 1
+            resultIndex = self.bisectRight(t)
         return resultIndex
     
     ###########################################################
@@ -98,14 +153,11 @@ class hashRate:
         """ Return time stamp of first entry in self.time that is greater than t or False if none exist. """ 
         result = False
         if(t==None):
-            self.printToLog("Error in (hashRate getIndexRightEndpoint): Can't find right endpoint for time t=None. Silly.")
+            self.printToLog("Error in (hashRate getIndexRightEndpoint): Can't find right endpoint for time t=None. Silly.", ERROR)
         elif(t < self.time[-1]):
             # Note that if t >= self.time[-1], there is no righthand endpoint, so we return false.
             # Inside this case, we are guaranteed a righthand endpoint.
-            nextChangePointIndex = self.getIndexRightEndpoint(t)
-            result = self.time[nextChangePointIndex]
-#        else:
-#            print("Time has exceeded support, so hash rate should be 1. But we have no more hcangepoints. In fact, time = " + str(t) + " and our last timepoint was " + str(self.time[-1]))
+            result = self.time[self.bisectRight(t)]
         return result
     
     ###########################################################
@@ -114,18 +166,11 @@ class hashRate:
         """ Return index of last entry in self.time that is less than or equal to t, or False if none exist. """ 
         resultIndex = False
         if(t==None):
-            self.printToLog("Error in (hashRate getIndexLeftEndpoint): Can't find left endpoint for time t=None. Silly.")
+            self.printToLog("Error in (hashRate getIndexLeftEndpoint): Can't find left endpoint for time t=None. Silly.", ERROR)
         elif(t >= self.time[0]):
             # Note that if t < self.time[0], there is no lefthand endpoint, so we return false.
-            # Inside this case, we are guaranteed a righthand endpoint.
-            resultIndex = 0
-            weCanStop = False
-            while(resultIndex < len(self.time) and not weCanStop):
-                if(self.time[resultIndex] <= t):
-                    resultIndex = resultIndex + 1
-                else:
-                    weCanStop = True
-                    resultIndex = resultIndex - 1
+            # Inside this case, we are guaranteed a lefthand endpoint.
+            resultIndex = self.bisectRight(t) - 1
         return resultIndex
     
     ###########################################################
@@ -134,22 +179,40 @@ class hashRate:
         """ Return hash function value at time t, or false if not possible for some reason. """
         resultValue = False
         if(t==None):
-            self.printToLog("Error in (hashRate getFunctionValue): Can't find function value for time t=None. Silly.")
+            self.printToLog("Error in (hashRate getFunctionValue): Can't find function value for time t=None. Silly.", ERROR)
         elif(not isinstance(t,float)):
-            self.printToLog("Error in (hashRate getFunctionValue): Can't fund function value at non-float time t = " + str(t))
+            self.printToLog("Error in (hashRate getFunctionValue): Can't fund function value at non-float time t = " + str(t), ERROR)
         elif(t< 0.0 or t >= self.maxTime):
             resultValue = 1.0
-            self.printToLog("Error in (hashRate getFunctionValue): Tried to get hashrate outside of [0, maxTime] at time t = " + str(t))
+            if(traceEnabled()):
+                self.printToLog("Error in (hashRate getFunctionValue): Tried to get hashrate outside of [0, maxTime] at time t = " + str(t), TRACE)
         else:
-            resultIndex = 0
+            # time[i] <= t < time[i+1] exactly when i = bisect_right(time, t) - 1.
+            resultIndex = self.bisectRight(t) - 1
             resultValue = 1.0
-            weCanStop = False
-            while(resultIndex < len(self.values) and not weCanStop):
-                if(self.time[resultIndex] <= t and self.time[resultIndex+1] > t):
-                     resultValue = self.values[resultIndex]
-                     weCanStop = True
-                else:
-                     resultIndex = resultIndex + 1
-            if( not weCanStop):
-                self.printToLog("Error in (hashRate getFunctionValue): time t is within [0, maxTime], but no hashrate function value was returned.")
+            if(resultIndex >= 0 and resultIndex < len(self.values)):
+                resultValue = self.values[resultIndex]
+            else:
+                self.printToLog("Error in (hashRate getFunctionValue): time t is within [0, maxTime], but no hashrate function value was returned.", ERROR)
         return resultValue
+
+    ###########################################################
+
+    def getFunctionValues(self, t):
+        """ Vectorized getFunctionValue: hash rate at every time in the array t. Times outside
+        [0, maxTime), or outside the partition, get the assumed hash rate of 1.0. """
+        t = numpy.asarray(t, dtype=numpy.float64)
+        result = numpy.ones(t.shape)
+        index = numpy.searchsorted(self.timeArray, t, side="right") - 1
+        inside = (t >= 0.0) & (t < self.maxTime) & (index >= 0) & (index < len(self.valueArray))
+        result[inside] = self.valueArray[index[inside]]
+        return result
+
+    def getNextChangePoints(self, t):
+        """ Vectorized getNextChangePoint, with inf in place of False where no changepoint exists. """
+        t = numpy.asarray(t, dtype=numpy.float64)
+        index = numpy.searchsorted(self.timeArray, t, side="right")
+        result = numpy.full(t.shape, numpy.inf)
+        inside = index < len(self.timeArray)
+        result[inside] = self.timeArray[index[inside]]
+        return result
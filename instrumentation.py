@@ -0,0 +1,238 @@
+"""
+Counters, per-phase timers and optional profiling of a simulation run.
+
+An instrumentation object attaches to a simulation for the length of runSim (set
+simulation.instrument, or simulation.instrumentation to an instrumentation of your own). It
+replaces the methods that make up the hot loop, on those very objects, with wrappers that count
+calls and time them, and puts the originals back when the run is over. Nothing in the
+simulation checks whether it is being instrumented, so a run without instrumentation costs
+exactly what it did before.
+
+Time is charged to phases:
+    ~ events: handling the events of the queue and scheduling the next ones;
+    ~ rng: drawing inter-arrival times;
+    ~ hashRate: hash rate lookups, changepoints and arrival time inversions;
+    ~ leap: epoch leaps, besides the draws, lookups and appends they make;
+    ~ miners: bringing the miners of a minerNetwork up to date and picking block finders;
+    ~ timestamps: stamping blocks (distortTime) and checking their timestamps (submitBlock);
+    ~ difficulty: setNextDifficulty, with every call of the formula itself also counted as a
+      difficulty recompute;
+    ~ append: storing blocks in the chain and its incremental windows;
+    ~ sinks: handing blocks to the chainWriter and onlineMetrics during the run;
+    ~ output: writing the output at the end, and flushing streamed output;
+    ~ metrics: folding queued blocks into the online metrics;
+    ~ logging: log records, whether or not their level lets them through;
+    ~ checkpoint: writing checkpoints.
+Times are exclusive: a phase called from within another one, like a lookup inside a leap, is only
+charged to the inner one, so the phases and "loop" (whatever is left of the wall time) add up to
+the run. The wrappers themselves cost a fraction of a microsecond per call, charged to the
+phase they wrap.
+
+Counters come from the calls and the chain: the events handled of each type, the candidate
+blocks drawn one at a time, leaps and the blocks they added, blocks submitted one at a time and
+how many of them were ignored.
+
+With profile set, cProfile records the run, and with traceMemory set, tracemalloc tracks its
+allocations. writeSummary writes all of it as text, beside the run's output
+(outputFileName + INSTRUMENTATION_SUFFIX), and the cProfile statistics to a .prof file next to it
+for pstats or any viewer that reads them.
+"""
+from Constants import *
+
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+
+PHASES = ["events", "rng", "hashRate", "leap", "miners", "timestamps", "difficulty", "append", "sinks", "output", "metrics", "logging", "checkpoint"]
+
+
+class instrumentation:
+    """ Counters and exclusive per-phase timers of the simulation runs it is attached to. """
+
+    profile = PROFILE_RUN
+    traceMemory = TRACE_MEMORY
+    topEntries = PROFILE_TOP_ENTRIES
+
+    ###########################################################
+
+    def __init__(self, profile=None, traceMemory=None):
+        if(profile != None):
+            self.profile = profile
+        if(traceMemory != None):
+            self.traceMemory = traceMemory
+        self.timers = dict((phase, 0.0) for phase in PHASES)
+        self.calls = {} # "object.method" -> number of calls
+        self.counters = {"blockEvents": 0, "hashRateChanges": 0, "retargets": 0, "draws": 0, "leaps": 0, "leapBlocks": 0, "submittedBlocks": 0, "rejectedBlocks": 0, "difficultyRecomputes": 0}
+        self.wallTime = 0.0
+        self.runs = 0
+        self.profiler = cProfile.Profile() if self.profile else None
+        self.peakMemory = None
+        self.memorySnapshot = None
+        self.wrapped = [] # (object, attribute name, whether it was an instance attribute, original)
+        self.stack = [] # Time spent in wrapped calls nested inside each wrapped call in progress
+        self.sim = None
+
+    ###########################################################
+
+    def wrap(self, obj, name, phase, label, counter=None):
+        """ Replace obj.name by a wrapper charging its time to phase and counting its calls under
+        label (and counter, if given). Missing methods are skipped. """
+        if(obj == None or not hasattr(obj, name)):
+            return
+        original = getattr(obj, name)
+        if(original == None):
+            return
+        timers = self.timers
+        calls = self.calls
+        counters = self.counters
+        stack = self.stack
+        clock = time.perf_counter
+        calls.setdefault(label, 0)
+
+        def timed(*args, **kwargs):
+            calls[label] = calls[label] + 1
+            if(counter != None):
+                counters[counter] = counters[counter] + 1
+            stack.append(0.0)
+            start = clock()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                timers[phase] = timers[phase] + elapsed - stack.pop()
+                if(stack):
+                    stack[-1] = stack[-1] + elapsed
+
+        instanceAttribute = name in getattr(obj, "__dict__", {}) or name in getattr(type(obj), "__slots__", ())
+        try:
+            setattr(obj, name, timed)
+        except AttributeError: # A method of a class with __slots__
+            return
+        self.wrapped.append((obj, name, instanceAttribute, original))
+
+    def wrapLeaps(self, s):
+        """ Wrap leapEpoch, also counting the leaps taken and the blocks they added. """
+        original = s.leapEpoch
+        counters = self.counters
+        bc = s.bChain
+
+        def leapEpoch():
+            height = len(bc.timeChain)
+            leapt = original()
+            if(leapt[0]):
+                counters["leaps"] = counters["leaps"] + 1
+                counters["leapBlocks"] = counters["leapBlocks"] + len(bc.timeChain) - height
+            return leapt
+
+        self.wrapped.append((s, "leapEpoch", False, original))
+        s.leapEpoch = leapEpoch
+        self.wrap(s, "leapEpoch", "leap", "simulation.leapEpoch")
+
+    ###########################################################
+
+    def attach(self, s):
+        """ Start instrumenting the simulation s; runSim calls this once its sinks are set up. """
+        self.sim = s
+        self.rejectedAtStart = s.bChain.rejectedBlocks
+        bc = s.bChain
+        for name in ["expovariate", "exponentials", "peekExponentials", "skip"]:
+            self.wrap(s.rng, name, "rng", "rng." + name)
+        for name in ["getFunctionValue", "getFunctionValues", "getNextChangePoint", "getArrivalTime", "getArrivalTimes"]:
+            self.wrap(s.hRate, name, "hashRate", "hRate." + name)
+        self.wrap(s, "setBlockArrivalRate", "hashRate", "simulation.setBlockArrivalRate")
+        # startEvents looks the handlers up when the run starts, so it picks up the wrappers.
+        for name, counter in [("onBlockFound", "blockEvents"), ("onHashRateChange", "hashRateChanges"), ("onDifficultyRetarget", "retargets"), ("onCheckpoint", None), ("onEndOfRun", None), ("scheduleBlock", None), ("scheduleHashRateChange", None)]:
+            self.wrap(s, name, "events", "simulation." + name, counter)
+        self.wrap(s, "drawArrival", "rng", "simulation.drawArrival", "draws")
+        self.wrapLeaps(s)
+        for name in ["advance", "blockFound", "blocksFound"]:
+            self.wrap(s.miners, name, "miners", "miners." + name)
+        self.wrap(s, "distortTime", "timestamps", "simulation.distortTime")
+        self.wrap(bc, "submitBlock", "timestamps", "blockChain.submitBlock", "submittedBlocks")
+        self.wrap(bc, "setNextDifficulty", "difficulty", "blockChain.setNextDifficulty")
+        for name in ["nextDifficulty", "nextDifficultyFromWindow"]:
+            self.wrap(bc.algorithm, name, "difficulty", "algorithm." + name, "difficultyRecomputes")
+        for name in ["addBlock", "addBlocks"]:
+            self.wrap(bc, name, "append", "blockChain." + name)
+        self.wrap(bc.chain, "sink", "sinks", "chain.sink")
+        self.wrap(s, "writeDataToFile", "output", "simulation.writeDataToFile")
+        for name in ["flush", "sync", "close"]:
+            self.wrap(s.writer, name, "output", "writer." + name)
+        self.wrap(s.metrics, "flush", "metrics", "metrics.flush")
+        self.wrap(s.log, "log", "logging", "simulation.log")
+        self.wrap(bc.log, "log", "logging", "blockChain.log")
+        self.wrap(s, "saveCheckpoint", "checkpoint", "simulation.saveCheckpoint")
+
+        if(self.traceMemory):
+            self.startedTracing = not tracemalloc.is_tracing()
+            if(self.startedTracing):
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        if(self.profiler != None):
+            self.profiler.enable()
+        self.start = time.perf_counter()
+
+    def detach(self):
+        """ Put every wrapped method back and fold the run into the totals. """
+        self.wallTime = self.wallTime + time.perf_counter() - self.start
+        if(self.profiler != None):
+            self.profiler.disable()
+        if(self.traceMemory):
+            peak = tracemalloc.get_traced_memory()[1]
+            self.peakMemory = peak if self.peakMemory == None else max(self.peakMemory, peak)
+            self.memorySnapshot = tracemalloc.take_snapshot()
+            if(self.startedTracing):
+                tracemalloc.stop()
+        for obj, name, wasInstanceAttribute, original in reversed(self.wrapped):
+            if(wasInstanceAttribute):
+                setattr(obj, name, original)
+            else:
+                delattr(obj, name)
+        self.wrapped = []
+        self.counters["rejectedBlocks"] = self.counters["rejectedBlocks"] + self.sim.bChain.rejectedBlocks - self.rejectedAtStart
+        self.runs = self.runs + 1
+        self.sim = None
+
+    ###########################################################
+
+    def getSummary(self):
+        """ Counters, per-phase seconds (with "loop" for the rest of the wall time) and calls. """
+        counters = dict(self.counters)
+        timers = dict(self.timers)
+        timers["loop"] = max(self.wallTime - sum(self.timers.values()), 0.0)
+        result = {"runs": self.runs, "wallTime": self.wallTime, "counters": counters, "seconds": timers, "calls": dict(self.calls)}
+        if(self.peakMemory != None):
+            result["peakTracedBytes"] = self.peakMemory
+        return result
+
+    def writeSummary(self, fileName):
+        """ Write getSummary, the top cProfile entries and the top allocation sites as text to
+        fileName, and the raw cProfile statistics to fileName with a .prof extension. """
+        summary = self.getSummary()
+        wall = max(summary["wallTime"], 1e-9)
+        w = open(fileName, "w")
+        w.write("Wall time: " + str(summary["wallTime"]) + " s over " + str(summary["runs"]) + " run(s)\n\nCounters\n")
+        for name in sorted(summary["counters"]):
+            w.write("  " + name + "\t" + str(summary["counters"][name]) + "\n")
+        w.write("\nSeconds per phase (exclusive)\n")
+        for phase in PHASES + ["loop"]:
+            seconds = summary["seconds"][phase]
+            w.write("  " + phase + "\t" + "{:.6f}".format(seconds) + "\t" + "{:.1f}".format(100.0*seconds/wall) + "%\n")
+        w.write("\nCalls\n")
+        for label in sorted(summary["calls"]):
+            w.write("  " + label + "\t" + str(summary["calls"][label]) + "\n")
+        if(self.profiler != None):
+            text = io.StringIO()
+            stats = pstats.Stats(self.profiler, stream=text)
+            stats.sort_stats("cumulative").print_stats(self.topEntries)
+            w.write("\ncProfile, top " + str(self.topEntries) + " by cumulative time\n" + text.getvalue())
+            stats.dump_stats(fileName.rsplit(".", 1)[0] + ".prof")
+        if(self.memorySnapshot != None):
+            w.write("\nPeak traced memory: " + str(self.peakMemory) + " bytes\nTop allocation sites still held at the end\n")
+            for stat in self.memorySnapshot.statistics("lineno")[:self.topEntries]:
+                w.write("  " + str(stat) + "\n")
+        w.close()
+
+#####################EOF###################################
@@ -0,0 +1,282 @@
+"""
+Sweeps sharded over any number of workers and hosts through a job ledger in an SQLite file.
+
+runSweep needs every cell to finish in one pool on one machine. A jobLedger instead expands a
+sweep grid into one record per cell in an SQLite database, and workers anywhere that can open the
+file claim cells from it, one at a time:
+
+    ~ pending cells are claimed in order by a worker, which then sends a heartbeat every
+      LEDGER_HEARTBEAT_SECONDS while it runs the cell (sweep.runCell) and finally completes
+      it with its summary row, or fails it with the error;
+    ~ a failed cell goes back to pending until it has been tried LEDGER_MAX_ATTEMPTS times,
+      and then stays failed (retry puts failed cells back);
+    ~ a running cell whose worker has not sent a heartbeat for LEDGER_LEASE_SECONDS (it was
+      preempted, or crashed) goes back to pending, or to failed past its attempts, the next
+      time anyone claims a cell. A late result of a cell that was handed to someone else is
+      dropped.
+
+Adding a grid to an existing ledger only adds the cells it does not have yet, and done cells are
+never run again, so a sweep is resumed, or extended, by running workers on the same ledger. The
+settings of a ledger (where runs go, whether they write output, the cache) are fixed by the grid
+that created it: later grids keep them, and asking for other ones is an error.
+merge writes the rows of every done cell, in cell order, to the sweep's summary.csv. Runs still
+go to outputDirectory/runNNNNN/ as in sweep.py, with NNNNN the cell's id in the ledger, and may
+share a resultCache.
+
+Claims are transactions of SQLite itself, so any number of processes may use one ledger; across
+hosts the file needs a filesystem with working locks. Everything works on local files alone:
+
+    python jobLedger.py create grid.json sweep.db -o sweep
+    python jobLedger.py work sweep.db -p 8        (as many times, on as many hosts as wanted)
+    python jobLedger.py status sweep.db
+    python jobLedger.py merge sweep.db
+"""
+from sweep import *
+from resultCache import *
+from Constants import *
+
+import argparse
+import errno
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+
+LEDGER_STATES = ["pending", "running", "done", "failed"]
+
+LEDGER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    cellKey TEXT UNIQUE,
+    cell TEXT,
+    state TEXT,
+    attempts INTEGER DEFAULT 0,
+    worker TEXT,
+    heartbeat REAL,
+    result TEXT,
+    error TEXT);
+CREATE INDEX IF NOT EXISTS jobsByState ON jobs (state, id);
+"""
+
+
+class jobLedger:
+    """ The jobs table of one sweep, and its settings, in an SQLite file. """
+
+    leaseSeconds = LEDGER_LEASE_SECONDS
+    maxAttempts = LEDGER_MAX_ATTEMPTS
+
+    ###########################################################
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        # Autocommit: every transaction below is opened explicitly.
+        self.connection = sqlite3.connect(fileName, timeout=60.0, isolation_level=None)
+        self.connection.executescript(LEDGER_SCHEMA)
+        settings = self.getSettings()
+        if("leaseSeconds" in settings):
+            self.leaseSeconds = settings["leaseSeconds"]
+        if("maxAttempts" in settings):
+            self.maxAttempts = settings["maxAttempts"]
+
+    def close(self):
+        self.connection.close()
+
+    def getSettings(self):
+        """ outputDirectory, writeOutput, cacheDirectory, leaseSeconds and maxAttempts. """
+        return dict((name, json.loads(value)) for name, value in self.connection.execute("SELECT name, value FROM settings"))
+
+    ###########################################################
+
+    def addGrid(self, grid, outputDirectory=None, writeOutput=None, cacheDirectory=None):
+        """ Add a pending job for every cell of grid not in the ledger yet, and set where its runs
+        go; returns the number of jobs added. Settings left as None keep what the ledger has, or
+        take their defaults in a new ledger, and settings the ledger has already cannot change:
+        that raises a ValueError. """
+        given = {"outputDirectory": outputDirectory, "writeOutput": writeOutput, "cacheDirectory": cacheDirectory}
+        defaults = {"outputDirectory": SWEEP_DIRECTORY, "writeOutput": False, "cacheDirectory": None, "leaseSeconds": self.leaseSeconds, "maxAttempts": self.maxAttempts}
+        cells = expandGrid(grid)
+        c = self.connection
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            stored = self.getSettings()
+            for name, value in given.items():
+                if(value != None and name in stored and stored[name] != value):
+                    raise ValueError("The ledger " + str(self.fileName) + " has " + name + " " + repr(stored[name]) + ", not " + repr(value) + ".")
+            settings = dict((name, given.get(name) if given.get(name) != None else value) for name, value in defaults.items() if name not in stored)
+            c.executemany("INSERT INTO settings VALUES (?, ?)", [(name, json.dumps(value)) for name, value in settings.items()])
+            before = c.total_changes
+            c.executemany("INSERT OR IGNORE INTO jobs (cellKey, cell, state) VALUES (?, ?, 'pending')", [(json.dumps(canonicalValue(cell), sort_keys=True), json.dumps(cell)) for cell in cells])
+            added = c.total_changes - before
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        return added
+
+    def reclaim(self, now):
+        """ Put the running jobs whose lease ran out back to pending, or to failed past their
+        attempts. Called within the claim transaction. """
+        expired = now - self.leaseSeconds
+        self.connection.execute("UPDATE jobs SET state = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, error = 'Lease expired on ' || worker, worker = NULL WHERE state = 'running' AND heartbeat < ?", (self.maxAttempts, expired))
+
+    def claim(self, worker):
+        """ Claim the next pending job for worker: returns (id, cell), or None if none is left. """
+        c = self.connection
+        now = time.time()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            self.reclaim(now)
+            found = c.execute("SELECT id, cell FROM jobs WHERE state = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if(found != None):
+                c.execute("UPDATE jobs SET state = 'running', worker = ?, heartbeat = ?, attempts = attempts + 1 WHERE id = ?", (worker, now, found[0]))
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        if(found == None):
+            return None
+        return found[0], json.loads(found[1])
+
+    def heartbeat(self, jobId, worker):
+        """ Extend the lease of a job; returns whether worker still holds it. """
+        cursor = self.connection.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? AND state = 'running'", (time.time(), jobId, worker))
+        return cursor.rowcount > 0
+
+    def complete(self, jobId, worker, row):
+        """ Record the summary row of a job; returns False (and drops it) if worker no longer
+        holds the job. """
+        cursor = self.connection.execute("UPDATE jobs SET state = 'done', result = ?, error = NULL, heartbeat = ? WHERE id = ? AND worker = ? AND state = 'running'", (json.dumps(row), time.time(), jobId, worker))
+        return cursor.rowcount > 0
+
+    def fail(self, jobId, worker, error):
+        """ Give a job back after an error, to be retried unless it ran out of attempts. """
+        self.connection.execute("UPDATE jobs SET state = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, error = ?, worker = NULL WHERE id = ? AND worker = ? AND state = 'running'", (self.maxAttempts, error, jobId, worker))
+
+    def retry(self):
+        """ Give every failed job a fresh set of attempts; returns how many there were. """
+        return self.connection.execute("UPDATE jobs SET state = 'pending', attempts = 0 WHERE state = 'failed'").rowcount
+
+    ###########################################################
+
+    def getProgress(self):
+        """ Number of jobs in each state. """
+        progress = dict((state, 0) for state in LEDGER_STATES)
+        progress.update(self.connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+        return progress
+
+    def getFailures(self):
+        """ (id, attempts, error) of every failed job. """
+        return self.connection.execute("SELECT id, attempts, error FROM jobs WHERE state = 'failed' ORDER BY id").fetchall()
+
+    def getResults(self):
+        """ The summary rows of the done jobs, in cell order. """
+        return [json.loads(result) for (result,) in self.connection.execute("SELECT result FROM jobs WHERE state = 'done' ORDER BY id")]
+
+    def merge(self, fileName=None):
+        """ Write the rows of the done jobs to fileName (by default outputDirectory/summary.csv)
+        and return them. """
+        if(fileName == None):
+            fileName = os.path.join(self.getSettings().get("outputDirectory", SWEEP_DIRECTORY), "summary.csv")
+        rows = self.getResults()
+        try:
+            os.makedirs(os.path.dirname(fileName) or ".")
+        except OSError as exception:
+            if exception.errno != errno.EEXIST:
+                raise
+        writeSummary(rows, fileName)
+        return rows
+
+###########################################################
+
+def workerName():
+    return socket.gethostname() + ":" + str(os.getpid())
+
+def runWorker(fileName, worker=None, heartbeatSeconds=LEDGER_HEARTBEAT_SECONDS, maxJobs=None):
+    """ Claim and run jobs of the ledger in fileName until none is left (or maxJobs were run);
+    returns the number of jobs run. """
+    if(worker == None):
+        worker = workerName()
+    ledger = jobLedger(fileName)
+    settings = ledger.getSettings()
+    outputDirectory = settings.get("outputDirectory", SWEEP_DIRECTORY)
+    done = 0
+    try:
+        while(maxJobs == None or done < maxJobs):
+            claimed = ledger.claim(worker)
+            if(claimed == None):
+                break
+            jobId, cell = claimed
+
+            # The heartbeat has its own connection: SQLite connections stay in their thread.
+            stop = threading.Event()
+            def beat():
+                beats = jobLedger(fileName)
+                while(not stop.wait(heartbeatSeconds)):
+                    if(not beats.heartbeat(jobId, worker)):
+                        break
+                beats.close()
+            beating = threading.Thread(target=beat, daemon=True)
+            beating.start()
+            try:
+                row = runCell((jobId, cell, outputDirectory, settings.get("writeOutput", False), settings.get("cacheDirectory")))
+                row["worker"] = worker
+                ledger.complete(jobId, worker, row)
+            except Exception:
+                ledger.fail(jobId, worker, traceback.format_exc())
+            finally:
+                stop.set()
+                beating.join()
+            done = done + 1
+    finally:
+        ledger.close()
+    return done
+
+def runWorkers(fileName, processes=None):
+    """ Run a worker per process (one per core by default) on this host until the ledger in
+    fileName has no pending jobs left; returns the number of jobs run. """
+    if(processes == 1):
+        return runWorker(fileName)
+    if(processes == None):
+        processes = multiprocessing.cpu_count()
+    with poolContext().Pool(processes) as pool:
+        return sum(pool.map(runWorker, [fileName]*processes))
+
+###########################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shard a parameter sweep over workers through a job ledger.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="add the cells of a grid to a ledger, creating it if need be")
+    create.add_argument("grid", help="JSON or TOML file holding the sweep grid")
+    create.add_argument("ledger", help="SQLite ledger file")
+    create.add_argument("-o", "--output", default=None, help="directory for runs and summary.csv (default: the ledger's, or " + SWEEP_DIRECTORY + ")")
+    create.add_argument("--write-output", action="store_true", default=None, help="also write every run's output")
+    create.add_argument("--cache", default=None, help="result cache directory shared by the workers (default: the ledger's, if any)")
+    work = commands.add_parser("work", help="run jobs of a ledger until none is left")
+    work.add_argument("ledger")
+    work.add_argument("-p", "--processes", type=int, default=None, help="worker processes (default: one per core)")
+    for name, text in [("status", "count the jobs in each state"), ("retry", "give failed jobs a fresh set of attempts"), ("merge", "write the summary of the done jobs")]:
+        commands.add_parser(name, help=text).add_argument("ledger")
+    args = parser.parse_args()
+
+    if(args.command == "create"):
+        ledger = jobLedger(args.ledger)
+        print("Added " + str(ledger.addGrid(readDocument(args.grid), args.output, args.write_output, args.cache)) + " jobs to " + args.ledger)
+    elif(args.command == "work"):
+        print("Ran " + str(runWorkers(args.ledger, args.processes)) + " jobs")
+    elif(args.command == "retry"):
+        print("Put back " + str(jobLedger(args.ledger).retry()) + " failed jobs")
+    elif(args.command == "merge"):
+        ledger = jobLedger(args.ledger)
+        print("Merged " + str(len(ledger.merge())) + " runs into " + os.path.join(ledger.getSettings().get("outputDirectory", SWEEP_DIRECTORY), "summary.csv"))
+    ledger = jobLedger(args.ledger)
+    print(", ".join(state + " " + str(count) for state, count in ledger.getProgress().items()))
+    for jobId, attempts, error in ledger.getFailures():
+        print("Job " + str(jobId) + " failed after " + str(attempts) + " attempts: " + str(error).strip().splitlines()[-1])
+
+#####################EOF###################################
@@ -0,0 +1,342 @@
+"""
+Generator-backed hash rates whose changepoints are produced lazily, chunk by chunk.
+
+A hashRate needs its whole partition up front. A lazyHashRate instead describes a stochastic
+process and draws its piecewise constant path on demand, HASHRATE_CHUNK_SEGMENTS segments at a
+time, as queries reach further into the run. It answers the same queries as a hashRate
+(getFunctionValue, getNextChangePoint, their vectorized versions, and the cumulative hash count
+used for integrated arrivals), so it can be passed to a simulation or batchSimulation wherever a
+hashRate goes, for runs with millions of changepoints.
+
+Chunk k is drawn from its own random stream, the child of the seed with spawn key (k,), starting
+from the small state the process was in at the end of chunk k-1 (the current level, regime, ...).
+Only those boundary states are kept for every chunk; the segments themselves live in a cache of
+the HASHRATE_CACHED_CHUNKS most recently used chunks. A chunk that has been evicted is simply
+drawn again, identically, if something (an output writer, say) asks about a time long past. So
+memory is bounded by the cache, plus a few numbers per chunk, however long the run.
+
+After maxTime, as for a hashRate, the hash rate is 1.0 and there are no more changepoints.
+
+Processes register themselves by name with registerLazyHashRate, and makeLazyHashRate rebuilds one
+from getSpec(), which is how checkpoints store them. Shipped processes:
+    ~ "gbm": geometric Brownian motion sampled every step seconds;
+    ~ "regime": a continuous-time Markov chain over levels, leaving regime i after an
+      exponential time with mean meanDurations[i] for a uniformly chosen other regime;
+    ~ "diurnal": a daily (or any period) sinusoidal cycle with log-normal noise every step seconds;
+    ~ "hopping": loyal hash rate plus hoppers who mine here whenever a competing coin, whose
+      relative profitability is a mean-reverting (Ornstein-Uhlenbeck) process, pays less.
+"""
+from simLog import *
+from Constants import *
+
+import bisect
+import collections
+import math
+import numpy
+
+LAZY_HASH_RATES = {}
+
+def registerLazyHashRate(hashRateClass):
+    """ Class decorator adding a lazy hash rate process to the registry under its name. """
+    LAZY_HASH_RATES[hashRateClass.name] = hashRateClass
+    return hashRateClass
+
+def makeLazyHashRate(spec):
+    """ Rebuild the lazyHashRate described by spec, as returned by its getSpec(). """
+    return LAZY_HASH_RATES[spec["name"]](spec["params"], spec["maxTime"], spec["seed"], spec["chunkSegments"])
+
+###########################################################
+
+class hashRateChunk:
+    """ Segments of one chunk: segment i has hash rate values[i] on [times[i], times[i+1]), and
+    hashes[i] hashes have been computed by times[i]. """
+
+    def __init__(self, times, values, hashes):
+        self.timeArray = times
+        self.valueArray = values
+        self.hashArray = hashes
+        # Lists for the per-step scalar lookups.
+        self.times = times.tolist()
+        self.values = values.tolist()
+        self.hashes = hashes.tolist()
+
+###########################################################
+
+class lazyHashRate:
+    """ Base class of all lazily generated hash rates. """
+
+    name = None
+    description = None
+    chunkSegments = HASHRATE_CHUNK_SEGMENTS
+    cachedChunks = HASHRATE_CACHED_CHUNKS
+
+    def __init__(self, params, maxTime=MAX_RUN_TIME, seed=None, chunkSegments=None):
+        self.params = list(params)
+        self.maxTime = maxTime
+        if(chunkSegments != None):
+            self.chunkSegments = chunkSegments
+        # Fix the entropy now, so that the process can be redrawn (or checkpointed) even with seed=None.
+        self.seed = numpy.random.SeedSequence(seed).entropy
+        if(self.description == None):
+            self.description = self.name
+        self.logFileName = logPath("hashRate" + str(self.description) + str(self.maxTime) + "Log.log")
+        self.log = openLog(self.logFileName) # Clear the log file and buffer writes to it
+
+        # Boundary k: chunk k starts at starts[k], with startHashes[k] hashes computed so far
+        # and the process in state states[k]. finalChunk is the chunk reaching maxTime, once drawn.
+        self.starts = [0.0]
+        self.startHashes = [0.0]
+        self.states = [self.initialState()]
+        self.finalChunk = None
+        self.finalHashes = None
+        self.chunks = collections.OrderedDict()
+        self.cursor = 0 # Chunk of the last scalar lookup
+
+    ###########################################################
+
+    def printToLog(self, text, level=INFO):
+        self.log.log(level, text)
+
+    def getSpec(self):
+        """ JSON-friendly description from which makeLazyHashRate rebuilds this hash rate. """
+        return {"name": self.name, "params": self.params, "maxTime": self.maxTime, "seed": self.seed, "chunkSegments": self.chunkSegments}
+
+    ###########################################################
+
+    def initialState(self):
+        raise NotImplementedError("Lazy hash rate " + str(self.name) + " has no initial state.")
+
+    def drawSegments(self, state, generator, startTime, n):
+        """ Return (durations, values, state): n segment durations and hash rates starting from
+        state at startTime, and the state after them. """
+        raise NotImplementedError("Lazy hash rate " + str(self.name) + " cannot draw segments.")
+
+    ###########################################################
+
+    def getChunk(self, k):
+        """ Chunk k, drawn (or redrawn) if it is not in the cache. Chunks are only ever first
+        drawn in order, since each starts where the one before left off. """
+        chunk = self.chunks.get(k)
+        if(chunk != None):
+            self.chunks.move_to_end(k)
+            return chunk
+        while(len(self.starts) <= k):
+            self.getChunk(len(self.starts) - 1)
+
+        generator = numpy.random.Generator(numpy.random.PCG64(numpy.random.SeedSequence(self.seed, spawn_key=(k,))))
+        durations, values, state = self.drawSegments(self.states[k], generator, self.starts[k], self.chunkSegments)
+        times = numpy.concatenate(([self.starts[k]], self.starts[k] + numpy.cumsum(durations)))
+        past = numpy.flatnonzero(times[1:] >= self.maxTime)
+        if(len(past) > 0):
+            # The process stops at maxTime.
+            n = past[0] + 1
+            times = times[:n+1]
+            times[n] = float(self.maxTime)
+            values = values[:n]
+        hashes = numpy.concatenate(([self.startHashes[k]], self.startHashes[k] + numpy.cumsum(numpy.asarray(values)*numpy.diff(times))))
+        chunk = hashRateChunk(times, numpy.asarray(values, dtype=numpy.float64), hashes)
+
+        if(len(past) > 0):
+            self.finalChunk = k
+            self.finalHashes = float(hashes[-1])
+        elif(k == len(self.starts) - 1):
+            self.starts.append(float(times[-1]))
+            self.startHashes.append(float(hashes[-1]))
+            self.states.append(state)
+        self.chunks[k] = chunk
+        if(len(self.chunks) > self.cachedChunks):
+            self.chunks.popitem(last=False)
+        return chunk
+
+    def findChunk(self, t):
+        """ Index of the chunk holding time t, 0 <= t < maxTime, drawing ahead as far as needed. """
+        while(self.finalChunk == None and t >= self.starts[-1]):
+            self.getChunk(len(self.starts) - 1)
+        k = self.cursor
+        if(k < len(self.starts) and self.starts[k] <= t and (k + 1 == len(self.starts) or t < self.starts[k+1])):
+            return k
+        self.cursor = bisect.bisect_right(self.starts, t) - 1
+        return self.cursor
+
+    ###########################################################
+
+    def getFunctionValue(self, t=None):
+        """ Return hash function value at time t, or false if not possible for some reason. """
+        if(t==None):
+            self.printToLog("Error in (lazyHashRate getFunctionValue): Can't find function value for time t=None. Silly.", ERROR)
+            return False
+        if(not isinstance(t,float)):
+            self.printToLog("Error in (lazyHashRate getFunctionValue): Can't fund function value at non-float time t = " + str(t), ERROR)
+            return False
+        if(t < 0.0 or t >= self.maxTime):
+            return 1.0
+        chunk = self.getChunk(self.findChunk(t))
+        return chunk.values[bisect.bisect_right(chunk.times, t) - 1]
+
+    def getNextChangePoint(self, t=None):
+        """ Return the first changepoint after t, or False if there are none. """
+        if(t==None):
+            self.printToLog("Error in (lazyHashRate getNextChangePoint): Can't find right endpoint for time t=None. Silly.", ERROR)
+            return False
+        if(t >= self.maxTime):
+            return False
+        if(t < 0.0):
+            return 0.0
+        chunk = self.getChunk(self.findChunk(t))
+        return chunk.times[bisect.bisect_right(chunk.times, t)]
+
+    def getFunctionValues(self, t):
+        """ Vectorized getFunctionValue. """
+        t = numpy.asarray(t, dtype=numpy.float64)
+        result = numpy.ones(t.shape)
+        inside = (t >= 0.0) & (t < self.maxTime)
+        if(inside.any()):
+            self.findChunk(float(t[inside].max()))
+            chunkIndex = numpy.searchsorted(self.starts, t, side="right") - 1
+            for k in numpy.unique(chunkIndex[inside]).tolist():
+                chunk = self.getChunk(k)
+                these = inside & (chunkIndex == k)
+                result[these] = chunk.valueArray[numpy.searchsorted(chunk.timeArray, t[these], side="right") - 1]
+        return result
+
+    def getNextChangePoints(self, t):
+        """ Vectorized getNextChangePoint, with inf in place of False where no changepoint exists. """
+        t = numpy.asarray(t, dtype=numpy.float64)
+        result = numpy.full(t.shape, numpy.inf)
+        result[t < 0.0] = 0.0
+        inside = (t >= 0.0) & (t < self.maxTime)
+        if(inside.any()):
+            self.findChunk(float(t[inside].max()))
+            chunkIndex = numpy.searchsorted(self.starts, t, side="right") - 1
+            for k in numpy.unique(chunkIndex[inside]).tolist():
+                chunk = self.getChunk(k)
+                these = inside & (chunkIndex == k)
+                result[these] = chunk.timeArray[numpy.searchsorted(chunk.timeArray, t[these], side="right")]
+        return result
+
+    ###########################################################
+
+    def getCumulativeHashes(self, t):
+        """ H(t), the number of hashes computed between time 0 and time t >= 0. """
+        if(t >= self.maxTime):
+            self.findChunk(float(self.maxTime))
+            return self.finalHashes + (t - self.maxTime)
+        chunk = self.getChunk(self.findChunk(t))
+        i = bisect.bisect_right(chunk.times, t) - 1
+        return chunk.hashes[i] + chunk.values[i]*(t - chunk.times[i])
+
+    def findWorkChunk(self, work):
+        """ Index of the chunk in which work hashes have been computed, or None past maxTime. """
+        while(self.finalChunk == None and work >= self.startHashes[-1]):
+            self.getChunk(len(self.starts) - 1)
+        if(self.finalHashes != None and work >= self.finalHashes):
+            return None
+        return bisect.bisect_right(self.startHashes, work) - 1
+
+    def getArrivalTime(self, work):
+        """ Inverse of getCumulativeHashes. Intervals of zero hash rate are never chosen. """
+        k = self.findWorkChunk(work)
+        if(k == None):
+            return self.maxTime + (work - self.finalHashes)
+        chunk = self.getChunk(k)
+        i = bisect.bisect_right(chunk.hashes, work) - 1
+        return chunk.times[i] + (work - chunk.hashes[i])/chunk.values[i]
+
+    def getArrivalTimes(self, work):
+        """ Vectorized getArrivalTime, agreeing with it bit for bit. """
+        work = numpy.asarray(work, dtype=numpy.float64)
+        result = numpy.empty(work.shape)
+        if(len(work) == 0):
+            return result
+        self.findWorkChunk(float(work.max()))
+        past = numpy.zeros(work.shape, dtype=bool)
+        if(self.finalHashes != None):
+            past = work >= self.finalHashes
+            result[past] = self.maxTime + (work[past] - self.finalHashes)
+        chunkIndex = numpy.searchsorted(self.startHashes, work, side="right") - 1
+        for k in numpy.unique(chunkIndex[~past]).tolist():
+            chunk = self.getChunk(k)
+            these = ~past & (chunkIndex == k)
+            i = numpy.searchsorted(chunk.hashArray, work[these], side="right") - 1
+            result[these] = chunk.timeArray[i] + (work[these] - chunk.hashArray[i])/chunk.valueArray[i]
+        return result
+
+###########################################################
+
+@registerLazyHashRate
+class gbmHashRate(lazyHashRate):
+    """ params = [initial, drift, volatility, step]: geometric Brownian motion with the given
+    drift and volatility per second, held constant for step seconds at a time. """
+
+    name = "gbm"
+
+    def initialState(self):
+        return math.log(self.params[0])
+
+    def drawSegments(self, state, generator, startTime, n):
+        initial, drift, volatility, step = self.params
+        increments = (drift - 0.5*volatility*volatility)*step + volatility*math.sqrt(step)*generator.standard_normal(n)
+        logValues = state + numpy.concatenate(([0.0], numpy.cumsum(increments[:-1])))
+        return numpy.full(n, float(step)), numpy.exp(logValues), float(state + increments.sum())
+
+@registerLazyHashRate
+class regimeHashRate(lazyHashRate):
+    """ params = [levels, meanDurations]: hash rate levels[i] in regime i, left after an
+    exponential time with mean meanDurations[i] for a uniformly chosen other regime. """
+
+    name = "regime"
+
+    def initialState(self):
+        return 0
+
+    def drawSegments(self, state, generator, startTime, n):
+        levels = numpy.asarray(self.params[0], dtype=numpy.float64)
+        meanDurations = numpy.asarray(self.params[1], dtype=numpy.float64)
+        m = len(levels)
+        if(m == 1):
+            regimes = numpy.zeros(n, dtype=numpy.int64)
+        else:
+            jumps = generator.integers(1, m, size=n)
+            regimes = (state + numpy.concatenate(([0], numpy.cumsum(jumps[:-1])))) % m
+        durations = generator.standard_exponential(n)*meanDurations[regimes]
+        return durations, levels[regimes], int(regimes[-1] + (jumps[-1] if m > 1 else 0)) % m
+
+@registerLazyHashRate
+class diurnalHashRate(lazyHashRate):
+    """ params = [base, amplitude, period, step, noise]: base*(1 + amplitude*sin(2*pi*t/period))
+    times exp(noise*Z) with Z standard normal, held constant for step seconds at a time. """
+
+    name = "diurnal"
+
+    def initialState(self):
+        return None
+
+    def drawSegments(self, state, generator, startTime, n):
+        base, amplitude, period, step, noise = self.params
+        midpoints = startTime + step*(numpy.arange(n) + 0.5)
+        values = base*(1.0 + amplitude*numpy.sin(2.0*math.pi*midpoints/period))*numpy.exp(noise*generator.standard_normal(n))
+        return numpy.full(n, float(step)), values, None
+
+@registerLazyHashRate
+class hoppingHashRate(lazyHashRate):
+    """ params = [loyal, hopping, reversion, volatility, step]: loyal hash rate, plus hopping
+    hash rate whenever the log relative profitability x of a competing coin is negative. x is
+    an Ornstein-Uhlenbeck process, dx = -reversion*x dt + volatility dW, sampled every step seconds. """
+
+    name = "hopping"
+
+    def initialState(self):
+        return 0.0
+
+    def drawSegments(self, state, generator, startTime, n):
+        loyal, hopping, reversion, volatility, step = self.params
+        decay = math.exp(-reversion*step)
+        spread = volatility*math.sqrt((1.0 - decay*decay)/(2.0*reversion))
+        noise = (spread*generator.standard_normal(n)).tolist()
+        x = numpy.empty(n)
+        for i in range(n):
+            x[i] = state
+            state = decay*state + noise[i]
+        return numpy.full(n, float(step)), loyal + hopping*(x < 0.0), state
+
+#####################EOF###################################
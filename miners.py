@@ -0,0 +1,367 @@
+"""
+Many miners sharing the network hash rate, each with its own schedule and strategy.
+
+A minerNetwork stands in for the hashRate of a simulation (see simulation.setMiners): its hash
+rate is the sum of the rates its miners put in, and the simulation treats it like any other
+hashRate. Blocks still arrive at total rate/difficulty, from one exponential draw per block, and
+the finder of each block is then picked with probability proportional to the miners' rates:
+
+    ~ a rateIndex (a Fenwick tree over the miners' current rates) updates one rate, sums them and
+      maps a uniform draw on [0, total) to a miner in O(log M) each, and does the same for a
+      whole epoch leap's worth of blocks in a handful of array operations;
+    ~ a miner's rate is its schedule (a constant, or any hashRate or lazyHashRate) times the
+      fraction its strategy chooses to mine at the current difficulty. The changepoints of
+      all schedules are kept in a heap, so only the miners whose rate actually changes are
+      touched, and strategies are evaluated for all their miners at once when difficulty moves;
+    ~ advance(t, difficulty) applies everything due by time t; the simulation calls it
+      whenever it recomputes the arrival rate. Every change of the total is recorded, so the
+      output writer and the online metrics look the hash rate up like any other.
+
+Per-miner results come as arrays from getSummary(t): blocks found, revenue (MINER_BLOCK_REWARD
+per block) and hashes computed up to time t.
+
+Strategies register themselves by name with registerMinerStrategy. Shipped strategies, with
+their positional params:
+    ~ "steady": mines its whole schedule whatever the difficulty;
+    ~ "hopper" [maxDifficulty]: mines its whole schedule while the difficulty is at most
+      maxDifficulty, and nothing here otherwise, like a pool hopper;
+    ~ "elastic" [referenceDifficulty, elasticity]: mines a fraction
+      min(1, (referenceDifficulty/difficulty)^elasticity) of its schedule, like a miner
+      switching rigs off as mining gets less profitable.
+"""
+from Constants import *
+
+import array
+import bisect
+import heapq
+import math
+import numpy
+
+MINER_STRATEGIES = {}
+
+def registerMinerStrategy(strategyClass):
+    """ Class decorator adding a miner strategy to the registry under its name. """
+    MINER_STRATEGIES[strategyClass.name] = strategyClass
+    return strategyClass
+
+###########################################################
+
+class rateIndex:
+    """ Fenwick tree of non-negative rates: O(log n) updates, totals and rate-weighted choices.
+    Rounding in the partial sums is reset by rebuilding the tree once every n updates. """
+
+    def __init__(self, rates):
+        self.rates = numpy.array(rates, dtype=numpy.float64)
+        self.n = len(self.rates)
+        self.top = 1 << (self.n.bit_length() - 1) if self.n > 0 else 0
+        self.rebuild()
+
+    def rebuild(self):
+        """ Build the tree from the rates, a level at a time: node i holds the rates of
+        (i - lowbit(i), i], and is complete once the levels below it have been added in. The
+        tree is kept as a list, which is much cheaper to walk one node at a time. """
+        n = self.n
+        tree = numpy.zeros(n + 1)
+        tree[1:] = self.rates
+        step = 1
+        while(step <= n):
+            i = numpy.arange(step, n + 1 - step, 2*step)
+            tree[i + step] = tree[i + step] + tree[i]
+            step = step << 1
+        self.tree = tree.tolist()
+        self.updates = 0
+
+    ###########################################################
+
+    def update(self, i, rate):
+        """ Set the rate of entry i. """
+        delta = rate - float(self.rates[i])
+        self.rates[i] = rate
+        tree = self.tree
+        n = self.n
+        j = i + 1
+        while(j <= n):
+            tree[j] = tree[j] + delta
+            j = j + (j & -j)
+        self.updates = self.updates + 1
+        if(self.updates >= n):
+            self.rebuild()
+
+    def setMany(self, indices, rates):
+        """ Set the rates of many entries at once, rebuilding the tree. """
+        self.rates[indices] = rates
+        self.rebuild()
+
+    def total(self):
+        tree = self.tree
+        result = 0.0
+        j = self.n
+        while(j > 0):
+            result = result + tree[j]
+            j = j - (j & -j)
+        return result
+
+    def find(self, x):
+        """ The entry whose interval of the cumulative rates holds x, for 0 <= x < total(). """
+        tree = self.tree
+        n = self.n
+        position = 0
+        step = self.top
+        while(step):
+            following = position + step
+            if(following <= n and tree[following] <= x):
+                position = following
+                x = x - tree[following]
+            step = step >> 1
+        return min(position, n - 1)
+
+    def findMany(self, xs):
+        """ Vectorized find, with the very same arithmetic for every x. """
+        tree = numpy.array(self.tree)
+        n = self.n
+        x = numpy.array(xs, dtype=numpy.float64)
+        position = numpy.zeros(len(x), dtype=numpy.int64)
+        step = self.top
+        while(step):
+            following = position + step
+            inside = following <= n
+            take = numpy.zeros(len(x), dtype=bool)
+            take[inside] = tree[following[inside]] <= x[inside]
+            position[take] = following[take]
+            x[take] = x[take] - tree[following[take]]
+            step = step >> 1
+        return numpy.minimum(position, n - 1)
+
+###########################################################
+
+class minerStrategy:
+    """ Base class of all strategies; mines the whole schedule. fractions(params, difficulty)
+    returns the fraction of their schedules the miners with the rows of params as their
+    params mine at difficulty. """
+
+    name = None
+
+    def fractions(self, params, difficulty):
+        return numpy.ones(len(params))
+
+@registerMinerStrategy
+class steadyStrategy(minerStrategy):
+    """ Mines the whole schedule whatever the difficulty. """
+
+    name = "steady"
+
+@registerMinerStrategy
+class hopperStrategy(minerStrategy):
+    """ Mines the whole schedule while difficulty is at most params[0], and nothing otherwise. """
+
+    name = "hopper"
+
+    def fractions(self, params, difficulty):
+        return (difficulty <= params[:, 0]).astype(numpy.float64)
+
+@registerMinerStrategy
+class elasticStrategy(minerStrategy):
+    """ Mines min(1, (params[0]/difficulty)^params[1]) of the schedule. """
+
+    name = "elastic"
+
+    def fractions(self, params, difficulty):
+        return numpy.minimum(1.0, (params[:, 0]/float(difficulty))**params[:, 1])
+
+###########################################################
+
+class miner:
+    """ One miner: a schedule (a constant hash rate, or a hashRate or lazyHashRate), and the
+    name and params of the strategy deciding how much of it is mined. """
+
+    def __init__(self, schedule, strategy="steady", params=None, name=None):
+        self.schedule = schedule
+        self.strategy = strategy
+        self.params = list(params or [])
+        self.name = name
+
+    def rateAt(self, t):
+        if(isinstance(self.schedule, (int, float))):
+            return float(self.schedule)
+        return self.schedule.getFunctionValue(t)
+
+    def nextChangePoint(self, t):
+        if(isinstance(self.schedule, (int, float))):
+            return False
+        return self.schedule.getNextChangePoint(t)
+
+###########################################################
+
+class minerNetwork:
+    """ The hash rate of a list of miners, usable wherever a hashRate goes in a simulation. """
+
+    reward = MINER_BLOCK_REWARD
+
+    def __init__(self, miners, maxTime=MAX_RUN_TIME, description=None, reward=None):
+        self.miners = list(miners)
+        self.maxTime = maxTime
+        self.description = description if description != None else "Miners" + str(len(self.miners))
+        if(reward != None):
+            self.reward = reward
+        self.cursor = 0
+        n = len(self.miners)
+        for m in self.miners:
+            if(m.strategy not in MINER_STRATEGIES):
+                raise ValueError("No miner strategy registered as " + str(m.strategy) + ".")
+        # Strategic miners are evaluated together, one array operation per strategy.
+        self.groups = []
+        for name in sorted(MINER_STRATEGIES):
+            if(name == "steady"):
+                continue
+            members = [i for i in range(n) if self.miners[i].strategy == name]
+            if(members):
+                params = numpy.array([self.miners[i].params for i in members], dtype=numpy.float64).reshape(len(members), -1)
+                self.groups.append((MINER_STRATEGIES[name](), numpy.array(members), params, numpy.ones(len(members))))
+
+        self.scheduled = numpy.array([m.rateAt(0.0) for m in self.miners], dtype=numpy.float64) # Schedule values in force
+        self.fraction = numpy.ones(n)
+        self.index = rateIndex(self.scheduled)
+        self.since = numpy.zeros(n) # Time each rate has been in force since
+        self.hashes = numpy.zeros(n) # Hashes computed before that
+        self.blocks = numpy.zeros(n, dtype=numpy.int64)
+        self.changes = [] # Heap of (next schedule changepoint, miner)
+        for i in range(n):
+            self.pushChange(i, 0.0)
+        self.time = 0.0 # Everything up to this time has been applied
+        self.difficulty = None
+        self.total = self.index.total()
+        self.historyTimes = array.array("d", [0.0])
+        self.historyValues = array.array("d", [self.total])
+
+    ###########################################################
+
+    def pushChange(self, i, t):
+        nextChange = self.miners[i].nextChangePoint(t)
+        if(not isinstance(nextChange, bool)):
+            heapq.heappush(self.changes, (nextChange, i))
+
+    def setRates(self, batch, t):
+        """ Bring the rates of the miners in the array batch in line with their schedules and
+        fractions from time t on. When there are many of them, rebuilding the index once is
+        cheaper than updating it for each. """
+        rates = self.index.rates
+        self.hashes[batch] = self.hashes[batch] + rates[batch]*(t - self.since[batch])
+        self.since[batch] = t
+        newRates = self.scheduled[batch]*self.fraction[batch]
+        if(len(batch) * self.index.top.bit_length() < len(self.miners)):
+            for i, rate in zip(batch.tolist(), newRates.tolist()):
+                self.index.update(i, rate)
+        else:
+            self.index.setMany(batch, newRates)
+
+    def record(self, t):
+        self.total = self.index.total()
+        if(self.historyTimes[-1] == t):
+            self.historyValues[-1] = self.total
+        else:
+            self.historyTimes.append(t)
+            self.historyValues.append(self.total)
+
+    def advance(self, t, difficulty):
+        """ Apply every schedule changepoint up to time t and, if difficulty has changed, the
+        miners' strategies. """
+        changes = self.changes
+        while(changes and changes[0][0] <= t):
+            changeTime = changes[0][0]
+            batch = []
+            while(changes and changes[0][0] == changeTime):
+                batch.append(heapq.heappop(changes)[1])
+            for i in batch:
+                self.scheduled[i] = self.miners[i].rateAt(changeTime)
+                self.pushChange(i, changeTime)
+            self.setRates(numpy.array(batch), changeTime)
+            self.record(changeTime)
+        self.time = max(self.time, t)
+        if(difficulty != self.difficulty):
+            self.difficulty = difficulty
+            batch = []
+            for strategy, members, params, current in self.groups:
+                fractions = strategy.fractions(params, difficulty)
+                moved = numpy.flatnonzero(fractions != current)
+                current[moved] = fractions[moved]
+                self.fraction[members[moved]] = fractions[moved]
+                batch.append(members[moved])
+            batch = numpy.concatenate(batch) if batch else numpy.zeros(0, dtype=numpy.int64)
+            if(len(batch)):
+                self.setRates(batch, self.time)
+                self.record(self.time)
+
+    ###########################################################
+
+    def getFunctionValue(self, t):
+        """ Total hash rate at time t: recorded if t has been applied, otherwise what the
+        schedules will make of it with the current strategies. """
+        if(t < self.time):
+            index = bisect.bisect_right(self.historyTimes, t) - 1
+            return self.historyValues[max(index, 0)]
+        changes = self.changes
+        if(not changes or changes[0][0] > t):
+            return self.total
+        result = self.total
+        stack = [0]
+        while(stack):
+            j = stack.pop()
+            if(j < len(changes) and changes[j][0] <= t):
+                i = changes[j][1]
+                result = result + self.miners[i].rateAt(t)*float(self.fraction[i]) - float(self.index.rates[i])
+                stack.extend([2*j + 1, 2*j + 2])
+        return result
+
+    def getFunctionValues(self, t):
+        """ Vectorized getFunctionValue. """
+        t = numpy.asarray(t, dtype=numpy.float64)
+        result = numpy.empty(t.shape)
+        past = t < self.time
+        if(past.any()):
+            times = numpy.frombuffer(self.historyTimes)
+            index = numpy.maximum(numpy.searchsorted(times, t[past], side="right") - 1, 0)
+            result[past] = numpy.frombuffer(self.historyValues)[index]
+            del times
+        for k in numpy.flatnonzero(~past).tolist():
+            result.flat[k] = self.getFunctionValue(float(t.flat[k]))
+        return result
+
+    def getNextChangePoint(self, t=None):
+        """ The first change of the total after t: a recorded one (schedule or strategy) if there
+        is one after t, otherwise the next schedule changepoint still to be applied, or False if
+        there are none. """
+        index = bisect.bisect_right(self.historyTimes, t)
+        if(index < len(self.historyTimes)):
+            return self.historyTimes[index]
+        changes = self.changes
+        if(not changes):
+            return False
+        return changes[0][0]
+
+    ###########################################################
+
+    def blockFound(self, rng):
+        """ Credit a block to a miner chosen in proportion to the current rates, with a uniform
+        draw 1 - exp(-E) made from an Exp(1) variate E of rng. """
+        i = self.index.find(-math.expm1(-rng.exponential())*self.total)
+        self.blocks[i] = self.blocks[i] + 1
+        return i
+
+    def blocksFound(self, rng, n):
+        """ blockFound for n blocks found at the current rates, at once. """
+        uniforms = [-math.expm1(-e) for e in rng.exponentials(n).tolist()]
+        finders = self.index.findMany(numpy.array(uniforms)*self.total)
+        self.blocks = self.blocks + numpy.bincount(finders, minlength=len(self.miners))
+        return finders
+
+    ###########################################################
+
+    def getSummary(self, t):
+        """ Per-miner arrays of blocks found, revenue, and hashes computed up to time t. """
+        hashes = self.hashes + self.index.rates*(t - self.since)
+        return {"names": [m.name for m in self.miners],
+                "blocks": self.blocks.copy(),
+                "revenue": self.blocks*self.reward,
+                "hashes": hashes}
+
+#####################EOF###################################
@@ -0,0 +1,235 @@
+"""
+Online summary statistics of a blockChain, computed while it is being built.
+
+writeDataToFile reports, for every block, the relative error |LambdaTarg - LambdaHat|/LambdaTarg
+where LambdaHat = hashRate/difficulty, and getSummary re-scans the retained chain for its mean
+and maximum. An onlineMetrics object is a chainStorage sink instead (see chainStorage.setSink):
+it sees every block as it is appended and keeps, in O(1) memory per statistic,
+
+    ~ the count, mean, variance, minimum and maximum of the error (Welford's algorithm, merged a
+      chunk at a time with the formula of Chan, Golub and LeVeque),
+    ~ the error quantiles in METRICS_QUANTILES, from a logarithmic-bucket sketch accurate to a
+      relative METRICS_QUANTILE_ACCURACY whatever the order of the stream (the errors of a
+      chain are anything but independent draws, which throws off marker-based estimators),
+    ~ time to recover after each hash rate changepoint: the time from the changepoint to the first
+      of RECOVERY_BLOCKS consecutive blocks with error at most RECOVERY_TOLERANCE, summarized by
+      count, mean and maximum, together with the changepoints never recovered from,
+    ~ the first and last timestamps, for the mean block time.
+
+Blocks are queued and processed in chunks of METRICS_CHUNK_RECORDS, so the hash rate and errors
+are computed with vectorized NumPy operations. Checkpoints save the queue along with the
+statistics, so a resumed run processes exactly the same chunks and ends with the same numbers.
+Because nothing needs the chain afterwards, metrics combine with windowOnly chains to run without
+retaining or writing any blocks at all.
+"""
+from chainWriter import *
+from Constants import *
+
+import array
+import math
+import numpy
+
+
+class quantileSketch:
+    """ Relative-error quantile sketch: a histogram of the stream over logarithmic buckets
+    (gamma^(i-1), gamma^i] with gamma = (1 + accuracy)/(1 - accuracy), so any quantile is
+    returned within a relative error of accuracy of the true value. Zero and negative
+    observations are counted apart. Memory is bounded by the number of distinct buckets, a few
+    hundred per decade spanned by the data, and the order of the stream does not matter. """
+
+    def __init__(self, accuracy=METRICS_QUANTILE_ACCURACY):
+        self.accuracy = accuracy
+        self.gamma = (1.0 + accuracy)/(1.0 - accuracy)
+        self.logGamma = math.log(self.gamma)
+        self.buckets = {} # Bucket index -> count of positive observations
+        self.zeros = 0
+        self.negatives = {} # Value -> count; only the -1.0 flag for a zero difficulty in practice
+        self.count = 0
+
+    def addArray(self, values):
+        """ Add every observation of a NumPy array. """
+        positive = values[values > 0.0]
+        indices, counts = numpy.unique(numpy.ceil(numpy.log(positive)/self.logGamma).astype(numpy.int64), return_counts=True)
+        for index, count in zip(indices.tolist(), counts.tolist()):
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeros = self.zeros + int((values == 0.0).sum())
+        negative, counts = numpy.unique(values[values < 0.0], return_counts=True)
+        for value, count in zip(negative.tolist(), counts.tolist()):
+            self.negatives[value] = self.negatives.get(value, 0) + count
+        self.count = self.count + len(values)
+
+    def quantile(self, p):
+        """ Estimate of the p-quantile, the observation of rank p*(count - 1) in sorted order. """
+        if(self.count == 0):
+            return math.nan
+        rank = p*float(self.count - 1)
+        seen = 0
+        for value in sorted(self.negatives):
+            seen = seen + self.negatives[value]
+            if(seen > rank):
+                return value
+        seen = seen + self.zeros
+        if(seen > rank):
+            return 0.0
+        for index in sorted(self.buckets):
+            seen = seen + self.buckets[index]
+            if(seen > rank):
+                # Midpoint, in relative terms, of (gamma^(i-1), gamma^i].
+                return 2.0*math.exp(index*self.logGamma)/(self.gamma + 1.0)
+        return math.exp(max(self.buckets)*self.logGamma)
+
+    def getState(self):
+        return {"buckets": sorted(self.buckets.items()), "zeros": self.zeros, "negatives": sorted(self.negatives.items()), "count": self.count}
+
+    def setState(self, state):
+        self.buckets = dict((index, count) for index, count in state["buckets"])
+        self.zeros = state["zeros"]
+        self.negatives = dict((value, count) for value, count in state["negatives"])
+        self.count = state["count"]
+
+###########################################################
+
+class onlineMetrics:
+    """ chainStorage sink keeping summary statistics of the per-block relative error. """
+
+    chunkSize = METRICS_CHUNK_RECORDS
+    quantiles = METRICS_QUANTILES
+    recoveryTolerance = RECOVERY_TOLERANCE
+    recoveryBlocks = RECOVERY_BLOCKS
+
+    def __init__(self, hr, lambdaTarget, chunkSize=None):
+        if(chunkSize != None):
+            self.chunkSize = chunkSize
+        self.hr = hr
+        self.lambdaTarget = lambdaTarget
+        self.timestamps = array.array('q')
+        self.difficulties = array.array('d')
+
+        self.count = 0
+        self.mean = 0.0
+        self.sumSquares = 0.0 # Sum of squared deviations from the mean, M2 in Welford's notation
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.sketch = quantileSketch()
+        self.firstTime = None
+        self.lastTime = None
+
+        nextChange = hr.getNextChangePoint(0.0)
+        self.nextChange = None if isinstance(nextChange, bool) else nextChange
+        self.pendingChange = None # Changepoint not recovered from yet
+        self.streak = 0 # Consecutive blocks within tolerance since pendingChange
+        self.streakStart = None
+        self.recoveries = 0
+        self.recoveryMean = 0.0
+        self.recoveryMax = 0.0
+        self.unrecovered = 0 # Changepoints superseded by the next one before recovering
+
+    ###########################################################
+
+    def addBlock(self, height, timeStamp, difficulty):
+        """ chainStorage sink: queue one block, processing a chunk once enough are queued. """
+        self.timestamps.append(timeStamp)
+        self.difficulties.append(difficulty)
+        if(len(self.timestamps) >= self.chunkSize):
+            self.flush()
+
+    def flush(self):
+        """ Fold every queued block into the statistics. """
+        if(len(self.timestamps) == 0):
+            return
+        timestamps = numpy.frombuffer(self.timestamps, dtype=numpy.int64).astype(numpy.float64)
+        difficulties = numpy.frombuffer(self.difficulties)
+        hashes = self.hr.getFunctionValues(timestamps)
+        errors = relativeErrors(self.lambdaTarget, hashes, difficulties)
+
+        n = len(errors)
+        chunkMean = float(errors.mean())
+        chunkSumSquares = float(((errors - chunkMean)**2).sum())
+        total = self.count + n
+        delta = chunkMean - self.mean
+        self.mean = self.mean + delta*float(n)/float(total)
+        self.sumSquares = self.sumSquares + chunkSumSquares + delta*delta*float(self.count)*float(n)/float(total)
+        self.count = total
+        self.minimum = min(self.minimum, float(errors.min()))
+        self.maximum = max(self.maximum, float(errors.max()))
+        if(self.firstTime == None):
+            self.firstTime = float(timestamps[0])
+        self.lastTime = float(timestamps[-1])
+
+        self.sketch.addArray(errors)
+        self.trackRecovery(timestamps.tolist(), errors.tolist())
+
+        self.timestamps = array.array('q')
+        self.difficulties = array.array('d')
+
+    def trackRecovery(self, timestamps, errors):
+        for timeStamp, error in zip(timestamps, errors):
+            while(self.nextChange != None and timeStamp >= self.nextChange):
+                if(self.pendingChange != None):
+                    self.unrecovered = self.unrecovered + 1
+                self.pendingChange = self.nextChange
+                self.streak = 0
+                nextChange = self.hr.getNextChangePoint(self.nextChange)
+                self.nextChange = None if isinstance(nextChange, bool) else nextChange
+            if(self.pendingChange == None):
+                continue
+            if(0.0 <= error <= self.recoveryTolerance):
+                if(self.streak == 0):
+                    self.streakStart = timeStamp
+                self.streak = self.streak + 1
+                if(self.streak >= self.recoveryBlocks):
+                    recovery = self.streakStart - self.pendingChange
+                    self.recoveries = self.recoveries + 1
+                    self.recoveryMean = self.recoveryMean + (recovery - self.recoveryMean)/float(self.recoveries)
+                    self.recoveryMax = max(self.recoveryMax, recovery)
+                    self.pendingChange = None
+            else:
+                self.streak = 0
+
+    ###########################################################
+
+    def getSummary(self):
+        """ The statistics so far as a dictionary, with the keys of blockChain.getSummary for the
+        ones it also reports. """
+        self.flush()
+        result = {"meteredBlocks": self.count}
+        if(self.count > 0):
+            variance = self.sumSquares/float(self.count)
+            result["meanError"] = self.mean
+            result["errorVariance"] = variance
+            result["rmsError"] = math.sqrt(self.mean*self.mean + variance)
+            result["minError"] = self.minimum
+            result["maxError"] = self.maximum
+            for p in self.quantiles:
+                result["errorQuantile" + str(p)] = self.sketch.quantile(p)
+        if(self.count > 1):
+            result["meanBlockTime"] = (self.lastTime - self.firstTime)/float(self.count - 1)
+        result["recoveries"] = self.recoveries
+        result["unrecoveredChanges"] = self.unrecovered + (1 if self.pendingChange != None else 0)
+        if(self.recoveries > 0):
+            result["meanRecoveryTime"] = self.recoveryMean
+            result["maxRecoveryTime"] = self.recoveryMax
+        return result
+
+    def getState(self):
+        """ JSON-friendly state of every statistic, for checkpoints. The queued blocks are not
+        part of it; they are the timestamps and difficulties arrays. """
+        return {"count": self.count, "mean": self.mean, "sumSquares": self.sumSquares,
+                "minimum": self.minimum, "maximum": self.maximum,
+                "sketch": self.sketch.getState(),
+                "firstTime": self.firstTime, "lastTime": self.lastTime,
+                "nextChange": self.nextChange, "pendingChange": self.pendingChange,
+                "streak": self.streak, "streakStart": self.streakStart,
+                "recoveries": self.recoveries, "recoveryMean": self.recoveryMean,
+                "recoveryMax": self.recoveryMax, "unrecovered": self.unrecovered}
+
+    def setState(self, state, timestamps, difficulties):
+        """ Restore getState together with the blocks that were queued. """
+        state = dict(state)
+        self.sketch.setState(state.pop("sketch"))
+        for name in state:
+            setattr(self, name, state[name])
+        self.timestamps = array.array('q', timestamps)
+        self.difficulties = array.array('d', difficulties)
+
+#####################EOF###################################
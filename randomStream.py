@@ -0,0 +1,176 @@
+"""
+Seeded, pre-drawn random streams for the simulation objects.
+
+The simulation only ever needs exponentially distributed inter-arrival times. Building a
+random.SystemRandom() for every candidate block costs an os.urandom syscall per draw and makes
+runs impossible to reproduce, so instead a randomStream wraps a seeded NumPy Generator, draws
+standard exponentials in large blocks and hands them out one at a time from a buffer.
+
+A randomStream is a drop-in replacement for random.SystemRandom() as far as the simulation is
+concerned: expovariate(rate) returns Exp(1)/rate. Any object with an expovariate method may be
+plugged in as simulation.rng instead.
+
+spawn(n) derives n statistically independent child streams (via numpy.random.SeedSequence), one
+per parallel replica. A batchRandomStream holds such a family of children and hands out one draw
+per replica for any subset of replicas at once. Since the underlying Generator produces the same
+sequence whatever the block size, replica i of a batchRandomStream(seed, n) sees exactly the same
+draws as randomStream(seed).spawn(n)[i], so any batch replica can be rerun on the scalar path.
+
+An antitheticStream(seed) is the mirror image of randomStream(seed): where the latter hands out
+Exp(1) = -log(U), the former hands out -log(1 - U) for the very same uniform U, so a run and
+its antithetic replica are negatively correlated. Its children are antithetic too.
+"""
+from Constants import *
+
+import numpy
+
+
+class randomStream:
+    """ Buffered stream of Exp(1) variates from a seeded NumPy Generator. """
+
+    ## Class attributes ##
+    ## These cause the default values of specific instances of this class.
+
+    seed = RANDOM_SEED
+    blockSize = RANDOM_BLOCK_SIZE
+
+    ###########################################################
+
+    def __init__(self, seed=None, blockSize=None, seedSequence=None):
+        if(seedSequence == None):
+            if(seed != None):
+                self.seed = seed
+            seedSequence = numpy.random.SeedSequence(self.seed)
+        if(blockSize != None):
+            self.blockSize = blockSize
+        self.seedSequence = seedSequence
+        self.generator = numpy.random.Generator(numpy.random.PCG64(seedSequence))
+        self.buffer = []
+        self.position = 0
+        self.refillState = None # Generator state the buffer was drawn from, see getState
+
+    ###########################################################
+
+    def refill(self):
+        """ Pre-draw the next block of standard exponentials. A list of Python floats is
+        much cheaper to index one element at a time than a NumPy array. """
+        self.refillState = self.generator.bit_generator.state
+        self.buffer = self.generator.standard_exponential(self.blockSize).tolist()
+        self.position = 0
+
+    def exponential(self):
+        """ Return the next Exp(1) variate of this stream. """
+        if(self.position >= len(self.buffer)):
+            self.refill()
+        result = self.buffer[self.position]
+        self.position = self.position + 1
+        return result
+
+    def expovariate(self, rate):
+        """ Same contract as random.Random.expovariate: exponential with mean 1/rate. """
+        return self.exponential()/rate
+
+    def exponentials(self, n):
+        """ Return the next n Exp(1) variates of this stream as an array, in stream order. """
+        result = numpy.empty(n)
+        filled = 0
+        while(filled < n):
+            if(self.position >= len(self.buffer)):
+                self.refill()
+            take = min(n - filled, len(self.buffer) - self.position)
+            result[filled:filled+take] = self.buffer[self.position:self.position+take]
+            self.position = self.position + take
+            filled = filled + take
+        return result
+
+    def peekExponentials(self, n):
+        """ Return up to n of the upcoming Exp(1) variates as an array without consuming them.
+        Only the current buffer is looked at, so fewer than n (but never none) may come back. """
+        if(self.position >= len(self.buffer)):
+            self.refill()
+        return numpy.array(self.buffer[self.position:self.position+n])
+
+    def skip(self, n):
+        """ Consume n variates returned by peekExponentials. """
+        self.position = self.position + n
+
+    ###########################################################
+
+    def getState(self):
+        """ Return a JSON-friendly dictionary from which setState continues this stream bit for
+        bit. Rather than the pre-drawn variates themselves it holds the generator state they were
+        drawn from and the position reached in them, which setState redraws. """
+        sequence = self.seedSequence
+        drawn = self.refillState != None
+        return {"generator": self.refillState if drawn else self.generator.bit_generator.state,
+                "drawn": drawn,
+                "position": self.position,
+                "entropy": sequence.entropy,
+                "spawnKey": list(sequence.spawn_key),
+                "childrenSpawned": sequence.n_children_spawned,
+                "blockSize": self.blockSize}
+
+    def setState(self, state):
+        """ Continue the stream saved by getState. """
+        self.blockSize = state["blockSize"]
+        self.seedSequence = numpy.random.SeedSequence(state["entropy"], spawn_key=tuple(state["spawnKey"]), n_children_spawned=state["childrenSpawned"])
+        self.generator = numpy.random.Generator(numpy.random.PCG64(self.seedSequence))
+        self.generator.bit_generator.state = state["generator"]
+        self.buffer = []
+        self.position = 0
+        self.refillState = None
+        if(state["drawn"]):
+            self.refill()
+            self.position = state["position"]
+
+    ###########################################################
+
+    def spawn(self, n):
+        """ Return a list of n independent child streams. """
+        return [self.__class__(blockSize=self.blockSize, seedSequence=child) for child in self.seedSequence.spawn(n)]
+
+###########################################################
+
+class antitheticStream(randomStream):
+    """ randomStream handing out -log(1 - U) wherever randomStream(seed) hands out -log(U). """
+
+    def refill(self):
+        self.refillState = self.generator.bit_generator.state
+        draws = self.generator.standard_exponential(self.blockSize)
+        # 1 - exp(-E) underflows to 0 only for E below about 1e-308, where the mirror is huge anyway.
+        self.buffer = (-numpy.log(numpy.maximum(-numpy.expm1(-draws), numpy.finfo(numpy.float64).tiny))).tolist()
+        self.position = 0
+
+    def getState(self):
+        state = randomStream.getState(self)
+        state["antithetic"] = True
+        return state
+
+###########################################################
+
+class batchRandomStream:
+    """ One independent Exp(1) stream per replica, buffered as a (blockSize, numReplicas)
+    array so that draws for many replicas are served by a single fancy index. """
+
+    blockSize = BATCH_RANDOM_BLOCK_SIZE
+
+    ###########################################################
+
+    def __init__(self, seed=None, numReplicas=1, blockSize=None):
+        if(blockSize != None):
+            self.blockSize = blockSize
+        self.streams = randomStream(seed).spawn(numReplicas)
+        self.buffer = numpy.empty((self.blockSize, numReplicas))
+        self.positions = numpy.full(numReplicas, self.blockSize, dtype=numpy.int64)
+
+    def exponentials(self, replicas):
+        """ Return the next Exp(1) variate of each of the given replicas. """
+        exhausted = replicas[self.positions[replicas] >= self.blockSize]
+        for replica in exhausted:
+            self.buffer[:, replica] = self.streams[replica].generator.standard_exponential(self.blockSize)
+        self.positions[exhausted] = 0
+        result = self.buffer[self.positions[replicas], replicas]
+        self.positions[replicas] = self.positions[replicas] + 1
+        return result
+
+#####################EOF###################################
@@ -0,0 +1,138 @@
+"""
+Replay difficulty formulas over a given, e.g. historical, column of block timestamps.
+
+simulation makes up its own timestamps. Replaying instead takes the timestamps of a real chain
+and asks what each difficulty formula would have assigned to its blocks, as if they had been
+added to a blockChain one by one:
+
+    ~ loadColumns(fileName) memory-maps the timestamps (and hash rates, if there are any) without
+      reading them into Python lists. fileName may be an output directory of a chainWriter, a
+      .npy file of integer timestamps, or a raw file of little-endian int64 timestamps; a
+      hash rate column may be given apart in the same forms, as float64;
+    ~ replayDifficulties(times, diffForms, ...) runs every formula over the column in a single
+      pass: each chunk of timestamps is read once and handed to difficultyAlgorithm.replayChunk
+      of every formula in turn. Formulas with sparse recomputations (bitcoin, other) only look
+      at the heights where they are due, bitmonero runs through its incremental trimmedWindow,
+      and ema and lwma use vectorized recurrences, so multi-million-block histories replay in
+      seconds. The results are bit for bit those of blockChain.setNextDifficulty;
+    ~ writeReplay(directory, times, difficulties, hashes, lambdaTarget) writes one chainWriter
+      style output directory per formula (directory/diffForm), so loadChain and exportText
+      read replays just like simulation output. Hash rate and error columns are NaN when no
+      hash rates were given.
+
+From the shell:
+
+    python replay.py timestamps.npy replayed --forms bitcoin bitmonero lwma [--hashrate rates.npy]
+"""
+from difficultyAlgorithms import *
+from chainWriter import *
+from Constants import *
+
+import argparse
+import errno
+import json
+import numpy
+import os
+
+###########################################################
+
+def loadColumn(fileName, dtype):
+    """ Memory-map a .npy file, or a raw binary file of dtype values. """
+    if(fileName.endswith(".npy")):
+        return numpy.load(fileName, mmap_mode="r")
+    return numpy.memmap(fileName, dtype=dtype, mode="r")
+
+def loadColumns(fileName, hashRateFileName=None):
+    """ Return the memory-mapped (timestamps, hash rates) of a replay input, with None for the
+    hash rates if there are none. """
+    hashes = None
+    if(os.path.isdir(fileName)):
+        columns = loadChain(fileName)
+        times = columns["timestamp"]
+        hashes = columns["hashRate"]
+    else:
+        times = loadColumn(fileName, "<i8")
+    if(hashRateFileName != None):
+        hashes = loadColumn(hashRateFileName, "<f8")
+    if(hashes is not None and len(hashes) != len(times)):
+        raise ValueError("Got " + str(len(hashes)) + " hash rates for " + str(len(times)) + " timestamps.")
+    return times, hashes
+
+###########################################################
+
+def replayDifficulties(times, diffForms, lambdaTarget=LAMBDA_TARGET, startingDifficulty=STARTING_DIFFICULTY, difficultyAdjustmentPeriod=DIFF_ADJ_PERIOD, diffSampleSize=DIFF_SAMPLE_SIZE, timeSampleSize=TIME_SAMPLE_SIZE, chunkSize=REPLAY_CHUNK_RECORDS):
+    """ Dictionary from each formula in diffForms to the difficulties of every block of times
+    under it, followed by the difficulty of the next block. times is read once, a chunk at a
+    time, for all the formulas together. """
+    replays = []
+    for diffForm in diffForms:
+        algorithm = makeAlgorithm(diffForm, lambdaTarget, diffSampleSize, timeSampleSize, difficultyAdjustmentPeriod)
+        if(algorithm == None):
+            raise ValueError("No difficulty algorithm registered as " + str(diffForm) + ".")
+        replays.append((diffForm, algorithm, algorithm.startReplay(len(times), startingDifficulty)))
+    for start in range(0, len(times), chunkSize):
+        chunk = numpy.asarray(times[start:start+chunkSize], dtype=numpy.int64)
+        for diffForm, algorithm, state in replays:
+            algorithm.replayChunk(state, chunk)
+    return dict((diffForm, state.result) for diffForm, algorithm, state in replays)
+
+def writeReplay(directory, times, difficulties, hashes=None, lambdaTarget=LAMBDA_TARGET, chunkSize=REPLAY_CHUNK_RECORDS):
+    """ Write the replayed difficulties of each formula to directory/diffForm in the layout of a
+    chainWriter, a chunk at a time. Returns the list of directories written. """
+    written = []
+    n = len(times)
+    for diffForm in sorted(difficulties):
+        path = os.path.join(directory, diffForm)
+        try:
+            os.makedirs(path)
+        except OSError as exception:
+            if exception.errno != errno.EEXIST:
+                raise
+        columns = dict((name, numpy.lib.format.open_memmap(os.path.join(path, name + ".npy"), mode="w+", dtype=descr, shape=(n,))) for name, descr in CHAIN_COLUMNS)
+        for start in range(0, n, chunkSize):
+            stop = min(start + chunkSize, n)
+            blockDifficulties = difficulties[diffForm][start:stop]
+            columns["timestamp"][start:stop] = times[start:stop]
+            columns["difficulty"][start:stop] = blockDifficulties
+            if(hashes is None):
+                columns["hashRate"][start:stop] = numpy.nan
+                columns["error"][start:stop] = numpy.nan
+            else:
+                chunkHashes = numpy.asarray(hashes[start:stop], dtype=numpy.float64)
+                columns["hashRate"][start:stop] = chunkHashes
+                columns["error"][start:stop] = relativeErrors(lambdaTarget, chunkHashes, blockDifficulties)
+        for column in columns.values():
+            column.flush()
+        del columns
+        with open(os.path.join(path, "meta.json"), "w") as w:
+            json.dump({"lambdaTarget": lambdaTarget, "diffForm": diffForm, "hashRate": "replayed", "blocks": n, "nextDifficulty": float(difficulties[diffForm][n])}, w)
+        written.append(path)
+    return written
+
+def replay(fileName, directory, diffForms, hashRateFileName=None, **params):
+    """ Replay every formula of diffForms over the timestamps in fileName and write the results
+    under directory; params are passed on to replayDifficulties. """
+    times, hashes = loadColumns(fileName, hashRateFileName)
+    difficulties = replayDifficulties(times, diffForms, **params)
+    return writeReplay(directory, times, difficulties, hashes, params.get("lambdaTarget", LAMBDA_TARGET))
+
+###########################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay difficulty formulas over a column of block timestamps.")
+    parser.add_argument("timestamps", help="chainWriter output directory, .npy file or raw int64 file of timestamps")
+    parser.add_argument("output", help="directory to write one output directory per formula to")
+    parser.add_argument("--forms", nargs="+", default=[DIFFICULTY_FORMULA], choices=sorted(ALGORITHMS), help="difficulty formulas to replay")
+    parser.add_argument("--hashrate", default=None, help=".npy file or raw float64 file of hash rates, one per block")
+    parser.add_argument("--lambda-target", type=float, default=LAMBDA_TARGET, dest="lambdaTarget")
+    parser.add_argument("--starting-difficulty", type=float, default=STARTING_DIFFICULTY, dest="startingDifficulty")
+    parser.add_argument("--period", type=int, default=DIFF_ADJ_PERIOD, dest="difficultyAdjustmentPeriod")
+    parser.add_argument("--diff-sample-size", type=int, default=DIFF_SAMPLE_SIZE, dest="diffSampleSize")
+    parser.add_argument("--time-sample-size", type=int, default=TIME_SAMPLE_SIZE, dest="timeSampleSize")
+    args = parser.parse_args()
+
+    params = dict((name, getattr(args, name)) for name in ["lambdaTarget", "startingDifficulty", "difficultyAdjustmentPeriod", "diffSampleSize", "timeSampleSize"])
+    for path in replay(args.timestamps, args.output, args.forms, args.hashrate, **params):
+        print("Replay written to " + path)
+
+#####################EOF###################################
@@ -0,0 +1,269 @@
+"""
+Content-addressed on-disk cache of simulation results.
+
+A run is identified by everything that decides its outcome: the settings of its scenario (see
+scenario.py) with the defaults filled in, the hash rate schedule, the seed, and the version of
+the code, i.e. a hash of the source of every module here together with the NumPy version. The
+key of a run is the SHA-256 of the canonical JSON of all of it. Settings that only decide where
+things go or what gets printed (verbose, name, log and output file names, checkpoints) are left
+out, and 100 and 100.0 are the same number. Runs without a seed are never cached, since they are
+not meant to be repeated; a lazy hash rate without a seed of its own is run with the seed of the
+run (scenario.seedScenario), so its path is part of what the key describes.
+
+Every entry is a directory directory/ab/abcdef.../ holding summary.json, the summary of the run
+(simulation.getSummary), and optionally chain/, the run's blocks as a chainWriter output
+directory. Entries are written to a staging directory and renamed into place, so readers never
+see half an entry, and when two processes compute the same run the second one simply drops its
+copy. Hits touch the entry's summary.json, and once the entries take more than maxBytes the
+least recently used ones are evicted, under a lock file shared by every process using the cache
+(fcntl, where the platform has it). Hits are read under the same lock, and since another process
+may evict an entry as soon as it is released, a chain is copied out by a copyChain function that
+run calls with the lock held, rather than read from the cache afterwards:
+
+    cache = resultCache("cache")
+    summary, chainDirectory, hit = cache.run({"diffForm": "lwma", "seed": 3}, storeChain=True, copyChain=lambda chain: shutil.copytree(chain, "lwma"))
+
+sweep.runSweep takes a cache directory, so re-running a grid with a few new cells only
+simulates the new ones.
+"""
+from scenario import *
+from simLog import *
+from Constants import *
+
+import errno
+import glob
+import hashlib
+import json
+import numpy
+import os
+import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError: # No lock files, e.g. on Windows: one process per cache directory
+    fcntl = None
+
+# Settings with no bearing on the result of a run.
+UNCACHED_SETTINGS = ["verbose", "name", "logLevel", "logDirectory", "outputFileName", "outputFormat", "checkpointFileName", "checkpointInterval"]
+
+codeVersions = {}
+
+###########################################################
+
+def codeVersion():
+    """ Hash of the source of every module next to this one and of the NumPy version. """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    if(directory not in codeVersions):
+        digest = hashlib.sha256(numpy.__version__.encode())
+        for fileName in sorted(glob.glob(os.path.join(directory, "*.py"))):
+            digest.update(os.path.basename(fileName).encode())
+            with open(fileName, "rb") as f:
+                digest.update(f.read())
+        codeVersions[directory] = digest.hexdigest()
+    return codeVersions[directory]
+
+def canonicalValue(value):
+    """ value with integral floats as ints, tuples as lists and dictionaries with sorted keys. """
+    if(isinstance(value, float) and value.is_integer()):
+        return int(value)
+    if(isinstance(value, (list, tuple))):
+        return [canonicalValue(item) for item in value]
+    if(isinstance(value, dict)):
+        return dict((str(name), canonicalValue(value[name])) for name in sorted(value))
+    return value
+
+def canonicalScenario(scenario):
+    """ The settings of scenario that decide its result, defaults filled in and the hash rate
+    in table form. """
+    checkScenario(scenario)
+    settings = defaultScenario()
+    settings.update(scenario)
+    settings = seedScenario(settings, settings["seed"])
+    spec = settings["hashRate"]
+    if(not isinstance(spec, dict)):
+        settings["hashRate"] = {"time": spec[0], "values": spec[1], "description": spec[2]}
+    for name in UNCACHED_SETTINGS:
+        settings.pop(name, None)
+    return canonicalValue(settings)
+
+def runKey(scenario):
+    """ Cache key of the run described by scenario, or None if it has no seed. """
+    settings = canonicalScenario(scenario)
+    if(settings.get("seed") == None):
+        return None
+    text = json.dumps({"scenario": settings, "code": codeVersion()}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+###########################################################
+
+class resultCache:
+    """ Size-bounded, least recently used cache of run summaries and chains in a directory. """
+
+    directory = RESULT_CACHE_DIRECTORY
+    maxBytes = RESULT_CACHE_MAX_BYTES
+
+    ###########################################################
+
+    def __init__(self, directory=None, maxBytes=None):
+        if(directory != None):
+            self.directory = directory
+        if(maxBytes != None):
+            self.maxBytes = maxBytes
+        self.staging = os.path.join(self.directory, "staging")
+        try:
+            os.makedirs(self.staging)
+        except OSError as exception:
+            if exception.errno != errno.EEXIST:
+                raise
+        self.hits = 0
+        self.misses = 0
+
+    def entryPath(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    ###########################################################
+
+    def lock(self):
+        """ Open and lock the lock file of the cache; unlock by closing what this returns. """
+        f = open(os.path.join(self.directory, "lock"), "a")
+        if(fcntl != None):
+            fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def get(self, scenario, copyChain=None):
+        """ (summary, chain directory or None) of the cached run described by scenario, or None
+        if there is none. The entry is read with the lock held, and copyChain, if given, is
+        called with the chain directory before the lock is released; afterwards other processes
+        may evict the entry at any time. """
+        key = runKey(scenario)
+        if(key == None):
+            return None
+        path = self.entryPath(key)
+        chain = os.path.join(path, "chain")
+        lock = self.lock()
+        try:
+            try:
+                with open(os.path.join(path, "summary.json")) as f:
+                    summary = json.load(f)
+                os.utime(os.path.join(path, "summary.json"))
+            except (OSError, ValueError): # Missing, or left half written by a crash
+                self.misses = self.misses + 1
+                return None
+            if(not os.path.isdir(chain)):
+                chain = None
+            elif(copyChain != None):
+                copyChain(chain)
+        finally:
+            lock.close()
+        self.hits = self.hits + 1
+        return summary, chain
+
+    def stagingDirectory(self):
+        """ A new directory to build an entry in before put moves it into the cache. """
+        return tempfile.mkdtemp(dir=self.staging)
+
+    def put(self, scenario, summary, staged=None):
+        """ Store the summary of the run described by scenario, with the chain written to
+        staged/chain if staged (from stagingDirectory) is given. Returns the entry's path. """
+        key = runKey(scenario)
+        if(key == None):
+            raise ValueError("Runs without a seed cannot be cached.")
+        if(staged == None):
+            staged = self.stagingDirectory()
+        with open(os.path.join(staged, "summary.json"), "w") as w:
+            json.dump(summary, w)
+        path = self.entryPath(key)
+        lock = self.lock()
+        try:
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as exception:
+                if exception.errno != errno.EEXIST:
+                    raise
+            try:
+                os.rename(staged, path)
+            except OSError: # Another process stored the same run first
+                shutil.rmtree(staged, ignore_errors=True)
+            self.evict()
+        finally:
+            lock.close()
+        return path
+
+    ###########################################################
+
+    def entries(self):
+        """ (last use, bytes, path) of every entry. """
+        result = []
+        for path in glob.glob(os.path.join(self.directory, "??", "*")):
+            size = 0
+            for root, directories, fileNames in os.walk(path):
+                for fileName in fileNames:
+                    size = size + os.path.getsize(os.path.join(root, fileName))
+            try:
+                used = os.path.getmtime(os.path.join(path, "summary.json"))
+            except OSError:
+                used = 0.0
+            result.append((used, size, path))
+        return result
+
+    def evict(self):
+        """ Drop the least recently used entries until the rest fit in maxBytes. Called by put
+        with the lock held. """
+        entries = sorted(self.entries())
+        total = sum(size for used, size, path in entries)
+        for used, size, path in entries:
+            if(total <= self.maxBytes):
+                break
+            self.discard(path)
+            total = total - size
+
+    def discard(self, path):
+        """ Delete the entry at path, moving it out of the way first so that readers see it
+        whole or not at all. Called with the lock held. """
+        doomed = tempfile.mkdtemp(dir=self.staging)
+        try:
+            os.rename(path, os.path.join(doomed, "entry"))
+        except OSError: # Gone already
+            pass
+        shutil.rmtree(doomed, ignore_errors=True)
+
+    def getSize(self):
+        return sum(size for used, size, path in self.entries())
+
+    ###########################################################
+
+    def run(self, scenario, storeChain=False, copyChain=None):
+        """ (summary, chain directory or None, whether it was a hit) of the run described by
+        scenario, simulated and stored if it is not in the cache yet (or is, but without the
+        chain storeChain asks for). copyChain, if given, is called with the chain directory
+        while nothing can evict it, see get. Unseeded runs are simulated every time. """
+        if(not storeChain):
+            copyChain = None
+        cached = self.get(scenario, copyChain)
+        if(cached != None and (cached[1] != None or not storeChain)):
+            return cached[0], cached[1], True
+        if(runKey(scenario) == None):
+            s = makeSimulation(scenario)
+            s.runSim()
+            return s.getSummary(), None, False
+        staged = self.stagingDirectory()
+        settings = seedScenario(scenario, dict(defaultScenario(), **scenario)["seed"])
+        settings["outputFileName"] = os.path.join(staged, "chain") if storeChain else None
+        settings["outputFormat"] = "npy"
+        s = makeSimulation(settings)
+        s.runSim()
+        summary = s.getSummary()
+        if(copyChain != None and os.path.isdir(os.path.join(staged, "chain"))):
+            copyChain(os.path.join(staged, "chain")) # Nobody else sees it until put moves it in
+        if(cached != None): # Replace the entry stored without its chain
+            lock = self.lock()
+            try:
+                self.discard(self.entryPath(runKey(scenario)))
+            finally:
+                lock.close()
+        path = self.put(scenario, summary, staged)
+        chain = os.path.join(path, "chain")
+        return summary, chain if storeChain and os.path.isdir(chain) else None, False
+
+#####################EOF###################################
@@ -0,0 +1,168 @@
+"""
+Declarative scenarios: a whole simulation described by a JSON or TOML file.
+
+A scenario is a dictionary of named settings, anything left out taking its default from
+Constants.py, e.g. in TOML
+
+    diffForm = "lwma"
+    maxTime = 4000000.0
+    seed = 7
+    outputFileName = "data/lwma"
+    outputFormat = "npy"
+
+    [hashRate]
+    time = [0.0, 2000000.0, 4000000.0]
+    values = [100.0, 400.0]
+    description = "Step"
+
+The settings are:
+    ~ the simulation params list, by name: maxTime, lambdaTarget, diffForm, nextDifficulty
+      (the starting difficulty), difficultyAdjustmentPeriod, diffSampleSize, timeSampleSize,
+      hashRate, seed and windowOnly;
+    ~ hashRate as [time, values, description] (the form sweep grids use), as a table with the
+      keys time, values and description, or as a lazy hash rate {"lazy": name, "params": [...]}
+      with optional seed and chunkSegments. Without a seed a lazy hash rate draws a new path
+      every run; seedScenario gives it the seed of the run;
+    ~ the simulation attributes outputFileName, outputFormat, verbose, epochLeap,
+      integratedArrivals, collectMetrics, checkpointFileName and checkpointInterval;
+    ~ timestampPolicy and timestampPolicyParams;
+    ~ miners, a list of {"schedule": ..., "strategy": ..., "params": [...], "name": ...,
+      "count": n} where the schedule is a constant rate or a hash rate in any of the forms
+      above, and count repeats the entry n times; the miners then make up the hash rate, and
+      hashRate is ignored;
+    ~ logLevel and logDirectory, applied before anything is built;
+    ~ name, a label that is otherwise ignored.
+Unknown settings raise a ValueError rather than being silently dropped.
+
+Nothing here, nor in the modules it imports, does any work or touches any file when imported:
+log files are only created when something is written to them, and only the command line entry
+point (simulator.py) runs anything.
+"""
+from hashRate import *
+from lazyHashRate import *
+from simulation import *
+from miners import *
+from simLog import *
+from Constants import *
+
+import json
+
+try:
+    import tomllib
+except ImportError: # Before Python 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+SCENARIO_PARAMETERS = ["maxTime", "lambdaTarget", "diffForm", "nextDifficulty", "difficultyAdjustmentPeriod", "diffSampleSize", "timeSampleSize", "hashRate", "seed", "windowOnly"]
+SCENARIO_ATTRIBUTES = ["outputFileName", "outputFormat", "verbose", "epochLeap", "integratedArrivals", "collectMetrics", "checkpointFileName", "checkpointInterval"]
+SCENARIO_SETTINGS = SCENARIO_PARAMETERS + SCENARIO_ATTRIBUTES + ["timestampPolicy", "timestampPolicyParams", "miners", "logLevel", "logDirectory", "name"]
+
+###########################################################
+
+def readDocument(fileName):
+    """ Parse a JSON file, or a TOML file if fileName ends in .toml. """
+    if(fileName.endswith(".toml")):
+        if(tomllib == None):
+            raise ValueError("Reading " + str(fileName) + " needs tomllib (Python 3.11) or tomli.")
+        with open(fileName, "rb") as f:
+            return tomllib.load(f)
+    with open(fileName) as f:
+        return json.load(f)
+
+def defaultScenario():
+    """ The default value of every simulation parameter, as in Constants.py. """
+    return {"maxTime": MAX_RUN_TIME,
+            "lambdaTarget": LAMBDA_TARGET,
+            "diffForm": DIFFICULTY_FORMULA,
+            "nextDifficulty": STARTING_DIFFICULTY,
+            "difficultyAdjustmentPeriod": DIFF_ADJ_PERIOD,
+            "diffSampleSize": DIFF_SAMPLE_SIZE,
+            "timeSampleSize": TIME_SAMPLE_SIZE,
+            "hashRate": [TIME_EXAMPLE, VALUES_EXAMPLE, DESC_EXAMPLE],
+            "seed": RANDOM_SEED,
+            "windowOnly": False}
+
+def checkScenario(scenario):
+    """ Raise a ValueError if scenario has settings this module does not know. """
+    for name in scenario:
+        if(name not in SCENARIO_SETTINGS):
+            raise ValueError("Unknown scenario setting " + str(name) + ", expected one of " + str(SCENARIO_SETTINGS))
+
+def loadScenario(fileName):
+    """ Read the scenario stored in a JSON or TOML file, with defaults filled in. """
+    document = readDocument(fileName)
+    if(not isinstance(document, dict)):
+        raise ValueError("A scenario file holds a table of settings, " + str(fileName) + " does not.")
+    checkScenario(document)
+    scenario = defaultScenario()
+    scenario.update(document)
+    return scenario
+
+def seedScenario(scenario, seed):
+    """ scenario with the given seed, which a lazy hash rate without a seed of its own gets too,
+    so that the run draws its hash rate path from the seed like everything else rather than
+    from OS entropy. """
+    seeded = dict(scenario, seed=seed)
+    spec = seeded.get("hashRate")
+    if(isinstance(spec, dict) and "lazy" in spec and spec.get("seed") == None):
+        seeded["hashRate"] = dict(spec, seed=seed)
+    return seeded
+
+###########################################################
+
+def makeHashRate(spec, maxTime):
+    """ Build the hashRate or lazyHashRate described by spec, in any of the forms listed above. """
+    if(isinstance(spec, dict)):
+        if("lazy" in spec):
+            if(spec["lazy"] not in LAZY_HASH_RATES):
+                raise ValueError("No lazy hash rate registered as " + str(spec["lazy"]) + ", expected one of " + str(sorted(LAZY_HASH_RATES)))
+            return makeLazyHashRate({"name": spec["lazy"], "params": spec.get("params", []), "maxTime": maxTime, "seed": spec.get("seed"), "chunkSegments": spec.get("chunkSegments")})
+        spec = [spec["time"], spec["values"], spec.get("description", DESC_EXAMPLE)]
+    hashTimes, hashValues, description = spec
+    return hashRate([hashTimes, hashValues, description, maxTime])
+
+def makeMiners(specs, maxTime):
+    """ Build the minerNetwork described by a list of miner entries. """
+    members = []
+    for spec in specs:
+        schedule = spec.get("schedule", 1.0)
+        if(not isinstance(schedule, (int, float))):
+            schedule = makeHashRate(schedule, maxTime) # Shared by the copies of the entry
+        count = spec.get("count", 1)
+        for i in range(count):
+            name = spec.get("name")
+            if(name != None and count > 1):
+                name = name + str(i)
+            members.append(miner(schedule, spec.get("strategy", "steady"), spec.get("params"), name))
+    return minerNetwork(members, maxTime)
+
+def makeSimulation(scenario):
+    """ Build the simulation object described by a scenario. """
+    checkScenario(scenario)
+    settings = defaultScenario()
+    settings.update(scenario)
+    if("logDirectory" in settings):
+        setLogDirectory(settings["logDirectory"])
+    if("logLevel" in settings):
+        setLogLevel(settings["logLevel"])
+
+    hr = makeHashRate(settings["hashRate"], settings["maxTime"])
+    s = simulation([settings[name] if name != "hashRate" else hr for name in SCENARIO_PARAMETERS])
+    for name in SCENARIO_ATTRIBUTES:
+        if(name in settings):
+            setattr(s, name, settings[name])
+    if("timestampPolicy" in settings or "timestampPolicyParams" in settings):
+        s.setTimestampPolicy(settings.get("timestampPolicy", s.timestampPolicyName), settings.get("timestampPolicyParams"))
+    if(settings.get("miners")):
+        s.setMiners(makeMiners(settings["miners"], settings["maxTime"]))
+    return s
+
+def runScenario(scenario):
+    """ Build and run the simulation described by a scenario, and return it. """
+    s = makeSimulation(scenario)
+    s.runSim()
+    return s
+
+#####################EOF###################################
@@ -0,0 +1,132 @@
+"""
+Shared, buffered and levelled logging for every object of the simulation.
+
+Each object used to open its log file, append one line and close it again for every message,
+which on long runs means millions of open/close syscalls. Instead, every log file now belongs to
+one logging.Logger from the standard library, and records are written through either
+
+    ~ a MemoryHandler, which buffers LOG_BUFFER_RECORDS records before writing them out in one
+      go (and writes immediately on anything CRITICAL), or
+    ~ if LOG_BACKGROUND is set, a QueueHandler feeding a QueueListener thread, so the
+      simulation never waits on the disk at all.
+
+Records carry levels. On top of the usual DEBUG, INFO, WARNING, ERROR and CRITICAL there is
+TRACE, below DEBUG, for per-block and per-query messages. The level is shared by every log
+and set with setLogLevel; it starts at LOG_LEVEL. Hot loops should guard trace messages with
+traceEnabled(), so that with tracing off the message strings are never even built:
+
+    if(traceEnabled()):
+        self.printToLog("Block " + str(height) + " ...", TRACE)
+
+Buffered records are written out by flushLogs(), when a log is reopened, and at interpreter exit.
+Worker processes that may exit without running atexit handlers should call closeAllLogs().
+
+Every object names its log file through logPath(), relative to a log directory shared by the
+whole process (LOG_DIRECTORY to begin with), so a sweep can give each run its own logs with
+setLogDirectory() before building the run's objects. Neither the directory nor the file is
+touched until the first record is actually written, so building objects (or importing modules
+that build them) creates and clears no files, and a log that never gets a record is left alone.
+"""
+from Constants import *
+
+import atexit
+import errno
+import logging
+import logging.handlers
+import os
+import queue
+
+from logging import DEBUG, INFO, WARNING, ERROR, CRITICAL
+
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+logSettings = {"level": logging.getLevelName(LOG_LEVEL) if isinstance(LOG_LEVEL, str) else LOG_LEVEL, "directory": LOG_DIRECTORY}
+openLogs = {} # fileName -> [logger, handler, fileHandler, listener or None]
+
+###########################################################
+
+def setLogDirectory(directory):
+    """ Put every log opened from now on in directory. """
+    logSettings["directory"] = directory
+
+def logPath(name):
+    """ Path of the log file called name in the current log directory. """
+    return os.path.join(logSettings["directory"], name)
+
+###########################################################
+
+class lazyFileHandler(logging.FileHandler):
+    """ FileHandler that creates its directory and clears its file only when it writes its first
+    record. """
+
+    def __init__(self, fileName):
+        logging.FileHandler.__init__(self, fileName, mode="w", delay=True)
+
+    def _open(self):
+        try:
+            os.makedirs(os.path.dirname(self.baseFilename))
+        except OSError as exception:
+            if exception.errno != errno.EEXIST:
+                raise
+        return logging.FileHandler._open(self)
+
+def openLog(fileName):
+    """ Return the logger writing to fileName, which is cleared when the first record is written. """
+    closeLog(fileName)
+    fileHandler = lazyFileHandler(fileName)
+    fileHandler.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
+    listener = None
+    if(LOG_BACKGROUND):
+        records = queue.SimpleQueue()
+        handler = logging.handlers.QueueHandler(records)
+        listener = logging.handlers.QueueListener(records, fileHandler)
+        listener.start()
+    else:
+        handler = logging.handlers.MemoryHandler(LOG_BUFFER_RECORDS, flushLevel=CRITICAL, target=fileHandler)
+
+    logger = logging.getLogger("difficulty." + fileName)
+    logger.propagate = False
+    logger.handlers = [handler]
+    logger.setLevel(logSettings["level"])
+    openLogs[fileName] = [logger, handler, fileHandler, listener]
+    return logger
+
+def closeLog(fileName):
+    """ Write out everything buffered for fileName and release the file. """
+    if(fileName in openLogs):
+        logger, handler, fileHandler, listener = openLogs.pop(fileName)
+        if(listener != None):
+            listener.stop()
+        handler.close()
+        fileHandler.close()
+        logger.handlers = []
+
+def flushLogs():
+    """ Write out every buffered record of every open log. """
+    for logger, handler, fileHandler, listener in openLogs.values():
+        if(listener == None):
+            handler.flush()
+        fileHandler.flush()
+
+def closeAllLogs():
+    for fileName in list(openLogs.keys()):
+        closeLog(fileName)
+
+atexit.register(closeAllLogs)
+
+###########################################################
+
+def setLogLevel(level):
+    """ Set the level of every log, e.g. setLogLevel(TRACE) or setLogLevel("WARNING"). """
+    if(isinstance(level, str)):
+        level = logging.getLevelName(level)
+    logSettings["level"] = level
+    for logger, handler, fileHandler, listener in openLogs.values():
+        logger.setLevel(level)
+
+def traceEnabled():
+    """ True if per-block TRACE messages would be written, so callers may skip building them. """
+    return logSettings["level"] <= TRACE
+
+#####################EOF###################################
@@ -1,9 +1,18 @@
 from hashRate import *
+from lazyHashRate import *
+from miners import *
 from blockChain import *
+from randomStream import *
+from timestampPolicies import *
+from eventQueue import *
+from checkpoint import *
+from onlineMetrics import *
+from instrumentation import *
+from simLog import *
 from Constants import *
 
 import math
-import random
+import numpy
 import os
 import errno
 
@@ -25,16 +34,38 @@ class simulation:
     difficultyAdjustmentPeriod = DIFF_ADJ_PERIOD
     diffSampleSize = DIFF_SAMPLE_SIZE
     timeSampleSize = TIME_SAMPLE_SIZE
-
-    bChain = blockChain()
-    hRate = hashRate()
+    seed = RANDOM_SEED
+    windowOnly = CHAIN_WINDOW_ONLY
+    outputFileName = OUTPUT_FILE_NAME # runSim writes nothing if this is None
+    outputFormat = OUTPUT_FORMAT # "text" file written at the end, or "npy" directory streamed during the run
+    verbose = True # Announce each simulated day on stdout
+    epochLeap = EPOCH_LEAP # Draw constant-rate stretches of blocks at once, see leapEpoch
+    integratedArrivals = INTEGRATED_ARRIVALS # Invert cumulative hashes, see drawArrival
+    work = 0.0 # Hashes computed so far, hRate.getCumulativeHashes(clock), for integrated arrivals
+    checkpointFileName = CHECKPOINT_FILE_NAME # No periodic checkpoints if this is None
+    checkpointInterval = CHECKPOINT_INTERVAL
+    lastCheckpoint = 0.0 # Clock at the last checkpoint
+    events = None # eventQueue of the current run, see takeNextStep
+    day = 1 # First day not yet announced, see reportGrowth
+    blockEvent = None # Queue entry of the pending block
+    pendingBlock = None # Arrival time of the block drawn but not yet reached, kept across checkpoints
+    writer = None # chainWriter of the current run when streaming npy output
+    collectMetrics = ONLINE_METRICS # Keep onlineMetrics of the run in self.metrics
+    metrics = None
+    timestampPolicyName = TIMESTAMP_POLICY # How miners stamp their blocks, see timestampPolicies.py
+    timestampPolicyParams = TIMESTAMP_POLICY_PARAMS
+    instrument = INSTRUMENT # Count and time the phases of runSim in self.instrumentation
+    instrumentation = None
+    miners = None # minerNetwork splitting the hash rate between miners, see setMiners
+
+    bChain = None # Built by __init__
+    hRate = None # params[7], or the example hashRate() without params
 
     ###########################################################
 
     def __init__(self,  params = None):
-        if(params==None or not params):
-            self.printToLog("Error in (simulation __init__): No parameters passed in, using defaults.")
-        else:
+        paramsPassedIn = not(params==None or not params)
+        if(paramsPassedIn):
             #print("A simulation object has been initialized. params = " + str(params))
             self.maxTime = params[0]
             self.lambdaTarget = params[1]
@@ -44,25 +75,28 @@ class simulation:
             self.diffSampleSize = params[5]
             self.timeSampleSize = params[6]
             self.hRate = params[7]
-
-
-        self.bChain = blockChain([[],[],self.lambdaTarget, self.diffForm, self.nextDifficulty])
+            if(len(params) > 8):
+                self.seed = params[8]
+            if(len(params) > 9):
+                self.windowOnly = params[9]
+
+        self.logFileName = logPath("simulation" + self.diffForm + str(self.maxTime) + "Log.log")
+        self.log = openLog(self.logFileName) # Clear the log file and buffer writes to it
+        if(not paramsPassedIn):
+            self.hRate = hashRate()
+            self.printToLog("Error in (simulation __init__): No parameters passed in, using defaults.", ERROR)
+
+        # Any object with an expovariate(rate) method may replace self.rng after construction.
+        self.rng = randomStream(self.seed)
+
+        self.bChain = blockChain([[],[],self.lambdaTarget, self.diffForm, self.nextDifficulty, self.diffSampleSize, self.timeSampleSize, self.difficultyAdjustmentPeriod], windowOnly=self.windowOnly)
+        self.setTimestampPolicy()
         self.setBlockArrivalRate();
 
-        self.make_sure_path_exists("logs")
-        self.logFileName = "logs/simulation" + self.diffForm + str(self.maxTime) + "Log.log"
-        temp = open(self.logFileName,"w") # Clear the log file 
-        temp.close() # Clear the log file
-
     ###########################################################
 
-    def printToLog(self, text):
-        self.logFile = open(self.logFileName, "a")
-        if(not self.logFile):
-            print("Error in (blockChain __printToLog__): Log file is an empty object!")
-        else:
-            self.logFile.write(text + "\n")
-        self.logFile.close()
+    def printToLog(self, text, level=INFO):
+        self.log.log(level, text)
 
     def make_sure_path_exists(self, path):
         try:
@@ -73,13 +107,51 @@ class simulation:
     
     ###########################################################
 
+    def setTimestampPolicy(self, name=None, params=None):
+        """ Stamp blocks with the timestamp policy registered as name (by default
+        timestampPolicyName) from now on. A randomized policy draws from a new child of self.rng. """
+        if(name != None):
+            self.timestampPolicyName = name
+            self.timestampPolicyParams = list(params or [])
+        policyClass = TIMESTAMP_POLICIES.get(self.timestampPolicyName)
+        if(policyClass == None):
+            self.printToLog("Error in (simulation setTimestampPolicy): No timestamp policy registered as " + str(self.timestampPolicyName) + ", stamping blocks honestly.", ERROR)
+            self.timestampPolicyName = "honest"
+            self.timestampPolicyParams = []
+            policyClass = TIMESTAMP_POLICIES["honest"]
+        rng = self.rng.spawn(1)[0] if policyClass.randomized else None
+        self.timestampPolicy = makeTimestampPolicy(self.timestampPolicyName, self.timestampPolicyParams, rng)
+
+    def setMiners(self, network):
+        """ Split the hash rate between the miners of the minerNetwork network from now on: it
+        becomes self.hRate, and every block is credited to a miner picked in proportion to the
+        miners' rates, with draws from a new child of self.rng, so that who finds the blocks does
+        not change when they arrive. Runs with miners take accept/reject steps and cannot be
+        checkpointed. """
+        if(self.integratedArrivals):
+            self.printToLog("Error in (simulation setMiners): Integrated arrivals need the hash rate in advance, which miners' strategies decide as they go; taking accept/reject steps.", ERROR)
+            self.integratedArrivals = False
+        self.miners = network
+        self.hRate = network
+        self.minerRng = self.rng.spawn(1)[0]
+        self.pendingBlock = None
+        self.setBlockArrivalRate()
+
+    def getMinerSummary(self):
+        """ Per-miner arrays of blocks found, revenue and hashes computed so far. """
+        return self.miners.getSummary(self.clock)
+
+    ###########################################################
+
     def setBlockArrivalRate(self):
+        if(self.miners != None):
+            self.miners.advance(self.clock, self.bChain.nextDifficulty)
         hr = self.hRate.getFunctionValue(self.clock)
         if(isinstance(hr,bool)):
             if(not hr):
-                self.printToLog("Error in (simulation - setBlockArrivalRate): No index found, hash rate must be 1.0, although that should have been returned.")
+                self.printToLog("Error in (simulation - setBlockArrivalRate): No index found, hash rate must be 1.0, although that should have been returned.", ERROR)
             else:
-                self.printToLog("Error in (simulation - setBlockArrivalRate): Boolean index returned, this should be impossible.")
+                self.printToLog("Error in (simulation - setBlockArrivalRate): Boolean index returned, this should be impossible.", ERROR)
         else:
             self.arrivalRate = self.hRate.getFunctionValue(self.clock)/float(self.bChain.nextDifficulty)
         #print("Block arrival rate is " + str(self.arrivalRate))
@@ -87,90 +159,390 @@ class simulation:
     ###########################################################
 
     def takeNextStep(self):
-        """ Computes block-arrival-times, checks them against hashrate updating times,
-        and rolls forward time until the next block is discovered."""
-
-        noMoreHashes = False
-
-        while(self.clock >= 0.0 and self.clock < self.maxTime):
-            # Accept/reject method of generating randomized timesteps.
-            # Generate exponentially-distributed inter-arrival time to determine a candidate
-            # block arrival time. If that block arrives after the next hashrate change, then 
-            # we move time forward to the next hash change and we try again. If that block
-            # Arrives before the next hashrate change, we move time forward to the block arrival,
-            # we append the block to the blockchain, and in so doing we compute the next diff.
-
-            self.setBlockArrivalRate() # Update block arrival rate
-            u = random.SystemRandom().expovariate(self.arrivalRate) # Random interarrival time, float
-            tempClock = self.clock + u # This is a candidate block arrival time.
-            nextEventTime = min(tempClock, self.maxTime) 
-
-            # Compute the next hash event time.
-            nextHashTime = self.hRate.getNextChangePoint(self.clock)
-            noMoreHashes = isinstance(nextHashTime, bool)
-            # When we are out of hash events, nextHashTime becomes False, so noMoreHashes becomes true.
-            # Once this is the case, we can expect nextEventTime == nextHashTime to regularly return false.
-            
-            if(not noMoreHashes):
-                nextEventTime = min(nextHashTime, nextEventTime) 
-
-            if(nextEventTime == nextHashTime):
-                self.clock = nextHashTime
-                # If the next event is a hash event, roll time forward to that point.
-                
-            elif(nextEventTime == tempClock):
-                # If the next event is a block addition, roll time forward to that point, add block.
-                self.clock = tempClock
-                self.bChain.addBlock(self.distortTime())
-            else:
-                # The only other possibility is the simulation comes to an end.
-                self.clock = self.maxTime
+        """ Takes events off the queue in time order and handles them until maxTime. Each
+        source of events (see eventQueue.py) schedules its next event only when its own state
+        changes: a block is drawn when the arrival rate changes, i.e. at a hash changepoint or
+        when a block brings a new difficulty, and the pending draw is thrown away (arrivals
+        being memoryless) when the rate changes before it arrives. Checkpoints leave it alone,
+        so checkpointing does not change the run."""
+        if(self.clock >= self.maxTime):
+            return
+        self.startEvents()
+        events = self.events
+        handlers = self.handlers
+        while(self.clock < self.maxTime):
+            entry = events.pop()
+            self.clock = entry[0]
+            handlers[entry[1]](entry[3])
+
+    def startEvents(self):
+        """ Put the first event of every source on a new queue. A block drawn before the last
+        run or checkpoint stopped is still pending, and is scheduled as it was. """
+        self.events = eventQueue()
+        self.blockEvent = None
+        self.day = int(self.clock//86400) + 1
+        self.handlers = {HASH_RATE_CHANGE: self.onHashRateChange,
+                         DIFFICULTY_RETARGET: self.onDifficultyRetarget,
+                         BLOCK_FOUND: self.onBlockFound,
+                         CHECKPOINT: self.onCheckpoint,
+                         END_OF_RUN: self.onEndOfRun}
+        self.events.push(self.maxTime, END_OF_RUN)
+        self.setBlockArrivalRate()
+        if(not self.integratedArrivals):
+            self.scheduleHashRateChange()
+        if(self.checkpointFileName != None):
+            self.events.push(max(self.lastCheckpoint + self.checkpointInterval, self.clock), CHECKPOINT)
+        if(self.pendingBlock != None):
+            self.blockEvent = self.events.push(self.pendingBlock, BLOCK_FOUND)
+        else:
+            self.scheduleBlock()
+
+    ###########################################################
 
+    def scheduleHashRateChange(self):
+        """ Schedule the next hash changepoint, if there is one before maxTime. Integrated
+        arrivals do not stop at changepoints, so they never schedule any. """
+        nextHashTime = self.hRate.getNextChangePoint(self.clock)
+        if(not isinstance(nextHashTime, bool) and nextHashTime < self.maxTime):
+            self.events.push(nextHashTime, HASH_RATE_CHANGE)
+
+    def scheduleBlock(self):
+        """ Replace the pending block by one drawn at the current arrival rate. With epochLeap,
+        every block a leap can add before the next event is added first, and the leap hands
+        over the candidate it drew after them. """
+        if(self.blockEvent != None):
+            self.events.cancel(self.blockEvent)
+            self.blockEvent = None
+        arrival = None
+        while(arrival == None):
+            if(self.epochLeap):
+                leapt, arrival = self.leapEpoch()
+                if(leapt):
+                    if(arrival == None): # The leap reached a retarget, or ran out of draws
+                        self.setBlockArrivalRate()
+                    continue
+            arrival = self.drawArrival()
+        self.pendingBlock = arrival
+        self.blockEvent = self.events.push(arrival, BLOCK_FOUND)
+
+    def discardPendingBlock(self):
+        """ Forget the pending block, so the next one is drawn afresh from the current state.
+        With integratedArrivals its draw was already added to self.work, which goes back to
+        the hashes computed up to now. """
+        if(self.blockEvent != None):
+            self.events.cancel(self.blockEvent)
+            self.blockEvent = None
+        self.pendingBlock = None
+        if(self.integratedArrivals):
+            self.work = self.hRate.getCumulativeHashes(self.clock)
+
+    def drawArrival(self):
+        """ Arrival time of the next block at the current arrival rate. With integratedArrivals
+        the block takes Exp(1) times difficulty hashes to find, so it arrives once the
+        cumulative hash count passes self.work plus that many, which hRate.getArrivalTime finds
+        with a single bisection, however many changepoints lie in between. """
+        if(self.integratedArrivals):
+            self.work = self.work + self.rng.expovariate(1.0)*float(self.bChain.nextDifficulty)
+            return self.hRate.getArrivalTime(self.work)
+        return self.clock + self.rng.expovariate(self.arrivalRate)
+
+    ###########################################################
+
+    def onHashRateChange(self, payload):
+        self.setBlockArrivalRate()
+        self.scheduleHashRateChange()
+        self.scheduleBlock()
+
+    def onBlockFound(self, payload):
+        self.blockEvent = None
+        self.pendingBlock = None
+        difficulty = self.bChain.nextDifficulty
+        height = len(self.bChain.timeChain)
+        self.bChain.submitBlock(self.distortTime(), self.clock)
+        if(self.miners != None and len(self.bChain.timeChain) > height):
+            self.miners.blockFound(self.minerRng)
+        self.reportGrowth(height)
+        if(self.bChain.nextDifficulty != difficulty):
+            self.events.push(self.clock, DIFFICULTY_RETARGET)
+        else:
+            self.scheduleBlock()
+
+    def onDifficultyRetarget(self, payload):
+        self.setBlockArrivalRate()
+        self.scheduleBlock()
+
+    def onCheckpoint(self, payload):
+        self.saveCheckpoint()
+        self.events.push(self.lastCheckpoint + self.checkpointInterval, CHECKPOINT)
+
+    def onEndOfRun(self, payload):
+        # The candidate after maxTime is not kept, so a longer run picks up with a fresh draw.
+        self.discardPendingBlock()
+        self.reportGrowth(len(self.bChain.timeChain))
+
+    def reportGrowth(self, height):
+        """ Trace the block height, if the chain grew past height, and announce the days that
+        have passed up to the clock, as the run goes. """
+        newHeight = len(self.bChain.timeChain)
+        if(newHeight != height and traceEnabled()):
+            self.printToLog("Blockchain growth: We are at block height " + str(newHeight) + " at time " + str(self.clock) + " and with difficulty " + str(self.bChain.nextDifficulty) + ". We have appended the timestamp " + str(self.bChain.timeChain[-1]) + ".", TRACE)
+        if(self.verbose):
+            thisSecond = int(math.ceil(self.clock))
+            while(thisSecond > self.day*86400):
+                print("Day " + str(self.day) + " has passed...")
+                self.day = self.day + 1
+
+    ###########################################################
+
+    def leapEpoch(self):
+        """ Fast path of scheduleBlock. Until the next height where difficulty is due and the
+        next event on the queue, the arrival rate is constant, so block arrivals are a
+        homogeneous Poisson process: draw all of their inter-arrival times at once, take a
+        cumulative sum, and append every arrival that comes before that event in one go. The
+        first arrival that does not is consumed and handed back as the next candidate block,
+        just as drawArrival would have drawn it, so runs are the same block for block as
+        ordinary steps.
+
+        With integratedArrivals the changepoints do not matter: the cumulative hash counts of the
+        arrivals are summed instead, and inverted with hRate.getArrivalTimes.
+
+        Blocks are stamped by timestampPolicy.stamps, and the leap stops short of the first one
+        it did not stamp or the network might ignore, which becomes the candidate and is
+        submitted on its own. Returns (whether it leapt, the candidate's arrival time or None if
+        it drew none); it does nothing when too few blocks are left before difficulty may
+        change, when self.rng cannot hand out draws in bulk, when the policy cannot stamp blocks
+        in bulk, or when the very first block needs a step. """
+        if(not hasattr(self.rng, "peekExponentials") or not self.timestampPolicy.bulkStamps):
+            return False, None
+        height = len(self.bChain.timeChain)
+        dueHeight = self.bChain.algorithm.nextDueHeight(height)
+        blocks = RANDOM_BLOCK_SIZE if dueHeight == None else dueHeight - height
+        if(blocks < EPOCH_LEAP_MIN_BLOCKS):
+            return False, None
+
+        draws = self.rng.peekExponentials(blocks)
+        # A one-dimensional cumsum adds strictly left to right, the same additions as step by step.
+        if(self.integratedArrivals):
+            works = numpy.cumsum(numpy.concatenate(([self.work], draws*float(self.bChain.nextDifficulty))))[1:]
+            arrivals = self.hRate.getArrivalTimes(works)
+        else:
+            with numpy.errstate(divide="ignore"): # No hashes at all: every arrival is at infinity.
+                arrivals = numpy.cumsum(numpy.concatenate(([self.clock], draws/self.arrivalRate)))[1:]
+        nextEvent = self.events.peek()
+        if(nextEvent == None):
+            accepted = len(arrivals)
+        else:
+            # Blocks win ties with the events ranked after them, and lose them to the others.
+            accepted = int(numpy.searchsorted(arrivals, nextEvent[0], side="right" if BLOCK_FOUND < nextEvent[1] else "left"))
+
+        if(accepted > 0):
+            stamps = self.timestampPolicy.stamps(arrivals[:accepted], self.bChain)
+            valid = self.bChain.validTimestampCount(stamps, arrivals[:len(stamps)])
+            if(valid == 0):
+                return False, None
+            accepted = valid
+            self.timestampPolicy.skip(accepted)
+
+        self.rng.skip(accepted)
+        if(accepted > 0):
+            self.clock = float(arrivals[accepted-1])
+            self.bChain.addBlocks(stamps[:accepted].tolist())
+            if(self.miners != None):
+                self.miners.blocksFound(self.minerRng, accepted)
+            self.reportGrowth(height)
+        arrival = None
+        if(accepted < len(arrivals)):
+            self.rng.skip(1)
+            arrival = float(arrivals[accepted])
+            accepted = accepted + 1
+        if(self.integratedArrivals and accepted > 0):
+            self.work = float(works[accepted-1])
+        return True, arrival
 
     ###########################################################
 
     def runSim(self):
         """ Run the actual simulation, finishing by writing data to file. """
-        bh = len(self.bChain.timeChain)
-        oldClock = self.clock
-        thisDay = 1
+        streaming = (self.outputFileName != None and self.outputFormat == "npy")
+        if(streaming):
+            # A run resumed from a checkpoint carries on after the blocks already on disk.
+            self.writer = chainWriter(self.outputFileName, self.hRate, self.lambdaTarget, self.diffForm, resumeBlocks=self.bChain.chain.streamed)
+        sinks = []
+        if(streaming):
+            sinks.append(self.writer.addBlock)
+        if(self.collectMetrics):
+            if(self.metrics == None):
+                self.metrics = onlineMetrics(self.hRate, self.lambdaTarget)
+            sinks.append(self.metrics.addBlock)
+        if(sinks):
+            self.bChain.chain.setSink(combineSinks(sinks))
+        if(self.instrument and self.instrumentation == None):
+            self.instrumentation = instrumentation()
+        if(self.instrumentation != None):
+            self.instrumentation.attach(self)
         #print("Beginning simulation.")
-        while(abs(self.clock) < self.maxTime):
-            # Just in case time accidentally runs backwards...
-
-            self.takeNextStep()
-            newClock = self.clock
-            #print("Time has adjusted from " + str(oldClock) + " to " + str(newClock))
-            # Throw an exception and abort the simulation if time isn't moving forward.
-            if(newClock < oldClock):
-                self.printToLog("Critical error in (simulation runSim): time running backwards! Holy shit! Aborting simulation by setting time to the maxTime")
-                self.clock = self.maxTime
-            elif(newClock == oldClock):
-                self.printToLog("Critical error in (simulation runSim): time holding still! Holy shit! Aborting simulation by setting time to the maxTime")
-                self.clock = self.maxTime
-            else: # If time is moving forward correctly, announce when block height has changed or when a day has passed.
-                thisBH = len(self.bChain.timeChain)
-                if(bh != thisBH):
-                    self.printToLog("Blockchain growth: We are at block height " + str(thisBH) + " at time " + str(self.clock) + " and with difficulty " + str(self.bChain.nextDifficulty) + ". We have appended the timestamp " + str(self.bChain.timeChain[-1]) + ".")
-                    bh = thisBH
-                thisSecond = int(math.ceil(self.clock))
-                while(thisSecond > thisDay*86400):
-                    print("Day " + str(thisDay) + " has passed...")
-                    thisDay = thisDay + 1
-        self.printToLog("MaxTime obtained, writing data to file...")
-        print("MaxTime obtained, writing data to file...")
-        self.writeDataToFile("data/output.csv")
+        # The event queue only ever moves time forward, up to maxTime.
+        self.takeNextStep()
+        if(self.metrics != None):
+            self.metrics.flush()
+        if(self.outputFileName != None):
+            self.printToLog("MaxTime obtained, writing data to file...")
+            if(self.verbose):
+                print("MaxTime obtained, writing data to file...")
+            if(streaming):
+                self.writer.close()
+            else:
+                self.writeDataToFile(self.outputFileName)
+        if(self.instrumentation != None):
+            self.instrumentation.detach()
+            if(self.outputFileName != None):
+                self.instrumentation.writeSummary(self.outputFileName + INSTRUMENTATION_SUFFIX)
 
 ###########################################################
 
     def distortTime(self):
-        #TODO: Implement time distortion policies
-
-        return int(math.ceil(self.clock))
+        """ Timestamp of a block found now, according to the timestamp policy. """
+        return self.timestampPolicy.stamp(self.clock, self.bChain)
 
 ###########################################################
 
     def writeDataToFile(self, fileName):
         return self.bChain.writeDataToFile(fileName, self.hRate)
 
+    def getSummary(self):
+        """ blockChain.getSummary, with the error statistics taken from the online metrics over
+        every block (not only the retained ones) if they were collected. """
+        summary = self.bChain.getSummary(self.hRate)
+        if(self.metrics != None):
+            summary.update(self.metrics.getSummary())
+        return summary
+
+###########################################################
+
+    def saveCheckpoint(self, fileName=None):
+        """ Write everything needed to continue this run bit for bit to fileName (by default
+        checkpointFileName): clock, random stream state, retained chain (which the difficulty
+        windows are rebuilt from), next difficulty, hash rate with its cursor and the pending block. Streamed npy output is synced to disk first,
+        so resuming picks up exactly where the checkpoint was taken. """
+        if(fileName == None):
+            fileName = self.checkpointFileName
+        if(not isinstance(self.rng, randomStream)):
+            raise TypeError("Only runs drawing from a randomStream can be checkpointed.")
+        if(self.miners != None):
+            raise TypeError("Runs with miners cannot be checkpointed.")
+        if(self.writer != None):
+            self.writer.sync()
+
+        bc = self.bChain
+        times, difficulties = bc.chain.asArrays()
+        state = {"clock": self.clock,
+                 "work": self.work,
+                 "pendingBlock": self.pendingBlock,
+                 "maxTime": self.maxTime,
+                 "lambdaTarget": self.lambdaTarget,
+                 "diffForm": self.diffForm,
+                 "startingDifficulty": self.nextDifficulty,
+                 "difficultyAdjustmentPeriod": self.difficultyAdjustmentPeriod,
+                 "diffSampleSize": self.diffSampleSize,
+                 "timeSampleSize": self.timeSampleSize,
+                 "seed": self.seed,
+                 "windowOnly": self.windowOnly,
+                 "epochLeap": self.epochLeap,
+                 "integratedArrivals": self.integratedArrivals,
+                 "outputFileName": self.outputFileName,
+                 "outputFormat": self.outputFormat,
+                 "checkpointFileName": self.checkpointFileName,
+                 "checkpointInterval": self.checkpointInterval,
+                 "timestampPolicy": self.timestampPolicyName,
+                 "timestampPolicyParams": self.timestampPolicyParams,
+                 "timestampPolicyState": self.timestampPolicy.getState(),
+                 "rejectedBlocks": bc.rejectedBlocks,
+                 "chainLength": len(bc.timeChain),
+                 "nextDifficulty": bc.nextDifficulty,
+                 "streamedBlocks": bc.chain.streamed,
+                 "collectMetrics": self.collectMetrics,
+                 "metrics": self.metrics.getState() if self.metrics != None else None,
+                 "rng": self.rng.getState(),
+                 "hashRate": {"description": str(self.hRate.description), "maxTime": self.hRate.maxTime, "cursor": self.hRate.cursor}}
+        arrays = {"chainTimes": times,
+                  "chainDifficulties": difficulties}
+        if(isinstance(self.hRate, lazyHashRate)):
+            # A lazy hash rate is stored by its recipe; it redraws its path identically.
+            state["hashRate"]["lazy"] = self.hRate.getSpec()
+        else:
+            arrays["hashTimes"] = self.hRate.timeArray
+            arrays["hashValues"] = self.hRate.valueArray
+        if(self.metrics != None):
+            arrays["metricsTimestamps"] = numpy.frombuffer(self.metrics.timestamps, dtype=numpy.int64).copy()
+            arrays["metricsDifficulties"] = numpy.frombuffer(self.metrics.difficulties).copy()
+        writeCheckpoint(fileName, state, arrays)
+        self.lastCheckpoint = self.clock
+        self.printToLog("Checkpoint written to " + str(fileName) + " at time " + str(self.clock) + " and block height " + str(len(bc.timeChain)) + ".")
+
+###########################################################
+
+def simulationFromCheckpoint(fileName, hr=None, maxTime=None):
+    """ Rebuild the simulation saved in fileName, optionally with another hash rate or maxTime. """
+    state, arrays = readCheckpoint(fileName)
+    newHashRate = (hr != None)
+    if(hr == None):
+        saved = state["hashRate"]
+        if("lazy" in saved):
+            hr = makeLazyHashRate(saved["lazy"])
+        else:
+            hr = hashRate([arrays["hashTimes"].tolist(), arrays["hashValues"].tolist(), saved["description"], saved["maxTime"]])
+        hr.cursor = saved["cursor"]
+    if(maxTime == None):
+        maxTime = state["maxTime"]
+    s = simulation([maxTime, state["lambdaTarget"], state["diffForm"], state["startingDifficulty"], state["difficultyAdjustmentPeriod"], state["diffSampleSize"], state["timeSampleSize"], hr, state["seed"], state["windowOnly"]])
+    for name in ["clock", "work", "epochLeap", "integratedArrivals", "outputFileName", "outputFormat", "checkpointFileName", "checkpointInterval", "collectMetrics"]:
+        setattr(s, name, state[name])
+    if(state["metrics"] != None):
+        s.metrics = onlineMetrics(hr, s.lambdaTarget)
+        s.metrics.setState(state["metrics"], arrays["metricsTimestamps"].tolist(), arrays["metricsDifficulties"].tolist())
+    s.lastCheckpoint = s.clock
+    s.pendingBlock = state.get("pendingBlock")
+    if(newHashRate): # A block drawn under the saved hash rate means nothing under another one
+        s.discardPendingBlock()
+    if(state["rng"].get("antithetic")):
+        s.rng = antitheticStream(s.seed)
+    s.setTimestampPolicy(state["timestampPolicy"], state["timestampPolicyParams"])
+    s.timestampPolicy.setState(state["timestampPolicyState"])
+
+    bc = s.bChain
+    bc.chain.load(state["chainLength"], arrays["chainTimes"].tolist(), arrays["chainDifficulties"].tolist())
+    bc.chain.streamed = state["streamedBlocks"]
+    bc.nextDifficulty = state["nextDifficulty"]
+    bc.rejectedBlocks = state["rejectedBlocks"]
+    bc.rebuildWindows()
+
+    s.rng.setState(state["rng"])
+    s.setBlockArrivalRate()
+    return s
+
+def resumeSimulation(fileName):
+    """ Continue the run checkpointed in fileName: runSim() on the result finishes it exactly as
+    the original run would have, appending to its streamed output if there was any. """
+    return simulationFromCheckpoint(fileName)
+
+def forkSimulations(fileName, n, seed=None, hr=None, maxTime=None):
+    """ Start n independent runs from the state saved in fileName, e.g. a chain that has already
+    reached equilibrium, so they skip the burn-in. Each fork draws from its own child of
+    randomStream(seed), and may be given a new hash rate scenario and maxTime. Forks keep the
+    saved chain but no checkpoints, and their sinks (npy output, online metrics) only see the
+    blocks they add themselves, so the burn-in stays out of their results. """
+    streams = randomStream(seed).spawn(n)
+    forks = []
+    for stream in streams:
+        s = simulationFromCheckpoint(fileName, hr, maxTime)
+        s.seed = seed
+        s.rng = stream
+        s.setTimestampPolicy()
+        s.discardPendingBlock() # Drawn from the saved stream, which the forks do not share
+        s.checkpointFileName = None
+        s.metrics = None
+        s.bChain.chain.streamed = len(s.bChain.timeChain)
+        forks.append(s)
+    return forks
+
 #####################EOF###################################
@@ -1,8 +1,16 @@
+"""
+Command line entry point: python simulator.py [scenario.json|scenario.toml ...] runs the scenarios
+(see scenario.py) one after the other, or the example run of Constants.py without any.
+Importing this module runs nothing.
+"""
 from Constants import *
 from hashRate import *
 from blockChain import *
 from simulation import *
+from scenario import *
 
+import argparse
+import json
 import random
 import operator as op
 import functools
@@ -42,10 +50,27 @@ def make_sure_path_exists(self, path):
     
 ###########################################################
 
-fifths = MAX_RUN_TIME*0.2
-thisTime = [0.0, 1.0*fifths, 2.0*fifths, 3.0*fifths, 4.0*fifths, 5.0*fifths]
-theseValues = [10.0, 20.0, 40.0, 80.0, 100.0]
-thisHashRate = hashRate([thisTime,theseValues,DESC_EXAMPLE,MAX_RUN_TIME])
+def exampleParams():
+    """ The params of the example run: the hash rate steps up five times over MAX_RUN_TIME. """
+    fifths = MAX_RUN_TIME*0.2
+    thisTime = [0.0, 1.0*fifths, 2.0*fifths, 3.0*fifths, 4.0*fifths, 5.0*fifths]
+    theseValues = [10.0, 20.0, 40.0, 80.0, 100.0]
+    thisHashRate = hashRate([thisTime,theseValues,DESC_EXAMPLE,MAX_RUN_TIME])
+    return [MAX_RUN_TIME, LAMBDA_TARGET, DIFFICULTY_FORMULA, STARTING_DIFFICULTY, DIFF_ADJ_PERIOD, DIFF_SAMPLE_SIZE, TIME_SAMPLE_SIZE, thisHashRate]
 
-params = [MAX_RUN_TIME, LAMBDA_TARGET, DIFFICULTY_FORMULA, STARTING_DIFFICULTY, DIFF_ADJ_PERIOD, DIFF_SAMPLE_SIZE, TIME_SAMPLE_SIZE, thisHashRate]
-letsGetThisPartyStarted(params) 
+###########################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the simulations described by scenario files, or the example run without any.")
+    parser.add_argument("scenarios", nargs="*", help="JSON or TOML scenario files, see scenario.py")
+    parser.add_argument("--summary", action="store_true", help="print the summary of every run as a line of JSON")
+    args = parser.parse_args()
+
+    if(not args.scenarios):
+        letsGetThisPartyStarted(exampleParams())
+    for fileName in args.scenarios:
+        s = runScenario(loadScenario(fileName))
+        if(args.summary):
+            print(json.dumps(dict(s.getSummary(), scenario=fileName)))
+
+#####################EOF###################################
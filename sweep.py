@@ -0,0 +1,192 @@
+"""
+Parallel parameter sweeps over a process pool.
+
+A sweep grid is a dictionary mapping simulation parameter names to lists of values, e.g.
+
+    grid = {"diffForm": ["bitmonero", "other"],
+            "diffSampleSize": [72, 720],
+            "difficultyAdjustmentPeriod": [1, 36],
+            "lambdaTarget": [1.0/60.0, 1.0/120.0],
+            "hashRate": [[[0.0, 1.0e6, 2.0e6], [100.0, 200.0], "Step"], ...]}
+
+Each combination of values (the Cartesian product of the lists) is one cell, and parameters
+missing from the grid take their default from Constants.py. The names are those of the
+simulation params list: maxTime, lambdaTarget, diffForm, nextDifficulty,
+difficultyAdjustmentPeriod, diffSampleSize, timeSampleSize, hashRate and seed, where a hashRate
+is given in any form scenario.py accepts: [time, values, description], a table with the keys
+time, values and description, or a lazy hash rate {"lazy": name, "params": [...]} with optional
+seed and chunkSegments. The summary table shows a hash rate by its description, or a lazy one
+by its name, parameters and seed. (As everywhere else, the "bitcoin" and "bitmonero"
+formulas use their own sample sizes whatever the grid says.)
+
+runSweep fans the cells out over a multiprocessing.Pool. Every cell runs in its own directory,
+outputDirectory/runNNNNN/, with its own logs/ (and output.csv if writeOutput is set), so runs no
+longer overwrite each other's data/output.csv and log files. The summary of each run, i.e.
+simulation.getSummary() together with the parameters of its cell and its wall time, is gathered
+into one table, which is returned and written to outputDirectory/summary.csv. Every run collects
+onlineMetrics, and unless writeOutput is set it keeps only its difficulty window in memory.
+
+From the shell, python sweep.py grid.json [-o outputDirectory] [-p processes] runs the grid
+stored in a JSON (or, ending in .toml, TOML) file. With --cache cache, cells with a seed are looked up in
+(and added to) a resultCache, so adding cells to a grid only simulates the new ones; their rows
+say whether they were cached.
+
+Cells are built by scenario.makeSimulation. Where the platform has it, workers come from a
+forkserver that has already imported the simulation modules, so a worker starts in
+milliseconds, and since logs are only opened when written to, it creates no files until its
+run logs something.
+"""
+from hashRate import *
+from blockChain import *
+from simulation import *
+from simLog import *
+from scenario import *
+from resultCache import *
+from Constants import *
+
+import argparse
+import csv
+import errno
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+SWEEP_PARAMETERS = ["maxTime", "lambdaTarget", "diffForm", "nextDifficulty", "difficultyAdjustmentPeriod", "diffSampleSize", "timeSampleSize", "hashRate", "seed"]
+
+###########################################################
+
+def defaultCell():
+    """ The default value of every parameter a grid may sweep over. """
+    return dict((name, value) for name, value in defaultScenario().items() if name in SWEEP_PARAMETERS)
+
+def expandGrid(grid):
+    """ Return the list of cells (complete parameter dictionaries) spanned by grid. """
+    for name in grid:
+        if(name not in SWEEP_PARAMETERS):
+            raise ValueError("Unknown sweep parameter " + str(name) + ", expected one of " + str(SWEEP_PARAMETERS))
+    names = [name for name in SWEEP_PARAMETERS if name in grid]
+    cells = []
+    for values in itertools.product(*[grid[name] for name in names]):
+        cell = defaultCell()
+        cell.update(zip(names, values))
+        cells.append(cell)
+    return cells
+
+def makeCellSimulation(cell, windowOnly=False):
+    """ Build the simulation object described by a cell. """
+    return makeSimulation(dict(cell, windowOnly=windowOnly))
+
+def describeCell(cell):
+    """ Flat, table friendly version of a cell: the hash rate is represented by its description,
+    or for a lazy hash rate by its name, parameters and seed. """
+    row = dict(cell)
+    spec = cell["hashRate"]
+    if(not isinstance(spec, dict)):
+        row["hashRate"] = spec[2]
+    elif("lazy" in spec):
+        row["hashRate"] = str(spec["lazy"]) + " " + str(spec.get("params", []))
+        if(spec.get("seed") != None):
+            row["hashRate"] = row["hashRate"] + " seed " + str(spec["seed"])
+    else:
+        row["hashRate"] = spec.get("description", DESC_EXAMPLE)
+    return row
+
+###########################################################
+
+def exportChain(chainDirectory, outputFileName):
+    """ Write the chain of a cached run, an npy output directory, to a cell's output file in the
+    output format of simulation. """
+    try:
+        os.makedirs(os.path.dirname(outputFileName))
+    except OSError as exception:
+        if exception.errno != errno.EEXIST:
+            raise
+    if(simulation.outputFormat == "text"):
+        exportText(chainDirectory, outputFileName)
+    else:
+        shutil.copytree(chainDirectory, outputFileName, dirs_exist_ok=True)
+
+def runCell(job):
+    """ Run one cell in its own directory and return its row of the summary table. Runs in a
+    worker process, so everything it needs comes in through job. """
+    index, cell, outputDirectory, writeOutput, cacheDirectory = job
+    runDirectory = os.path.join(outputDirectory, "run" + str(index).zfill(5))
+    setLogDirectory(os.path.join(runDirectory, "logs"))
+    outputFileName = os.path.join(runDirectory, "output.csv" if simulation.outputFormat == "text" else "output")
+
+    start = time.time()
+    row = {"run": index}
+    row.update(describeCell(cell))
+    # Without output nothing needs the chain, so only the difficulty window is kept and the
+    # summary comes from the online metrics.
+    scenario = dict(cell, windowOnly=not writeOutput, collectMetrics=True, verbose=False, outputFileName=None)
+    if(cacheDirectory != None and runKey(scenario) != None):
+        copyChain = lambda chainDirectory: exportChain(chainDirectory, outputFileName)
+        summary, chainDirectory, row["cached"] = resultCache(cacheDirectory).run(scenario, storeChain=writeOutput, copyChain=copyChain)
+    else:
+        s = makeSimulation(scenario)
+        if(writeOutput):
+            s.outputFileName = outputFileName
+        s.runSim()
+        summary = s.getSummary()
+    row.update(summary)
+    row["wallTime"] = time.time() - start
+    # Pool workers may be torn down without running atexit handlers.
+    closeAllLogs()
+    return row
+
+def writeSummary(rows, fileName):
+    """ Write the rows of a summary table to a comma-separated file. """
+    columns = []
+    for row in rows:
+        columns.extend([name for name in row if name not in columns])
+    with open(fileName, "w", newline="") as w:
+        writer = csv.DictWriter(w, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def poolContext():
+    """ multiprocessing context of the workers: a forkserver preloading this module (and with it
+    the whole simulation) where there is one, the platform's default otherwise. """
+    if("forkserver" not in multiprocessing.get_all_start_methods()):
+        return multiprocessing.get_context()
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["sweep"])
+    return context
+
+def runSweep(grid, outputDirectory=SWEEP_DIRECTORY, processes=None, writeOutput=False, cacheDirectory=None):
+    """ Run every cell of grid over a pool of processes (one per core by default; processes=1
+    runs them in this process) and return the summary table as a list of dictionaries. With a
+    cacheDirectory, seeded cells already in that resultCache are not simulated again. """
+    try:
+        os.makedirs(outputDirectory)
+    except OSError as exception:
+        if exception.errno != errno.EEXIST:
+            raise
+
+    jobs = [(index, cell, outputDirectory, writeOutput, cacheDirectory) for index, cell in enumerate(expandGrid(grid))]
+    if(processes == 1):
+        rows = [runCell(job) for job in jobs]
+    else:
+        with poolContext().Pool(processes) as pool:
+            rows = list(pool.imap_unordered(runCell, jobs))
+    rows.sort(key=lambda row: row["run"])
+    writeSummary(rows, os.path.join(outputDirectory, "summary.csv"))
+    return rows
+
+###########################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a parameter sweep stored in a JSON or TOML file.")
+    parser.add_argument("grid", help="JSON or TOML file holding the sweep grid")
+    parser.add_argument("-o", "--output", default=SWEEP_DIRECTORY, help="directory for runs and summary.csv")
+    parser.add_argument("-p", "--processes", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--write-output", action="store_true", help="also write every run's output.csv")
+    parser.add_argument("--cache", default=None, help="result cache directory, e.g. " + RESULT_CACHE_DIRECTORY + ", to reuse seeded runs already simulated")
+    args = parser.parse_args()
+    grid = readDocument(args.grid)
+    rows = runSweep(grid, args.output, args.processes, args.write_output, args.cache)
+    print("Ran " + str(len(rows)) + " cells, summary written to " + os.path.join(args.output, "summary.csv"))
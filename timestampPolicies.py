@@ -0,0 +1,178 @@
+"""
+Registry of timestamp policies: how the miner who finds a block stamps it.
+
+A block found at (simulated, true) time clock does not have to carry clock as its timestamp.
+The network only ignores a block if its timestamp is at or below the median of the last
+timeSampleSize timestamps, or more than MAX_FUTURE_BLOCK_TIME seconds ahead of network time
+(see blockChain.submitBlock). A policy chooses the timestamp within, or outside, those bounds:
+
+    ~ stamp(clock, bc) returns the integer timestamp of a block found at clock on top of the
+      blockChain bc; bc.medianTimestamp() is the median the stamp has to beat;
+    ~ stamps(arrivals, bc) is the bulk version for a run of arrival times, used by epoch leaps
+      of policies with bulkStamps set. It may stamp only the first few arrivals, and its
+      stamps are checked with blockChain.validTimestampCount, so it need not handle the blocks
+      that would need a second look, e.g. honest ones that have to be pushed above the median;
+      the leap stops short of them and they are stamped one at a time as they arrive. skip(n) then
+      consumes whatever randomness the first n stamps used;
+    ~ randomized policies get their own randomStream, a child of the simulation's, so
+      attacking does not change the arrival times of the blocks.
+
+Shipped policies, with their positional params:
+    ~ "honest": ceil(clock), or the median plus one if that is not above it, which is what
+      real mining software does;
+    ~ "skewed" [offset]: honest, but with a clock offset seconds off. Stamps more than
+      MAX_FUTURE_BLOCK_TIME ahead get their blocks ignored;
+    ~ "forward" [share]: an attacker finding a fraction share of the blocks stamps each of them
+      as far ahead as the network allows; the other miners are honest;
+    ~ "backward" [share]: the attacker stamps each of its blocks as far back as the network
+      allows, the median plus one.
+
+Policies register themselves by name with registerTimestampPolicy, and makeTimestampPolicy
+builds one by name.
+"""
+from Constants import *
+
+import math
+import numpy
+
+TIMESTAMP_POLICIES = {}
+
+def registerTimestampPolicy(policyClass):
+    """ Class decorator adding a timestamp policy to the registry under its name. """
+    TIMESTAMP_POLICIES[policyClass.name] = policyClass
+    return policyClass
+
+def makeTimestampPolicy(name, params=None, rng=None):
+    """ Return the policy registered as name, or None if there is no such policy. """
+    if(name not in TIMESTAMP_POLICIES):
+        return None
+    return TIMESTAMP_POLICIES[name](params, rng)
+
+###########################################################
+
+class timestampPolicy:
+    """ Base class of all timestamp policies; stamps blocks honestly. """
+
+    name = None
+    randomized = False # True if the policy needs an rng of its own
+    bulkStamps = False # True if stamps() can stamp runs of blocks for epoch leaps
+
+    def __init__(self, params=None, rng=None):
+        self.params = list(params or [])
+        self.rng = rng
+
+    def honestStamp(self, clock, median):
+        timeStamp = int(math.ceil(clock))
+        if(median != None and timeStamp <= median):
+            timeStamp = median + 1
+        return timeStamp
+
+    def stamp(self, clock, bc):
+        return self.honestStamp(clock, bc.medianTimestamp())
+
+    def stamps(self, arrivals, bc):
+        return None
+
+    def skip(self, n):
+        if(self.rng != None):
+            self.rng.skip(n)
+
+    def getState(self):
+        """ JSON-friendly state for checkpoints: the state of the policy's rng, if any. """
+        if(self.rng == None):
+            return None
+        return self.rng.getState()
+
+    def setState(self, state):
+        if(state != None):
+            self.rng.setState(state)
+
+###########################################################
+
+@registerTimestampPolicy
+class honestPolicy(timestampPolicy):
+    """ The time the block was found, rounded up, and never at or below the median. """
+
+    name = "honest"
+    bulkStamps = True
+
+    def stamps(self, arrivals, bc):
+        return numpy.ceil(arrivals).astype(numpy.int64)
+
+@registerTimestampPolicy
+class skewedPolicy(timestampPolicy):
+    """ Honest stamps from a clock that is off by offset seconds. """
+
+    name = "skewed"
+    bulkStamps = True
+
+    def __init__(self, params=None, rng=None):
+        timestampPolicy.__init__(self, params, rng)
+        self.offset = float(self.params[0]) if self.params else TIMESTAMP_SKEW
+
+    def stamp(self, clock, bc):
+        return self.honestStamp(clock + self.offset, bc.medianTimestamp())
+
+    def stamps(self, arrivals, bc):
+        return numpy.ceil(arrivals + self.offset).astype(numpy.int64)
+
+###########################################################
+
+class attackPolicy(timestampPolicy):
+    """ Each block is the attacker's with probability share, decided with an Exp(1) draw:
+    P(Exp(1) > -log(share)) = share. The attacker stamps its blocks with attackStamp, given the
+    median timestamp they have to beat. """
+
+    randomized = True
+    bulkStamps = True
+
+    def __init__(self, params=None, rng=None):
+        timestampPolicy.__init__(self, params, rng)
+        self.share = float(self.params[0]) if self.params else TIMESTAMP_ATTACKER_SHARE
+        self.threshold = -math.log(self.share) if self.share > 0.0 else math.inf
+
+    def stamp(self, clock, bc):
+        if(self.rng.exponential() > self.threshold):
+            return self.attackStamp(clock, bc.medianTimestamp())
+        return self.honestStamp(clock, bc.medianTimestamp())
+
+    def stamps(self, arrivals, bc):
+        # Every stamp may move the median the next one depends on, so they are worked out in
+        # turn on a copy of the chain's median window; still much cheaper than a step per block.
+        window = bc.timestampWindow.copy()
+        attack = self.rng.peekExponentials(len(arrivals)) > self.threshold
+        result = []
+        for attacker, clock in zip(attack.tolist(), arrivals.tolist()):
+            median = window.median()
+            if(attacker):
+                timeStamp = self.attackStamp(clock, median)
+            else:
+                timeStamp = self.honestStamp(clock, median)
+            window.push(timeStamp)
+            result.append(timeStamp)
+        return numpy.array(result, dtype=numpy.int64)
+
+    def attackStamp(self, clock, median):
+        raise NotImplementedError("Timestamp policy " + str(self.name) + " has no attack.")
+
+@registerTimestampPolicy
+class forwardPolicy(attackPolicy):
+    """ The attacker stamps its blocks MAX_FUTURE_BLOCK_TIME ahead of the time they were found. """
+
+    name = "forward"
+
+    def attackStamp(self, clock, median):
+        return int(math.floor(clock)) + MAX_FUTURE_BLOCK_TIME
+
+@registerTimestampPolicy
+class backwardPolicy(attackPolicy):
+    """ The attacker stamps its blocks with the smallest valid timestamp, the median plus one. """
+
+    name = "backward"
+
+    def attackStamp(self, clock, median):
+        if(median == None):
+            return int(math.ceil(clock))
+        return median + 1
+
+#####################EOF###################################
@@ -0,0 +1,144 @@
+"""
+Incremental sliding-window estimator for the trimmed "bitmonero" difficulty formula.
+
+blockChain.setNextDifficulty, for the bitmonero formula, takes the last diffSampleSize blocks,
+sorts their timestamps, trims toSlice outliers from the top and the bottom, and divides the sum
+of the (chronologically) middle difficulties by the span of the middle timestamps. Doing that
+from scratch costs a slice, a sort and a sum over the whole window for every block.
+
+A trimmedWindow keeps the same quantities up to date as blocks enter and leave the window:
+    ~ a sorted list of the timestamps in the window, maintained by bisection, so the trimmed
+      span is just sortedTimes[w-1-toSlice] - sortedTimes[toSlice];
+    ~ a deque of the window in chronological order, whose middle positions toSlice, ...,
+      w-1-toSlice are summed by sum() when the formula asks for them.
+
+Locating a timestamp costs O(log w) and the insertion and removal themselves are a single
+memmove, so the sort is gone. Timestamps are integers, so spans are exact. Difficulties are
+floats, and the direct formula adds them left to right, rounding after every addition; no
+running sum updated by one element leaving and one entering reproduces those roundings, so the
+middle sum is taken afresh over the deque, once per block and in C, and is the direct formula's
+bit for bit.
+
+A slidingMedian applies the same idea to the timestamp rule: a block is only valid if its
+timestamp is above the median of the last timeSampleSize timestamps, and that median is read
+off a bisection-sorted window rather than a fresh sort of the window for every block.
+"""
+from Constants import *
+
+import bisect
+import collections
+import itertools
+import math
+
+
+class trimmedWindow:
+    """ Window of the last windowSize (timestamp, difficulty) pairs with a sort-free trimmed formula. """
+
+    ## Class attributes ##
+    ## These cause the default values of specific instances of this class.
+
+    windowSize = DIFF_SAMPLE_SIZE
+
+    ###########################################################
+
+    def __init__(self, windowSize=None, toSlice=None):
+        if(windowSize != None):
+            self.windowSize = windowSize
+        if(toSlice == None):
+            # Same trim as blockChain.setNextDifficulty uses for the bitmonero formula.
+            toSlice = int(math.floor(1.0/12.0*float(self.windowSize)))
+        self.toSlice = toSlice
+        self.times = collections.deque()
+        self.difficulties = collections.deque()
+        self.sortedTimes = []
+        self.middleSum = None # Sum of the middle difficulties, None until asked for
+
+    ###########################################################
+
+    def isFull(self):
+        return len(self.times) == self.windowSize
+
+    def push(self, timestamp, difficulty):
+        """ Add the newest block to the window, evicting the oldest one if the window is full. """
+        bisect.insort(self.sortedTimes, timestamp)
+        self.times.append(timestamp)
+        self.difficulties.append(difficulty)
+        self.middleSum = None
+        if(len(self.times) > self.windowSize):
+            self.difficulties.popleft()
+            del self.sortedTimes[bisect.bisect_left(self.sortedTimes, self.times.popleft())]
+
+    ###########################################################
+
+    def span(self):
+        """ Latest minus earliest timestamp in the window. """
+        return self.sortedTimes[-1] - self.sortedTimes[0]
+
+    def trimmedSpan(self):
+        """ Span of the timestamps left after trimming toSlice from either end of the sorted window. """
+        return self.sortedTimes[len(self.sortedTimes)-1-self.toSlice] - self.sortedTimes[self.toSlice]
+
+    def cumulativeDifficulty(self):
+        """ Sum of all difficulties in the window. """
+        return sum(self.difficulties)
+
+    def trimmedCumulativeDifficulty(self):
+        """ Sum of the chronologically middle difficulties, positions toSlice to w-1-toSlice,
+        added left to right as sum(difficulties[toSlice:w-toSlice]) does. """
+        if(self.middleSum == None):
+            self.middleSum = sum(itertools.islice(self.difficulties, self.toSlice, len(self.difficulties)-self.toSlice))
+        return self.middleSum
+
+###########################################################
+
+class slidingMedian:
+    """ Window of the last windowSize timestamps with an O(1) median. """
+
+    ## Class attributes ##
+    ## These cause the default values of specific instances of this class.
+
+    windowSize = TIME_SAMPLE_SIZE
+
+    ###########################################################
+
+    def __init__(self, windowSize=None):
+        if(windowSize != None):
+            self.windowSize = windowSize
+        self.times = collections.deque()
+        self.sortedTimes = []
+
+    ###########################################################
+
+    def push(self, timestamp):
+        """ Add the newest timestamp to the window, evicting the oldest one if the window is full. """
+        bisect.insort(self.sortedTimes, timestamp)
+        self.times.append(timestamp)
+        if(len(self.times) > self.windowSize):
+            del self.sortedTimes[bisect.bisect_left(self.sortedTimes, self.times.popleft())]
+
+    def extend(self, timestamps):
+        """ push every timestamp of a list in turn; a list longer than the window replaces it. """
+        if(len(timestamps) >= self.windowSize):
+            self.times = collections.deque(timestamps[len(timestamps)-self.windowSize:])
+            self.sortedTimes = sorted(self.times)
+        else:
+            for timestamp in timestamps:
+                self.push(timestamp)
+
+    def copy(self):
+        result = slidingMedian(self.windowSize)
+        result.times = collections.deque(self.times)
+        result.sortedTimes = list(self.sortedTimes)
+        return result
+
+    def median(self):
+        """ Median timestamp of the window, rounded down between the middle two of an even
+        window as the CryptoNote reference code does, or None for an empty window. """
+        n = len(self.sortedTimes)
+        if(n == 0):
+            return None
+        if(n % 2 == 1):
+            return self.sortedTimes[n//2]
+        return (self.sortedTimes[n//2-1] + self.sortedTimes[n//2])//2
+
+#####################EOF###################################